@@ -0,0 +1,144 @@
+"""
+Admission control for the PDF service endpoints.
+
+Each endpoint gets its own limiter with a fixed number of concurrent
+slots and a bounded wait queue. When every slot is busy and the queue
+is full, new requests are shed immediately with a 503 and a
+``Retry-After`` header instead of piling up until the caller times out.
+
+Limits are configured per endpoint through environment variables, e.g.
+``HTML_TO_PDF_CONCURRENCY=2`` and ``HTML_TO_PDF_QUEUE=8``.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from config import env_int
+
+
+# ---------------------------------------------------------------------------
+# Limiter
+# ---------------------------------------------------------------------------
+
+class EndpointLimiter:
+    """Concurrency limit + bounded FIFO wait queue for one endpoint."""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, retry_after: int):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.retry_after = max(1, retry_after)
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _shed(self):
+        self.rejected += 1
+        raise HTTPException(
+            status_code=503,
+            detail=f"{self.name} is overloaded, retry later",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    async def acquire(self):
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._shed()
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except BaseException:
+            if fut in self._waiters:
+                self._waiters.remove(fut)
+            elif fut.done() and not fut.cancelled():
+                # Slot was handed to us just as we were cancelled — pass it on
+                self.release()
+            raise
+        self.admitted += 1
+
+    def release(self):
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                # Hand the slot straight to the next waiter; active stays the same
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "utilization": round(self.active / self.max_concurrent, 3),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Per-endpoint registry
+# ---------------------------------------------------------------------------
+
+# endpoint -> (env prefix, default concurrency, default queue)
+_DEFAULTS = {
+    "generate-booking": ("GENERATE_BOOKING", 4, 16),
+    "generate-booking-html": ("GENERATE_BOOKING_HTML", 2, 8),
+    "detect-fields": ("DETECT_FIELDS", 4, 8),
+    "detect-fields-batch": ("DETECT_FIELDS_BATCH", 1, 4),
+    "html-to-pdf": ("HTML_TO_PDF", 2, 8),
+    "html-to-pdf-batch": ("HTML_TO_PDF_BATCH", 1, 4),
+    "extract-text": ("EXTRACT_TEXT", 4, 16),
+    "bundle": ("BUNDLE", 2, 8),
+}
+
+RETRY_AFTER_SECONDS = env_int("ADMISSION_RETRY_AFTER", 2)
+
+_limiters: dict[str, EndpointLimiter] = {}
+
+
+def limiter(endpoint: str) -> EndpointLimiter:
+    """Return the (lazily created) limiter for *endpoint*."""
+    lim = _limiters.get(endpoint)
+    if lim is None:
+        prefix, concurrency, queue = _DEFAULTS.get(
+            endpoint, (endpoint.upper().replace("-", "_").replace("/", "_"), 4, 8)
+        )
+        lim = EndpointLimiter(
+            endpoint,
+            env_int(f"{prefix}_CONCURRENCY", concurrency),
+            env_int(f"{prefix}_QUEUE", queue),
+            RETRY_AFTER_SECONDS,
+        )
+        _limiters[endpoint] = lim
+    return lim
+
+
+def snapshot() -> dict:
+    """Queue depth and utilization of every endpoint, for autoscaling."""
+    for endpoint in _DEFAULTS:
+        limiter(endpoint)
+    return {name: lim.stats() for name, lim in sorted(_limiters.items())}
@@ -0,0 +1,319 @@
+"""
+Generate replace-text templates from the Jinja booking renderer.
+
+``replace_text_in_pdf`` is cheap but needs a template PDF plus a
+``field_mapping`` (normally detected by Gemini). ``render_booking_pdf``
+needs no mapping but lays out the whole document with WeasyPrint every
+time. This module joins the two: ``booking_confirmation.html`` is
+rendered once per hotel with a unique sentinel in every guest-specific
+field, so the resulting PDF's ``field_mapping`` is known exactly, and
+each booking afterwards is just a text replacement.
+
+Two things make a WeasyPrint PDF usable as a replace-text template:
+
+- WeasyPrint writes text in Type0 fonts whose character codes are glyph
+  IDs, while ``replace_text`` reads Type0 codes as Unicode. The Type0
+  fonts are therefore rewritten as simple TrueType fonts with
+  WinAnsiEncoding (text re-encoded through their ToUnicode maps), which
+  is the font shape ``replace_text`` already handles best.
+- The template embeds the complete font programs (WeasyPrint
+  ``full_fonts``), so every WinAnsi character a booking needs has its
+  glyph and width. The rewritten fonts are marked with
+  ``replace_text.COMPLETE_FONT`` so ``replace_text`` keeps them rather
+  than swapping in Segoe UI, and a booking made from the template has
+  the same fonts and advances as ``engine="render"``.
+- Every sentinel placed in the HTML is checked to be findable by
+  ``replace_text`` before the template is accepted.
+
+Sentinels for values shown alone in a centered box (day numbers, guest
+and night counts) are short digit strings. ``replace_text`` only
+matches those exactly and re-centers them. Month sentinels are
+uppercase words so they are re-centered too.
+
+Templates are cached in the shared cache (namespace ``booking-template``)
+by hotel data, refund variant and template source.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+from io import BytesIO
+
+import pikepdf
+
+from cache_store import shared_cache
+from generate_booking_html import (
+    _PROBE_BOOKING,
+    _TEMPLATE_DIR,
+    _render_part,
+    build_template_context,
+)
+
+# field_mapping name -> (template context key, sentinel)
+SENTINELS: dict[str, tuple[str, str]] = {
+    "guest_name": ("guest_name", "QGUEST NAMEQ"),
+    "guest_email": ("guest_email", "qguest@sentinel.invalid"),
+    "confirmation_number": ("confirmation_number", "9999.888.777"),
+    "pin_code": ("pin_code", "97531"),
+    "checkin_day": ("checkin_day", "88"),
+    "checkin_month": ("checkin_month", "QXCHECKINQ"),
+    "checkin_weekday": ("checkin_weekday", "QWDAYINQ"),
+    "checkout_day": ("checkout_day", "99"),
+    "checkout_month": ("checkout_month", "QXCHECKOUTQ"),
+    "checkout_weekday": ("checkout_weekday", "QWDAYOUTQ"),
+    "num_nights": ("nights", "66"),
+    "num_guests": ("num_guests", "77"),
+    "num_guests_display": ("your_group", "QGROUPQ"),
+    "price_rooms": ("price_rooms", "11,111"),
+    "price_vat": ("price_vat", "22,222"),
+    "price_total_tl": ("price_total_tl", "33,333"),
+    "price_total_dkk": ("price_total_dkk", "44,444.44"),
+    "cancel_until_date": ("cancel_until_date", "QCANCELUNTILQ"),
+    "cancel_from_date": ("cancel_from_date", "QCANCELFROMQ"),
+    # Digit first: main._format_date_like keeps the "14 May 2026" style
+    "refund_until_date": ("refund_until_date", "9QREFUNDUNTILQ"),
+    "refund_from_date": ("refund_from_date", "9QREFUNDFROMQ"),
+    "refund_amount": ("refund_amount_tl", "55,555.55"),
+}
+
+# "(for N guest)" next to the total repeats num_guests inside a sentence,
+# where a two-digit sentinel cannot be matched. main._build_replacements
+# fills it under this field name.
+_GUEST_NOTE = ("num_guests_note", "(for 77 guest)")
+
+# Kerning and ligatures would split or merge sentinel glyphs
+_SENTINEL_STYLESHEET = "* { font-kerning: none; font-variant-ligatures: none; }"
+
+# Bump to invalidate cached templates when this module changes
+_GENERATOR_VERSION = 2
+
+
+# ---------------------------------------------------------------------------
+# Type0 -> simple TrueType
+# ---------------------------------------------------------------------------
+
+_HEX = re.compile(rb"<([0-9A-Fa-f]+)>")
+
+
+def _utf16(hexstr: bytes) -> str:
+    return bytes.fromhex(hexstr.decode()).decode("utf-16-be", errors="replace")
+
+
+def _parse_tounicode(stream: pikepdf.Stream) -> dict[int, str]:
+    """Character code -> Unicode text from a ToUnicode CMap (bfchar/bfrange)."""
+    data = stream.read_bytes()
+    mapping: dict[int, str] = {}
+    for block in re.findall(rb"beginbfchar(.*?)endbfchar", data, re.S):
+        codes = _HEX.findall(block)
+        for src, dst in zip(codes[::2], codes[1::2]):
+            mapping[int(src, 16)] = _utf16(dst)
+    for block in re.findall(rb"beginbfrange(.*?)endbfrange", data, re.S):
+        for line in block.strip().splitlines():
+            parts = _HEX.findall(line)
+            if len(parts) < 3:
+                continue
+            lo, hi = int(parts[0], 16), int(parts[1], 16)
+            if b"[" in line:
+                for code, dst in zip(range(lo, hi + 1), parts[2:]):
+                    mapping[code] = _utf16(dst)
+            else:
+                base = bytes.fromhex(parts[2].decode())
+                prefix, last = base[:-2], int.from_bytes(base[-2:], "big")
+                for i, code in enumerate(range(lo, hi + 1)):
+                    mapping[code] = (prefix + (last + i).to_bytes(2, "big")).decode("utf-16-be", errors="replace")
+    return mapping
+
+
+def _parse_cid_widths(cid_font) -> tuple[dict[int, float], float]:
+    """CID -> width from a CIDFont's /W array, and its /DW."""
+    widths: dict[int, float] = {}
+    w = list(cid_font.get("/W", []))
+    i = 0
+    while i < len(w):
+        first = int(w[i])
+        if isinstance(w[i + 1], pikepdf.Array):
+            for j, width in enumerate(w[i + 1]):
+                widths[first + j] = float(width)
+            i += 2
+        else:
+            last, width = int(w[i + 1]), float(w[i + 2])
+            for cid in range(first, last + 1):
+                widths[cid] = width
+            i += 3
+    return widths, float(cid_font.get("/DW", 1000))
+
+
+def _simple_font_from_type0(font: pikepdf.Dictionary) -> dict[int, bytes]:
+    """Rewrite *font* in place as a WinAnsi TrueType font.
+
+    Returns the 2-byte CID -> WinAnsi byte map for re-encoding its text.
+    Glyphs without a single WinAnsi character are left out of the map;
+    ``_reencode`` rejects them if the text uses one.
+    """
+    from replace_text import COMPLETE_FONT
+
+    cid_font = font.DescendantFonts[0]
+    to_unicode = _parse_tounicode(font.ToUnicode)
+    cid_widths, default_width = _parse_cid_widths(cid_font)
+
+    codes: dict[int, bytes] = {}
+    widths = [0] * 224   # codes 32..255
+    for cid, text in sorted(to_unicode.items()):
+        if len(text) != 1:
+            continue
+        try:
+            byte = text.encode("cp1252")
+        except UnicodeEncodeError:
+            continue
+        if byte[0] < 32:
+            continue
+        codes[cid] = byte
+        if not widths[byte[0] - 32]:
+            widths[byte[0] - 32] = round(cid_widths.get(cid, default_width))
+
+    descriptor = cid_font.FontDescriptor
+    flags = int(descriptor.get("/Flags", 32))
+    descriptor.Flags = (flags | 32) & ~4   # nonsymbolic
+    base_font = cid_font.BaseFont
+    for key in ("/DescendantFonts", "/ToUnicode", "/Encoding"):
+        if key in font:
+            del font[key]
+    font.Subtype = pikepdf.Name.TrueType
+    font.BaseFont = base_font
+    font.FontDescriptor = descriptor
+    font.Encoding = pikepdf.Name.WinAnsiEncoding
+    font.FirstChar = 32
+    font.LastChar = 255
+    font.Widths = pikepdf.Array(widths)
+    font[COMPLETE_FONT] = True
+    return codes
+
+
+def _reencode(s: pikepdf.String, codes: dict[int, bytes]) -> pikepdf.String:
+    raw = bytes(s)
+    out = bytearray()
+    for i in range(0, len(raw) - 1, 2):
+        cid = int.from_bytes(raw[i:i + 2], "big")
+        if cid not in codes:
+            raise ValueError(f"glyph {cid} has no WinAnsi character; ligatures must be off")
+        out += codes[cid]
+    return pikepdf.String(bytes(out))
+
+
+def _reencode_stream(ops, fonts: dict[str, dict[int, bytes]]):
+    current = None
+    out = []
+    for operands, operator in ops:
+        op = str(operator)
+        if op == "Tf" and operands:
+            current = fonts.get(str(operands[0]))
+        elif current is not None and op in ("Tj", "'", '"') and operands:
+            operands = list(operands)
+            operands[-1] = _reencode(operands[-1], current)
+        elif current is not None and op == "TJ" and operands:
+            operands = [pikepdf.Array(
+                _reencode(item, current) if isinstance(item, pikepdf.String) else item
+                for item in operands[0]
+            )]
+        out.append((operands, operator))
+    return out
+
+
+def simplify_type0_fonts(pdf: pikepdf.Pdf) -> int:
+    """Convert Identity-H Type0 fonts to WinAnsi TrueType; returns how many.
+
+    The fonts are marked ``COMPLETE_FONT``: only call this on PDFs that
+    embed complete font programs.
+    """
+    from replace_text import content_streams
+
+    streams = content_streams(pdf)
+    converted: dict[tuple[int, int], dict[int, bytes]] = {}
+    for content in streams:
+        for font in content.fonts.values():
+            if (
+                font.objgen not in converted
+                and font.get("/Subtype") == pikepdf.Name.Type0
+                and font.get("/Encoding") == pikepdf.Name("/Identity-H")
+            ):
+                converted[font.objgen] = _simple_font_from_type0(font)
+
+    for content in streams:
+        fonts = {name: converted[font.objgen] for name, font in content.fonts.items() if font.objgen in converted}
+        if not fonts:
+            continue
+        data = pikepdf.unparse_content_stream(_reencode_stream(pikepdf.parse_content_stream(content.obj), fonts))
+        if content.is_page:
+            content.obj.Contents = pdf.make_stream(data)
+        else:
+            content.obj.write(data)
+    return len(converted)
+
+
+# ---------------------------------------------------------------------------
+# Template generation
+# ---------------------------------------------------------------------------
+
+def _cache_key(hotel_config: dict, hotel_record: dict, with_refund: bool) -> str:
+    with open(os.path.join(_TEMPLATE_DIR, "booking_confirmation.html"), "rb") as f:
+        template_hash = hashlib.sha256(f.read()).hexdigest()
+    payload = json.dumps(
+        [_GENERATOR_VERSION, template_hash, hotel_config, hotel_record, with_refund],
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def build_sentinel_template(hotel_config: dict, hotel_record: dict, with_refund: bool) -> tuple[bytes, dict]:
+    """Render the sentinel template for one hotel; returns (pdf, field_mapping).
+
+    Runs WeasyPrint in-process; call it from a render worker.
+    """
+    from html_render import render_html
+    from images import optimize_context_images
+    from replace_text import text_runs
+
+    ctx = optimize_context_images(build_template_context(_PROBE_BOOKING, hotel_config, hotel_record))
+    for ctx_key, sentinel in SENTINELS.values():
+        ctx[ctx_key] = sentinel
+    if not with_refund:
+        ctx["refund_amount_tl"] = ""
+    html = _render_part(ctx, "all")
+
+    pdf = pikepdf.open(BytesIO(render_html(html, _SENTINEL_STYLESHEET, full_fonts=True)))
+    simplify_type0_fonts(pdf)
+    runs = text_runs(pdf)
+
+    mapping: dict[str, str] = {}
+    missing = []
+    for field, (_, sentinel) in list(SENTINELS.items()) + [(_GUEST_NOTE[0], (None, _GUEST_NOTE[1]))]:
+        if sentinel not in html:
+            continue   # section not rendered for this hotel / variant
+        if len(sentinel) <= 4:
+            found = any(run.strip() == sentinel for run in runs)
+        else:
+            found = any(sentinel in run for run in runs)
+        if found:
+            mapping[field] = sentinel
+        else:
+            missing.append(field)
+    if missing:
+        raise ValueError(f"Sentinels not findable in rendered template: {', '.join(missing)}")
+
+    out = BytesIO()
+    pdf.save(out)
+    return out.getvalue(), mapping
+
+
+def sentinel_template(hotel_config: dict, hotel_record: dict, with_refund: bool = False) -> tuple[bytes, dict]:
+    """Cached :func:`build_sentinel_template`."""
+    cache = shared_cache()
+    key = _cache_key(hotel_config, hotel_record, with_refund)
+    hit = cache.get("booking-template", key)
+    if hit is not None and hit[1]:
+        return hit[0], hit[1]["field_mapping"]
+    pdf, mapping = build_sentinel_template(hotel_config, hotel_record, with_refund)
+    cache.put("booking-template", key, pdf, {"field_mapping": mapping})
+    return pdf, mapping
@@ -0,0 +1,298 @@
+"""
+Offline bulk generation of booking PDFs from a JSONL file.
+
+For season launches thousands of bookings are regenerated at once.
+Instead of one HTTP round trip per booking, this reads requests in the
+``/generate-booking`` shape (``BookingRequest``), one JSON object per
+line, and runs the same ``_build_replacements`` + ``replace_text``
+pipeline on a process pool across all cores:
+
+    python bulk_generate.py bookings.jsonl --out season-2027/
+    zcat bookings.jsonl.gz | python bulk_generate.py - --out season-2027/
+
+Each line may carry an ``id`` (default: its line number), which names
+the output file ``<id>.pdf``. Requests are grouped by ``template_url``:
+each template is fetched once (through the service's template cache;
+local paths and ``file://`` URLs are read directly) and its bookings
+are sent to the workers in chunks, so a template crosses the process
+boundary once per chunk rather than once per booking.
+
+Every finished booking is appended to ``<out>/manifest.jsonl`` with its
+status, file, size and the confirmation number and PIN it got. Running
+the same command again resumes: bookings whose manifest entry is a
+success and whose file still exists are skipped, failed ones are
+retried. PDFs are written to a temp name and renamed, so an interrupted
+run never leaves a truncated file behind.
+
+Progress (done/total, documents/s, ETA) goes to stderr every few
+seconds, and a summary with overall throughput is printed at the end
+(``--json`` for machine-readable output).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Optional
+from urllib.parse import urlsplit
+
+_MB = 1024 * 1024
+
+
+# ---------------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------------
+
+def _generate_chunk(template_bytes: bytes, items: list[tuple[str, dict]], output_profile: str, out_dir: str) -> list[dict]:
+    """Generate one PDF per ``(id, replacements)`` in *items* into *out_dir*."""
+    from replace_text import replace_text_with_stats
+
+    results = []
+    for doc_id, replacements in items:
+        started = time.perf_counter()
+        path = os.path.join(out_dir, f"{doc_id}.pdf")
+        try:
+            pdf_bytes, output = replace_text_with_stats(template_bytes, replacements, output_profile)
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(pdf_bytes)
+            os.replace(tmp, path)
+            results.append({
+                "id": doc_id, "status": "success", "file": os.path.basename(path),
+                "bytes": output["output_bytes"], "ms": round((time.perf_counter() - started) * 1000, 1),
+            })
+        except Exception as e:
+            results.append({"id": doc_id, "status": "error", "error": f"{type(e).__name__}: {e}"})
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Input, templates, manifest
+# ---------------------------------------------------------------------------
+
+def _read_requests(source: str) -> tuple[list[tuple[str, object]], list[dict]]:
+    """Parse *source* (a path or ``-``) into ``(id, BookingRequest)`` pairs
+    and manifest-style error records for lines that don't validate."""
+    from main import BookingRequest
+
+    stream = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    requests, errors, seen = [], [], set()
+    try:
+        for lineno, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            doc_id = str(lineno)
+            try:
+                payload = json.loads(line)
+                doc_id = str(payload.pop("id", lineno))
+                if doc_id in seen or os.sep in doc_id or doc_id.startswith("."):
+                    raise ValueError(f"id {doc_id!r} is duplicated or not a valid file name")
+                seen.add(doc_id)
+                requests.append((doc_id, BookingRequest(**payload)))
+            except Exception as e:
+                errors.append({"id": doc_id, "line": lineno, "status": "error", "error": f"{type(e).__name__}: {e}"})
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return requests, errors
+
+
+async def _fetch_templates(urls: list[str]) -> dict[str, bytes | Exception]:
+    from main import _fetch_template
+
+    async def fetch(url: str):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            path = parts.path if parts.scheme == "file" else url
+            return await asyncio.to_thread(lambda: open(path, "rb").read())
+        return await _fetch_template(url)
+
+    results = await asyncio.gather(*(fetch(url) for url in urls), return_exceptions=True)
+    return dict(zip(urls, results))
+
+
+def _load_manifest(path: str, out_dir: str) -> set[str]:
+    """Ids already generated by an earlier run."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue   # half-written last line of an interrupted run
+            if entry.get("status") == "success" and os.path.exists(os.path.join(out_dir, entry["file"])):
+                done.add(entry["id"])
+            else:
+                done.discard(entry.get("id"))
+    return done
+
+
+def _end_partial_line(path: str):
+    """Terminate a half-written last line, so the next entry starts a line of its own."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+def _replacements(req) -> tuple[dict[str, str], str, str]:
+    from main import _build_replacements
+
+    conf = req.confirmation_number or f"{random.randint(1000,9999)}.{random.randint(100,999)}.{random.randint(100,999)}"
+    pin = req.pin_code or f"{random.randint(1000,9999)}"
+    return _build_replacements(req, conf, pin), conf, pin
+
+
+class _Progress:
+    def __init__(self, total: int, every_s: float):
+        self.total = total
+        self.every_s = every_s
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self._last = self.started
+
+    def add(self, entry: dict):
+        self.done += 1
+        if entry["status"] == "success":
+            self.bytes += entry["bytes"]
+        else:
+            self.failed += 1
+        now = time.monotonic()
+        if self.every_s and now - self._last >= self.every_s:
+            self._last = now
+            rate = self.done / (now - self.started)
+            eta = (self.total - self.done) / rate if rate else 0
+            print(
+                f"[bulk] {self.done}/{self.total} ({self.failed} failed), {rate:.1f} docs/s, ETA {eta:.0f}s",
+                file=sys.stderr, flush=True,
+            )
+
+
+def run(source: str, out_dir: str, processes: int, chunk_size: int,
+        output_profile: Optional[str], progress_s: float) -> dict:
+    from pdf_output import resolve_profile
+
+    output_profile = resolve_profile(output_profile)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, "manifest.jsonl")
+
+    requests, invalid = _read_requests(source)
+    already = _load_manifest(manifest_path, out_dir)
+    pending = [(doc_id, req) for doc_id, req in requests if doc_id not in already]
+
+    by_template: dict[str, list] = {}
+    for doc_id, req in pending:
+        by_template.setdefault(req.template_url, []).append((doc_id, req))
+    templates = asyncio.run(_fetch_templates(list(by_template)))
+
+    progress = _Progress(len(pending) + len(invalid), progress_s)
+    _end_partial_line(manifest_path)
+    with open(manifest_path, "a", encoding="utf-8") as manifest:
+        def record(entry: dict, extra: Optional[dict] = None):
+            manifest.write(json.dumps({**entry, **(extra or {})}) + "\n")
+            manifest.flush()
+            progress.add(entry)
+
+        for entry in invalid:
+            record(entry)
+
+        # Confirmation numbers/PINs are drawn here so the manifest has them
+        codes: dict[str, dict] = {}
+        chunks = []
+        for url, group in by_template.items():
+            template = templates[url]
+            items = []
+            for doc_id, req in group:
+                if isinstance(template, Exception):
+                    record({"id": doc_id, "status": "error", "error": f"template: {type(template).__name__}: {template}"},
+                           {"template_url": url})
+                    continue
+                try:
+                    replacements, conf, pin = _replacements(req)
+                except Exception as e:
+                    record({"id": doc_id, "status": "error", "error": f"{type(e).__name__}: {e}"}, {"template_url": url})
+                    continue
+                codes[doc_id] = {"template_url": url, "confirmation_number": conf, "pin_code": pin}
+                items.append((doc_id, replacements))
+            for i in range(0, len(items), chunk_size):
+                chunks.append((template, items[i:i + chunk_size]))
+
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {pool.submit(_generate_chunk, template, items, output_profile, out_dir): items
+                       for template, items in chunks}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    items = futures.pop(fut)
+                    try:
+                        entries = fut.result()
+                    except Exception as e:
+                        # The worker itself died; the chunk's bookings are retried on resume
+                        entries = [{"id": doc_id, "status": "error", "error": f"{type(e).__name__}: {e}"}
+                                   for doc_id, _ in items]
+                    for entry in entries:
+                        record(entry, codes[entry["id"]])
+
+    elapsed = time.monotonic() - progress.started
+    return {
+        "total": len(requests) + len(invalid),
+        "skipped": len(requests) - len(pending),
+        "generated": progress.done - progress.failed,
+        "failed": progress.failed,
+        "templates": len(by_template),
+        "processes": processes,
+        "elapsed_s": round(elapsed, 2),
+        "docs_per_s": round((progress.done - progress.failed) / elapsed, 2) if elapsed else 0,
+        "output_mb": round(progress.bytes / _MB, 2),
+        "manifest": manifest_path,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("input", help="JSONL file of BookingRequest objects, or - for stdin")
+    parser.add_argument("--out", required=True, help="directory for the PDFs and manifest.jsonl")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=25, help="bookings per worker task")
+    parser.add_argument("--output-profile", help="pdf_output profile: fast, small or web")
+    parser.add_argument("--progress", type=float, default=5, help="seconds between progress lines (0 = off)")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = run(args.input, args.out, max(1, args.processes), max(1, args.chunk_size),
+                      args.output_profile, args.progress)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(
+            f"{summary['generated']} generated, {summary['failed']} failed, {summary['skipped']} skipped "
+            f"({summary['templates']} templates) in {summary['elapsed_s']} s: "
+            f"{summary['docs_per_s']} docs/s on {summary['processes']} processes, {summary['output_mb']} MB"
+        )
+        print(f"manifest: {summary['manifest']}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
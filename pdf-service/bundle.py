@@ -0,0 +1,123 @@
+"""
+Merge several PDFs into one application dossier.
+
+Documents generated for the same application often embed the same font
+programs over and over: booking PDFs carry the full Segoe UI streams
+injected by ``replace_text._extend_subsetted_fonts`` or the complete
+fonts of their sentinel template. While merging, each embedded font
+program is hashed and byte-identical ones are collapsed onto a single
+stream, so the dossier is much smaller than the sum of its parts.
+
+Only byte-identical programs are merged: full fonts, and subsets made
+from the same template with the same glyphs. Subsets of one font with
+different glyphs, as in WeasyPrint letters with different text, stay
+separate; merging those would mean re-subsetting to the union of their
+glyphs.
+
+Runs inside a worker process (see ``workers``).
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from io import BytesIO
+from typing import Union
+
+import pikepdf
+
+from workers import checkpoint
+
+_FONT_FILE_KEYS = ("/FontFile", "/FontFile2", "/FontFile3")
+
+
+def _open(source: Union[str, bytes]) -> pikepdf.Pdf:
+    if isinstance(source, (bytes, bytearray)):
+        return pikepdf.open(BytesIO(source))
+    return pikepdf.open(source, access_mode=pikepdf.AccessMode.mmap)
+
+
+def _dedupe_font_programs(pdf: pikepdf.Pdf) -> tuple[int, int]:
+    """Point every FontDescriptor at one stream per distinct font program.
+
+    Programs are compared byte for byte, so different subsets of the
+    same font count as distinct. Returns (streams removed, bytes saved). The duplicates become
+    unreferenced and are dropped when the PDF is written.
+    """
+    first_by_hash: dict[str, pikepdf.Stream] = {}
+    seen_streams: set[tuple[int, int]] = set()
+    removed = 0
+    saved = 0
+    for obj in pdf.objects:
+        if not isinstance(obj, pikepdf.Dictionary) or obj.get("/Type") != pikepdf.Name.FontDescriptor:
+            continue
+        for key in _FONT_FILE_KEYS:
+            stream = obj.get(key)
+            if not isinstance(stream, pikepdf.Stream):
+                continue
+            try:
+                data = stream.read_bytes()
+            except pikepdf.PdfError:
+                continue
+            h = hashlib.sha256()
+            h.update(key.encode())
+            h.update(str(stream.get("/Subtype", "")).encode())
+            h.update(data)
+            digest = h.hexdigest()
+            keeper = first_by_hash.get(digest)
+            if keeper is None:
+                first_by_hash[digest] = stream
+                seen_streams.add(stream.objgen)
+                continue
+            if stream.objgen == keeper.objgen:
+                continue
+            obj[pikepdf.Name(key)] = keeper
+            if stream.objgen not in seen_streams:
+                seen_streams.add(stream.objgen)
+                removed += 1
+                saved += len(stream.read_raw_bytes())
+    return removed, saved
+
+
+def build_bundle(sources: list[Union[str, bytes]], out_path: str) -> dict:
+    """Merge *sources* (paths or bytes) in order into *out_path*.
+
+    Returns stats. ``fonts_deduplicated`` is the number of font program
+    streams dropped as byte-identical to one already kept (identical
+    full fonts or identical subsets, see the module docstring), and
+    ``font_bytes_saved`` their size.
+    """
+    started = time.perf_counter()
+    merged = pikepdf.new()
+    opened = []
+    input_bytes = 0
+    try:
+        for source in sources:
+            checkpoint()
+            input_bytes += len(source) if isinstance(source, (bytes, bytearray)) else os.path.getsize(source)
+            src = _open(source)
+            opened.append(src)
+            merged.pages.extend(src.pages)
+
+        removed, saved = _dedupe_font_programs(merged)
+        pages = len(merged.pages)
+        checkpoint()
+        merged.save(
+            out_path,
+            compress_streams=True,
+            object_stream_mode=pikepdf.ObjectStreamMode.generate,
+        )
+    finally:
+        for src in opened:
+            src.close()
+        merged.close()
+
+    return {
+        "documents": len(sources),
+        "pages": pages,
+        "input_bytes": input_bytes,
+        "output_bytes": os.path.getsize(out_path),
+        "fonts_deduplicated": removed,
+        "font_bytes_saved": saved,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
@@ -0,0 +1,336 @@
+"""
+Cache tier shared by every worker process on a node.
+
+Entries live in one SQLite database (``CACHE_DB_PATH``) with
+least-recently-used eviction once the stored values exceed
+``CACHE_MAX_BYTES``. A freshly started worker therefore finds template
+bytes, font metrics, known template fingerprints and detection results
+already warm.
+
+The database is single-host only. SQLite's WAL mode coordinates its
+users through shared memory, so every process using the file must run
+on the same machine: the web process, its workers and any replicas on
+that node. Keep ``CACHE_DB_PATH`` on a local filesystem, never on a
+network volume shared between nodes; each node has its own cache.
+
+A small in-process LRU (``CACHE_MEMORY_BYTES``) sits in front of it for
+hot entries. Another process may replace or delete an entry meanwhile,
+so an LRU hit older than ``CACHE_MEMORY_TTL_S`` is checked against the
+entry's version in SQLite (a cheap indexed read) before it is served.
+
+Every call is blocking SQLite I/O: it can move multi-MB values and wait
+up to the 5 s busy timeout while another process writes. Code on the
+event loop uses the ``a``-prefixed variants (``aget``, ``aput``, ...),
+which run the same call on a thread.
+
+Namespaces in use:
+
+- ``template``     template PDF bytes by URL (meta: etag, fetched_at)
+- ``font``         compiled Segoe UI metrics by font file
+- ``fingerprint``  field patterns of known template structures
+- ``detection``    /detect-fields results by upload SHA-256
+- ``image-src``    hotel image URL -> SHA-256 of the source
+- ``image``        downsampled hotel images by source SHA-256 and box size
+- ``static-pages`` rendered hotel-static booking pages by SHA-256 of their HTML
+- ``llm``          Gemini answers by prompt hash (fallback while it is down)
+- ``booking-template`` sentinel replace-text templates per hotel (meta: field_mapping)
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import env_float, env_int
+
+CACHE_DB_PATH = os.environ.get(
+    "CACHE_DB_PATH", os.path.join(tempfile.gettempdir(), "pdf-service-cache.sqlite3")
+)
+CACHE_MAX_BYTES = env_int("CACHE_MAX_BYTES", 512 * 1024 * 1024)
+CACHE_MEMORY_BYTES = env_int("CACHE_MEMORY_BYTES", 64 * 1024 * 1024)
+CACHE_MEMORY_TTL_S = env_float("CACHE_MEMORY_TTL_S", 5.0)
+
+# Only rewrite last_access when it is older than this, to keep reads cheap
+_TOUCH_INTERVAL = 60.0
+
+
+# ---------------------------------------------------------------------------
+# In-process front
+# ---------------------------------------------------------------------------
+
+class MemoryLRU:
+    """Byte-bounded LRU of ``(namespace, key) -> (value, meta, version, checked_at)``."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, k):
+        with self._lock:
+            item = self._items.get(k)
+            if item is not None:
+                self._items.move_to_end(k)
+            return item
+
+    def put(self, k, value: bytes, meta: Optional[dict], version: int = 0):
+        if len(value) > self.max_bytes // 4:
+            return  # don't let one big entry flush everything else
+        with self._lock:
+            old = self._items.pop(k, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._items[k] = (value, meta, version, time.monotonic())
+            self.size += len(value)
+            self._evict(self.max_bytes)
+
+    def checked(self, k):
+        """Mark the entry as just confirmed current."""
+        with self._lock:
+            item = self._items.get(k)
+            if item is not None:
+                self._items[k] = (*item[:3], time.monotonic())
+
+    def discard(self, k):
+        with self._lock:
+            old = self._items.pop(k, None)
+            if old is not None:
+                self.size -= len(old[0])
+
+    def shrink(self, fraction: float = 0.5):
+        """Drop least-recently-used entries down to *fraction* of the budget."""
+        with self._lock:
+            self._evict(int(self.max_bytes * fraction))
+
+    def _evict(self, limit: int):
+        while self.size > limit and self._items:
+            _, (value, *_) = self._items.popitem(last=False)
+            self.size -= len(value)
+
+
+# ---------------------------------------------------------------------------
+# SQLite tier
+# ---------------------------------------------------------------------------
+
+class SharedCache:
+    def __init__(self, path: str, max_bytes: int, memory_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory = MemoryLRU(memory_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._disabled = False
+        self._puts_since_evict = 0
+
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if self._disabled:
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+                " meta TEXT, size INTEGER NOT NULL, last_access REAL NOT NULL,"
+                " version INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            if "version" not in columns:
+                # Database written before entries had versions
+                conn.execute("ALTER TABLE entries ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.Error as e:
+            print(f"[cache] disabled, cannot open {self.path}: {e}", file=sys.stderr, flush=True)
+            self._disabled = True
+            return None
+        self._local.conn = conn
+        return conn
+
+    def _memory_get(self, conn, namespace: str, key: str) -> Optional[tuple[bytes, Optional[dict]]]:
+        """``(value, meta)`` from the in-process LRU if it is still current."""
+        item = self.memory.get((namespace, key))
+        if item is None:
+            return None
+        value, meta, version, checked_at = item
+        if conn is None or time.monotonic() - checked_at < CACHE_MEMORY_TTL_S:
+            return value, meta
+        try:
+            row = conn.execute(
+                "SELECT version FROM entries WHERE namespace=? AND key=?", (namespace, key)
+            ).fetchone()
+        except sqlite3.Error:
+            return value, meta
+        if row is None or row[0] != version:
+            # Replaced or deleted by another process
+            self.memory.discard((namespace, key))
+            return None
+        self.memory.checked((namespace, key))
+        return value, meta
+
+    def get(self, namespace: str, key: str) -> Optional[tuple[bytes, Optional[dict]]]:
+        """``(value, meta)`` or None."""
+        conn = self._conn()
+        item = self._memory_get(conn, namespace, key)
+        if item is not None:
+            self.hits += 1
+            return item
+        if conn is None:
+            self.misses += 1
+            return None
+        try:
+            row = conn.execute(
+                "SELECT value, meta, last_access, version FROM entries WHERE namespace=? AND key=?",
+                (namespace, key),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if now - row[2] > _TOUCH_INTERVAL:
+                conn.execute(
+                    "UPDATE entries SET last_access=? WHERE namespace=? AND key=?",
+                    (now, namespace, key),
+                )
+        except sqlite3.Error as e:
+            print(f"[cache] get {namespace}/{key[:40]} failed: {e}", file=sys.stderr, flush=True)
+            self.misses += 1
+            return None
+        self.hits += 1
+        value, meta = bytes(row[0]), json.loads(row[1]) if row[1] else None
+        self.memory.put((namespace, key), value, meta, row[3])
+        return value, meta
+
+    def put(self, namespace: str, key: str, value: bytes, meta: Optional[dict] = None):
+        version = time.time_ns()
+        self.memory.put((namespace, key), value, meta, version)
+        conn = self._conn()
+        if conn is None or len(value) > self.max_bytes:
+            return
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, meta, size, last_access, version)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (namespace, key, value, json.dumps(meta) if meta else None, len(value), time.time(), version),
+            )
+            self._puts_since_evict += 1
+            if self._puts_since_evict >= 16 or len(value) > self.max_bytes // 16:
+                self._puts_since_evict = 0
+                self._evict(conn)
+        except sqlite3.Error as e:
+            print(f"[cache] put {namespace}/{key[:40]} failed: {e}", file=sys.stderr, flush=True)
+
+    def touch(self, namespace: str, key: str, meta: dict):
+        """Replace the metadata of an entry without rewriting its value."""
+        version = time.time_ns()
+        item = self.memory.get((namespace, key))
+        if item is not None:
+            self.memory.put((namespace, key), item[0], meta, version)
+        conn = self._conn()
+        if conn is None:
+            return
+        try:
+            conn.execute(
+                "UPDATE entries SET meta=?, last_access=?, version=? WHERE namespace=? AND key=?",
+                (json.dumps(meta), time.time(), version, namespace, key),
+            )
+        except sqlite3.Error:
+            pass
+
+    def delete(self, namespace: str, key: str):
+        self.memory.discard((namespace, key))
+        conn = self._conn()
+        if conn is None:
+            return
+        try:
+            conn.execute("DELETE FROM entries WHERE namespace=? AND key=?", (namespace, key))
+        except sqlite3.Error:
+            pass
+
+    def get_json(self, namespace: str, key: str):
+        item = self.get(namespace, key)
+        return json.loads(item[0]) if item is not None else None
+
+    def put_json(self, namespace: str, key: str, obj):
+        self.put(namespace, key, json.dumps(obj, separators=(",", ":")).encode())
+
+    # Event-loop variants; connections are per thread, so these are safe
+    # to run on any thread of the default executor.
+
+    async def aget(self, namespace: str, key: str) -> Optional[tuple[bytes, Optional[dict]]]:
+        return await asyncio.to_thread(self.get, namespace, key)
+
+    async def aput(self, namespace: str, key: str, value: bytes, meta: Optional[dict] = None):
+        await asyncio.to_thread(self.put, namespace, key, value, meta)
+
+    async def atouch(self, namespace: str, key: str, meta: dict):
+        await asyncio.to_thread(self.touch, namespace, key, meta)
+
+    async def aget_json(self, namespace: str, key: str):
+        return await asyncio.to_thread(self.get_json, namespace, key)
+
+    async def aput_json(self, namespace: str, key: str, obj):
+        await asyncio.to_thread(self.put_json, namespace, key, obj)
+
+    async def astats(self) -> dict:
+        return await asyncio.to_thread(self.stats)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Delete least-recently-used rows until the store is under 90 % of budget."""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        rows = conn.execute("SELECT namespace, key, size FROM entries ORDER BY last_access").fetchall()
+        doomed = []
+        for namespace, key, size in rows:
+            if total <= target:
+                break
+            doomed.append((namespace, key))
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE namespace=? AND key=?", doomed)
+        for k in doomed:
+            self.memory.discard(k)
+
+    def stats(self) -> dict:
+        out = {
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_bytes": self.memory.size,
+            "max_bytes": self.max_bytes,
+        }
+        conn = self._conn()
+        if conn is not None:
+            try:
+                rows = conn.execute(
+                    "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY namespace"
+                ).fetchall()
+                out["namespaces"] = {ns: {"entries": n, "bytes": b} for ns, n, b in rows}
+            except sqlite3.Error:
+                pass
+        return out
+
+
+_cache: Optional[SharedCache] = None
+
+
+def shared_cache() -> SharedCache:
+    global _cache
+    if _cache is None:
+        _cache = SharedCache(CACHE_DB_PATH, CACHE_MAX_BYTES, CACHE_MEMORY_BYTES)
+    return _cache
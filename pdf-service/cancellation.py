@@ -0,0 +1,142 @@
+"""
+Stop working on requests nobody is waiting for any more.
+
+The Next.js callers give up after 30 s. Without this the service would
+still finish every render it had started or queued, and under overload
+most CPU would go to results nobody reads.
+
+``CancellationMiddleware`` runs each request in its own task and cancels
+that task when either of these happens:
+
+- **Client disconnect**: once the request body has been read, the
+  middleware keeps listening on the connection, and an
+  ``http.disconnect`` cancels the handler.
+- **Deadline**: ``X-Request-Timeout-Ms`` (or ``REQUEST_TIMEOUT_S`` for
+  requests that send none) runs out. The handler is cancelled and,
+  if no response has started yet, the client gets a 504.
+
+Cancelling the task unwinds wherever it is waiting. Requests waiting in
+an admission queue or a worker lane leave it without ever starting.
+Jobs already running in a worker process stop at their next checkpoint, see
+``workers.run``.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import sys
+import time
+
+from config import env_float
+
+REQUEST_TIMEOUT_S = env_float("REQUEST_TIMEOUT_S", 0.0)   # 0 = no default deadline
+
+_counts = {"disconnected": 0, "deadline_exceeded": 0}
+
+
+def _timeout_s(headers: list[tuple[bytes, bytes]]) -> float:
+    for name, value in headers:
+        if name == b"x-request-timeout-ms":
+            ms = float(value)
+            if ms <= 0:
+                raise ValueError
+            return ms / 1000
+    return REQUEST_TIMEOUT_S
+
+
+async def _send_json(send, status: int, body: dict):
+    payload = json.dumps(body).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+class CancellationMiddleware:
+    """Cancel the handler on client disconnect or when its deadline passes."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        try:
+            timeout = _timeout_s(scope["headers"])
+        except ValueError:
+            return await _send_json(send, 400, {"detail": "X-Request-Timeout-Ms must be a positive number"})
+
+        body_read = asyncio.Event()
+        disconnected = asyncio.Event()
+        state = {"started": False, "finished": False}
+
+        async def wrapped_receive():
+            if body_read.is_set():
+                # The watcher owns the connection now; report what it sees
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_read.set()
+            return message
+
+        async def wrapped_send(message):
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["finished"] = True
+            await send(message)
+
+        async def watch():
+            await body_read.wait()
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        handler = asyncio.ensure_future(self.app(scope, wrapped_receive, wrapped_send))
+        watcher = asyncio.ensure_future(watch())
+        waiting = {handler, watcher}
+        if timeout:
+            waiting.add(asyncio.ensure_future(asyncio.sleep(timeout)))
+        started = time.monotonic()
+        try:
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            handler.cancel()
+            raise
+        finally:
+            for task in waiting - {handler}:
+                task.cancel()
+
+        if handler in done:
+            return handler.result()
+        if state["finished"]:
+            # The connection closed right after a complete response
+            return await handler
+
+        reason = "disconnected" if watcher in done else "deadline_exceeded"
+        _counts[reason] += 1
+        handler.cancel()
+        try:
+            await handler
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Whatever the handler was doing when cancelled, nobody will read it
+            pass
+        print(
+            f"[cancel] {scope['method']} {scope['path']} {reason} after {time.monotonic() - started:.1f}s",
+            file=sys.stderr, flush=True,
+        )
+        if reason == "deadline_exceeded" and not state["started"]:
+            await _send_json(send, 504, {"detail": "Request deadline exceeded"})
+
+
+def stats() -> dict:
+    return {**_counts, "default_timeout_s": REQUEST_TIMEOUT_S}
@@ -1,41 +1,65 @@
 """
-Auto-detect dynamic fields in a Booking.com confirmation PDF using Gemini.
+Auto-detect dynamic fields in a Booking.com confirmation PDF.
+
+Fields are first picked out by the deterministic rules in
+``detect_rules``. Gemini is only asked about fields that are missing
+or below ``LOCAL_DETECT_MIN_CONFIDENCE``, and only sees the text
+windows around those fields.
+
+``stream_fields_in_text`` is the streaming variant: it reports each
+field as soon as it is known, parsing Gemini's streamed answer with
+``json_stream``.
 """
 import os
+import sys
 import json
-import httpx
-from io import BytesIO
+import asyncio
+from dataclasses import dataclass, field
+from typing import AsyncIterator, BinaryIO, Optional, Union
 from pdfminer.high_level import extract_text
 
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+import llm_client
+from config import env_float, env_int
+from detect_rules import detect_fields_locally, field_present, text_windows
+from json_stream import ObjectStreamParser
+from llm_client import GEMINI_API_KEY, LLMError
+
+LOCAL_DETECT_MIN_CONFIDENCE = env_float("LOCAL_DETECT_MIN_CONFIDENCE", 0.85)
+# Batch detection: prompt size (estimated tokens) and documents per Gemini call
+DETECT_BATCH_MAX_TOKENS = env_int("DETECT_BATCH_MAX_TOKENS", 24000)
+DETECT_BATCH_MAX_DOCUMENTS = env_int("DETECT_BATCH_MAX_DOCUMENTS", 12)
+
+FIELD_DESCRIPTIONS = {
+    "guest_name": 'The guest\'s full name (near "Guest name:", usually UPPERCASE)',
+    "guest_email": "Email address (near bottom of document)",
+    "confirmation_number": "Booking confirmation number (format like XXXX.XXX.XXX)",
+    "pin_code": 'The 4-digit PIN code (after "PIN CODE:")',
+    "checkin_day": 'Check-in day number only (the large number in the date grid, e.g. "14")',
+    "checkin_month": 'Check-in month name (UPPERCASE in date grid, e.g. "MAY")',
+    "checkin_weekday": 'Check-in weekday (e.g. "Thursday")',
+    "checkout_day": "Check-out day number only",
+    "checkout_month": "Check-out month name (UPPERCASE)",
+    "checkout_weekday": "Check-out weekday",
+    "num_nights": "Number of nights (just the digit)",
+    "num_guests": "Number of rooms/guests (just the digit in the date grid)",
+    "num_guests_display": 'Guest count text like "1 adult" or "2 adults"',
+    "price_rooms": 'Room base price in TL (JUST the number with commas, e.g. "10,988")',
+    "price_vat": 'VAT amount in TL (JUST the number, e.g. "2,747")',
+    "price_total_tl": 'Total price in TL (JUST the number, e.g. "13,735")',
+    "price_total_dkk": 'Total price in DKK (JUST the number, e.g. "2,005.20")',
+    "cancel_until_date": 'Full cancellation deadline date text (e.g. "May 11, 2026")',
+    "cancel_from_date": 'Check-in date as it appears in cancellation section (e.g. "May 14, 2026")',
+    "refund_until_date": 'Refund deadline date if present (e.g. "14 May 2026")',
+    "refund_from_date": "Refund from-date if present",
+    "refund_amount": "Refund TL amount if present (just the number)",
+}
 
 DETECTION_PROMPT = """You are analyzing text extracted from a Booking.com hotel confirmation PDF.
 
 Identify all DYNAMIC fields (values that change per booking) and return their EXACT text as found in the document.
 
 Fields to find:
-- guest_name: The guest's full name (near "Guest name:", usually UPPERCASE)
-- guest_email: Email address (near bottom of document)
-- confirmation_number: Booking confirmation number (format like XXXX.XXX.XXX)
-- pin_code: The 4-digit PIN code (after "PIN CODE:")
-- checkin_day: Check-in day number only (the large number in the date grid, e.g. "14")
-- checkin_month: Check-in month name (UPPERCASE in date grid, e.g. "MAY")
-- checkin_weekday: Check-in weekday (e.g. "Thursday")
-- checkout_day: Check-out day number only
-- checkout_month: Check-out month name (UPPERCASE)
-- checkout_weekday: Check-out weekday
-- num_nights: Number of nights (just the digit)
-- num_guests: Number of rooms/guests (just the digit in the date grid)
-- num_guests_display: Guest count text like "1 adult" or "2 adults"
-- price_rooms: Room base price in TL (JUST the number with commas, e.g. "10,988")
-- price_vat: VAT amount in TL (JUST the number, e.g. "2,747")
-- price_total_tl: Total price in TL (JUST the number, e.g. "13,735")
-- price_total_dkk: Total price in DKK (JUST the number, e.g. "2,005.20")
-- cancel_until_date: Full cancellation deadline date text (e.g. "May 11, 2026")
-- cancel_from_date: Check-in date as it appears in cancellation section (e.g. "May 14, 2026")
-- refund_until_date: Refund deadline date if present (e.g. "14 May 2026")
-- refund_from_date: Refund from-date if present
-- refund_amount: Refund TL amount if present (just the number)
+{fields}
 
 Rules:
 - Return the EXACT text as it appears, character for character
@@ -49,32 +73,304 @@ Extracted text:
 ---"""
 
 
-async def detect_booking_fields(pdf_bytes: bytes) -> dict:
+def build_prompt(fields, text: str) -> str:
+    """The detection prompt restricted to *fields*."""
+    lines = "\n".join(f"- {name}: {FIELD_DESCRIPTIONS[name]}" for name in fields)
+    return DETECTION_PROMPT.format(fields=lines, text=text)
+
+
+@dataclass
+class FieldDetection:
+    mapping: dict = field(default_factory=dict)       # field_name -> exact text
+    confidence: dict = field(default_factory=dict)    # field_name -> 0..1
+    sources: dict = field(default_factory=dict)       # field_name -> "local" | "gemini"
+    # Set when Gemini was unavailable: "cache" (an earlier answer to the
+    # same prompt) or "local" (low-confidence local values kept)
+    fallback: Optional[str] = None
+
+
+async def detect_booking_fields(pdf: Union[bytes, str, BinaryIO]) -> dict:
     """
-    Extract text from a Booking.com PDF and use Gemini to identify
-    which text strings correspond to dynamic booking fields.
+    Extract text from a Booking.com PDF and identify which text strings
+    correspond to dynamic booking fields.
+
+    *pdf* is the raw bytes, a file path or a seekable binary stream.
+    Bytes and paths are extracted in the worker pool, long documents
+    split by page range (see ``text_extract``).
 
     Returns a dict of field_name -> exact_text_value.
     """
-    if not GEMINI_API_KEY:
-        raise ValueError("GEMINI_API_KEY not configured")
+    return (await detect_booking_fields_detailed(pdf)).mapping
 
-    text = extract_text(BytesIO(pdf_bytes))
+
+async def detect_booking_fields_detailed(pdf: Union[bytes, str, BinaryIO]) -> FieldDetection:
+    """Like :func:`detect_booking_fields`, with per-field confidence and source."""
+    if isinstance(pdf, (bytes, bytearray, str)):
+        from text_extract import extract_text_parallel
+        text = await extract_text_parallel(pdf)
+    else:
+        text = await asyncio.to_thread(extract_text, pdf)
     if not text or not text.strip():
         raise ValueError("Could not extract text from PDF")
+    return await detect_fields_in_text(text.strip())
+
+
+def _local_pass(text: str) -> tuple[FieldDetection, list[str]]:
+    """Local rule results, and the fields still worth asking Gemini about."""
+    result = FieldDetection()
+    for name, match in detect_fields_locally(text).items():
+        result.mapping[name] = match.value
+        result.confidence[name] = match.confidence
+        result.sources[name] = "local"
+
+    pending = [
+        name for name in FIELD_DESCRIPTIONS
+        if result.confidence.get(name, 0.0) < LOCAL_DETECT_MIN_CONFIDENCE
+        and field_present(name, text)
+    ]
+    if pending and not GEMINI_API_KEY:
+        if not result.mapping:
+            raise ValueError("GEMINI_API_KEY not configured")
+        # Best effort: keep the low-confidence local values
+        pending = []
+    return result, pending
+
+
+def _apply_gemini(result: FieldDetection, name: str, value, text: str) -> bool:
+    if not value:
+        return False
+    result.mapping[name] = value
+    result.confidence[name] = 0.9 if str(value) in text else 0.5
+    result.sources[name] = "gemini"
+    return True
+
+
+async def _fallback(result: FieldDetection, prompt: str, error: LLMError) -> Optional[dict]:
+    """Cached Gemini answer for *prompt*, or None to keep the local values.
+
+    Re-raises *error* when there is nothing at all to fall back to.
+    """
+    cached = await llm_client.cached_response(prompt)
+    if cached is not None:
+        result.fallback = "cache"
+        return cached
+    if not result.mapping:
+        raise error
+    print(f"[detect] Gemini unavailable, keeping local values: {error}", file=sys.stderr, flush=True)
+    result.fallback = "local"
+    return None
+
+
+async def detect_fields_in_text(text: str) -> FieldDetection:
+    """Run local rules on *text*, then ask Gemini only about what they missed."""
+    result, pending = _local_pass(text)
+    if not pending:
+        return result
+
+    prompt = build_prompt(pending, text_windows(pending, text))
+    try:
+        llm_mapping = await ask_gemini(prompt)
+        await llm_client.remember_response(prompt, llm_mapping)
+    except LLMError as e:
+        llm_mapping = await _fallback(result, prompt, e)
+        if llm_mapping is None:
+            return result
+    for name in pending:
+        _apply_gemini(result, name, llm_mapping.get(name), text)
+    return result
 
-    prompt = DETECTION_PROMPT.format(text=text.strip())
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}",
-            json={
-                "contents": [{"parts": [{"text": prompt}]}],
-                "generationConfig": {"temperature": 0.1, "maxOutputTokens": 2048},
-            },
+# ---------------------------------------------------------------------------
+# Batch detection — several documents per Gemini call
+# ---------------------------------------------------------------------------
+
+BATCH_PROMPT = """You are analyzing text extracted from several Booking.com hotel confirmation PDFs.
+
+For EACH document below, identify the listed DYNAMIC fields (values that change per booking) and return their EXACT text as found in that document.
+
+Rules:
+- Return the EXACT text as it appears, character for character
+- For price fields, return ONLY the number part (e.g. "10,988" not "TL 10,988")
+- If a field is not found in a document, omit it
+- Never take a value from a different document
+- Return ONLY valid JSON: one object keyed by document id, each value an object of field -> text, e.g. {{"doc1": {{"pin_code": "1234"}}, "doc2": {{}}}}
+
+{sections}"""
+
+BATCH_SECTION = """=== Document {doc_id} ===
+Fields to find:
+{fields}
+
+Extracted text:
+---
+{text}
+---"""
+
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token for Latin text
+    return len(text) // 4 + 1
+
+
+def _pack(sections: list[tuple[int, str]]) -> list[list[tuple[int, str]]]:
+    """Group (index, section) pairs into as few prompts as the budget allows.
+
+    First-fit decreasing by size; a section over the budget on its own
+    still gets a call to itself.
+    """
+    overhead = _estimate_tokens(BATCH_PROMPT)
+    bins: list[tuple[int, list[tuple[int, str]]]] = []
+    for item in sorted(sections, key=lambda item: -len(item[1])):
+        size = _estimate_tokens(item[1])
+        for i, (used, members) in enumerate(bins):
+            if used + size <= DETECT_BATCH_MAX_TOKENS and len(members) < DETECT_BATCH_MAX_DOCUMENTS:
+                members.append(item)
+                bins[i] = (used + size, members)
+                break
+        else:
+            bins.append((overhead + size, [item]))
+    return [sorted(members) for _, members in bins]
+
+
+async def _detect_group(group, texts, results, pending, prompts) -> None:
+    sections = "\n\n".join(section for _, section in group)
+    try:
+        answer = await ask_gemini(
+            BATCH_PROMPT.format(sections=sections),
+            max_output_tokens=min(8192, 512 * len(group) + 256),
         )
-        resp.raise_for_status()
-        result = resp.json()
+    except LLMError as e:
+        answer, error = {}, e
+    except ValueError as e:
+        # Empty or unparseable answer: each document falls back on its own
+        answer, error = {}, LLMError(f"Unusable batch answer from Gemini: {e}")
+    else:
+        error = None
+    if not isinstance(answer, dict):
+        answer = {}
+
+    for index, _ in group:
+        result = results[index]
+        doc_answer = answer.get(f"doc{index + 1}")
+        if isinstance(doc_answer, dict):
+            await llm_client.remember_response(prompts[index], doc_answer)
+        else:
+            try:
+                doc_answer = await _fallback(
+                    result, prompts[index],
+                    error or LLMError("No section for this document in the batch answer"),
+                )
+            except LLMError as e:
+                results[index] = e
+                continue
+            if doc_answer is None:
+                continue
+        for name in pending[index]:
+            _apply_gemini(result, name, doc_answer.get(name), texts[index])
+
+
+async def detect_fields_batch(texts: list[str]) -> tuple[list[Union[FieldDetection, Exception]], int]:
+    """Detect fields in several documents with as few Gemini calls as possible.
+
+    Local rules run per document. The fields they miss are asked about in
+    one prompt per group of documents, packed within
+    ``DETECT_BATCH_MAX_TOKENS`` and ``DETECT_BATCH_MAX_DOCUMENTS``, with
+    the groups sent concurrently. Returns one ``FieldDetection`` or
+    exception per document, in order, and the number of model calls.
+    Cache and local fallbacks apply per document, as in
+    :func:`detect_fields_in_text`.
+    """
+    results: list[Union[FieldDetection, Exception]] = []
+    pending: list[list[str]] = []
+    prompts: list[str] = []
+    sections: list[tuple[int, str]] = []
+    for index, text in enumerate(texts):
+        try:
+            result, fields = _local_pass(text)
+        except ValueError as e:
+            results.append(e)
+            pending.append([])
+            prompts.append("")
+            continue
+        results.append(result)
+        pending.append(fields)
+        windows = text_windows(fields, text) if fields else ""
+        # The single-document prompt keys the llm cache, shared with /detect-fields
+        prompts.append(build_prompt(fields, windows) if fields else "")
+        if fields:
+            lines = "\n".join(f"- {name}: {FIELD_DESCRIPTIONS[name]}" for name in fields)
+            sections.append((index, BATCH_SECTION.format(doc_id=f"doc{index + 1}", fields=lines, text=windows)))
+
+    groups = _pack(sections)
+    await asyncio.gather(*(_detect_group(group, texts, results, pending, prompts) for group in groups))
+    return results, len(groups)
+
+
+def extract_document_text(source: Union[bytes, str]) -> str:
+    """pdfminer text of *source* (PDF bytes or a file path); picklable for workers."""
+    from text_extract import extract_pdf_text
+    text = extract_pdf_text(source)
+    if not text or not text.strip():
+        raise ValueError("Could not extract text from PDF")
+    return text.strip()
+
+
+def _field_event(result: FieldDetection, name: str) -> tuple[str, dict]:
+    return "field", {
+        "name": name,
+        "value": result.mapping[name],
+        "confidence": result.confidence[name],
+        "source": result.sources[name],
+    }
+
+
+async def stream_fields_in_text(text: str) -> AsyncIterator[tuple[str, object]]:
+    """Streaming :func:`detect_fields_in_text`.
+
+    Yields ``("field", {name, value, confidence, source})`` for each
+    local field at once, then for each Gemini field as soon as its value
+    is complete in the streamed answer, and finally ``("done",
+    FieldDetection)``. A Gemini value replaces an earlier local one for
+    the same field.
+    """
+    result, pending = _local_pass(text)
+    for name in result.mapping:
+        yield _field_event(result, name)
+    if not pending:
+        yield "done", result
+        return
+
+    prompt = build_prompt(pending, text_windows(pending, text))
+    parser = ObjectStreamParser()
+    try:
+        async for chunk in llm_client.stream_content(_gemini_payload(prompt)):
+            for name, value in parser.feed(chunk):
+                if name in pending and _apply_gemini(result, name, value, text):
+                    yield _field_event(result, name)
+        if not parser.done:
+            raise ValueError("Incomplete JSON object from Gemini")
+        await llm_client.remember_response(prompt, parser.result)
+    except LLMError as e:
+        cached = await _fallback(result, prompt, e)
+        for name in pending:
+            if cached and name not in parser.result and _apply_gemini(result, name, cached.get(name), text):
+                yield _field_event(result, name)
+    yield "done", result
+
+
+def _gemini_payload(prompt: str, max_output_tokens: int = 2048) -> dict:
+    return {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {"temperature": 0.1, "maxOutputTokens": max_output_tokens},
+    }
+
+
+async def ask_gemini(prompt: str, max_output_tokens: int = 2048) -> dict:
+    """Send *prompt* to Gemini and parse the JSON object it returns.
+
+    Raises ``llm_client.LLMError`` when Gemini can't be reached in time.
+    """
+    result = await llm_client.generate_content(_gemini_payload(prompt, max_output_tokens))
 
     content = (
         result.get("candidates", [{}])[0]
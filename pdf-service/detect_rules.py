@@ -0,0 +1,285 @@
+"""
+Deterministic detection of Booking.com confirmation fields.
+
+The confirmation layout is fixed: the confirmation number is always
+``XXXX.XXX.XXX``, the PIN follows "PIN CODE:", prices are "TL n,nnn" /
+"DKK n,nnn.nn" and the check-in/check-out grid is day / MONTH / Weekday.
+These rules pick the fields out of pdfminer text in milliseconds and
+attach a confidence to each one, so the LLM only has to be asked about
+whatever is missing or doubtful.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+          "August", "September", "October", "November", "December"]
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+_MONTH_INDEX = {m.upper(): i + 1 for i, m in enumerate(MONTHS)}
+
+_US_DATE = r"(?:%s) \d{1,2}, \d{4}" % "|".join(MONTHS)          # May 14, 2026
+_EU_DATE = r"\d{1,2} (?:%s) \d{4}" % "|".join(MONTHS)           # 14 May 2026
+_TL_AMOUNT = r"\d{1,3}(?:,\d{3})*(?:\.\d{2})?"
+
+# Text that shows a field exists in the document even if the rules
+# could not pin its value down. Fields whose anchor is absent are
+# treated as not present (e.g. no refund schedule) rather than missing.
+FIELD_ANCHORS = {
+    "guest_name": r"Guest name",
+    "guest_email": r"@",
+    "confirmation_number": r"CONFIRMATION NUMBER|\d{4}\.\d{3}\.\d{3}",
+    "pin_code": r"PIN CODE",
+    "checkin_day": r"CHECK-IN",
+    "checkin_month": r"CHECK-IN",
+    "checkin_weekday": r"CHECK-IN",
+    "checkout_day": r"CHECK-OUT",
+    "checkout_month": r"CHECK-OUT",
+    "checkout_weekday": r"CHECK-OUT",
+    "num_nights": r"NIGHTS?",
+    "num_guests": r"ROOMS?|GUESTS?|adults?",
+    "num_guests_display": r"\d+ adults?",
+    "price_rooms": r"TL",
+    "price_vat": r"VAT",
+    "price_total_tl": r"TL",
+    "price_total_dkk": r"DKK",
+    "cancel_until_date": r"\buntil\b",
+    "cancel_from_date": r"\bfrom\b",
+    "refund_until_date": r"[Rr]efund",
+    "refund_from_date": r"[Rr]efund",
+    "refund_amount": r"[Rr]efund",
+}
+
+
+@dataclass
+class FieldMatch:
+    value: str
+    confidence: float
+    start: int = -1     # offset of the value in the extracted text, -1 if unknown
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def _lines(text: str) -> list[tuple[int, str]]:
+    """Non-empty stripped lines with their offsets in *text*."""
+    out = []
+    pos = 0
+    for raw in text.splitlines(keepends=True):
+        stripped = raw.strip()
+        if stripped:
+            out.append((pos + raw.index(stripped), stripped))
+        pos += len(raw)
+    return out
+
+
+def _parse_amount(s: str) -> float:
+    return float(s.replace(",", ""))
+
+
+def _search(pattern: str, text: str, confidence: float, flags: int = 0) -> Optional[FieldMatch]:
+    m = re.search(pattern, text, flags)
+    if not m:
+        return None
+    return FieldMatch(m.group(1), confidence, m.start(1))
+
+
+def _anchored_after(lines, anchor: str, pick, limit: int = 8):
+    """First line after the line equal to *anchor* for which *pick* is truthy."""
+    for i, (_, line) in enumerate(lines):
+        if line.upper() == anchor:
+            for pos, cand in lines[i + 1:i + 1 + limit]:
+                if pick(cand):
+                    return pos, cand
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Detector
+# ---------------------------------------------------------------------------
+
+def detect_fields_locally(text: str) -> dict[str, FieldMatch]:
+    """Return ``{field_name: FieldMatch}`` for every field the rules recognize."""
+    found: dict[str, FieldMatch] = {}
+    lines = _lines(text)
+
+    def put(name: str, match: Optional[FieldMatch]):
+        if match is not None and match.value:
+            found[name] = match
+
+    # --- Confirmation number / PIN ----------------------------------------
+    m = _search(r"CONFIRMATION NUMBER:?\s*(\d{4}\.\d{3}\.\d{3})", text, 0.99)
+    if m is None:
+        numbers = set(re.findall(r"\b\d{4}\.\d{3}\.\d{3}\b", text))
+        if len(numbers) == 1:
+            value = numbers.pop()
+            m = FieldMatch(value, 0.85, text.index(value))
+    put("confirmation_number", m)
+    put("pin_code", _search(r"PIN CODE:?\s*(\d{4})\b", text, 0.99))
+
+    # --- Guest --------------------------------------------------------------
+    put("guest_name", _search(r"Guest name:?[ \t]*([A-ZÀ-Þ][A-ZÀ-Þ .'\-]*[A-ZÀ-Þ])", text, 0.95))
+    emails = [m for m in re.finditer(r"[\w.+\-]+@[\w\-]+(?:\.[\w\-]+)+", text)
+              if not m.group(0).lower().endswith("booking.com")]
+    if emails:
+        distinct = {m.group(0) for m in emails}
+        last = emails[-1]
+        put("guest_email", FieldMatch(last.group(0), 0.95 if len(distinct) == 1 else 0.6, last.start()))
+
+    display = _search(r"\b(\d+ adults?)\b", text, 0.9)
+    put("num_guests_display", display)
+
+    # --- Cancellation / refund dates -----------------------------------------
+    put("cancel_until_date", _search(r"\buntil\s+(%s)" % _US_DATE, text, 0.95))
+    put("cancel_from_date", _search(r"\bfrom\s+(%s)" % _US_DATE, text, 0.9))
+    put("refund_until_date", _search(r"before\s+\d{1,2}:\d{2}\s+on\s+(%s)" % _EU_DATE, text, 0.9))
+    put("refund_from_date", _search(r"from\s+\d{1,2}:\d{2}\s+on\s+(%s)" % _EU_DATE, text, 0.9))
+    put("refund_amount", _search(r"TL\s*(%s)\s+refund" % _TL_AMOUNT, text, 0.9))
+
+    # --- Prices --------------------------------------------------------------
+    total = _search(r"approx\.?\s*TL\s*(%s)" % _TL_AMOUNT, text, 0.9)
+    tl_amounts = [m for m in re.finditer(r"TL\s*(%s)" % _TL_AMOUNT, text)
+                  if "refund" not in text[m.end():m.end() + 10]]
+    if total is None and tl_amounts:
+        biggest = max(tl_amounts, key=lambda m: _parse_amount(m.group(1)))
+        total = FieldMatch(biggest.group(1), 0.6, biggest.start(1))
+    put("price_total_tl", total)
+    if total is not None:
+        total_val = _parse_amount(total.value)
+        # Room price + 25 % VAT must add up to the total
+        for a in tl_amounts:
+            for b in tl_amounts:
+                if a is b:
+                    continue
+                va, vb = _parse_amount(a.group(1)), _parse_amount(b.group(1))
+                if va > vb and abs(va + vb - total_val) <= 2 and abs(vb - va * 0.25) <= 2:
+                    put("price_rooms", FieldMatch(a.group(1), 0.95, a.start(1)))
+                    put("price_vat", FieldMatch(b.group(1), 0.95, b.start(1)))
+                    total.confidence = max(total.confidence, 0.95)
+                    break
+            if "price_rooms" in found:
+                break
+    dkk = [m for m in re.finditer(r"DKK\s*(\d{1,3}(?:,\d{3})*\.\d{2})", text)]
+    if dkk:
+        best = max(dkk, key=lambda m: _parse_amount(m.group(1)))
+        distinct = {m.group(1) for m in dkk}
+        put("price_total_dkk", FieldMatch(best.group(1), 0.9 if len(distinct) == 1 else 0.75, best.start(1)))
+
+    # --- Date grid -------------------------------------------------------------
+    _detect_date_grid(lines, found)
+
+    return found
+
+
+def _detect_date_grid(lines, found: dict[str, FieldMatch]):
+    """Check-in/check-out day, MONTH and weekday plus the nights/guests cells.
+
+    Columns come out of pdfminer in varying order, so candidates are
+    validated against each other: the weekday must agree with the
+    calendar, and the check-in date must agree with the cancellation
+    "from" date when that was found.
+    """
+    months = [(pos, line) for pos, line in lines if line in _MONTH_INDEX]
+    weekdays = [(pos, line) for pos, line in lines if line in WEEKDAYS]
+    days = [(pos, line) for pos, line in lines if re.fullmatch(r"\d{1,2}", line) and 1 <= int(line) <= 31]
+
+    year = None
+    ref = found.get("cancel_from_date") or found.get("cancel_until_date")
+    if ref is not None:
+        year = int(ref.value[-4:])
+    else:
+        m = re.search(r"\b(20\d{2})\b", "\n".join(line for _, line in lines))
+        if m:
+            year = int(m.group(1))
+
+    def anchored(anchor, pool):
+        return _anchored_after(lines, anchor, lambda s: any(s == p[1] for p in pool))
+
+    for prefix, anchor, idx in (("checkin", "CHECK-IN", 0), ("checkout", "CHECK-OUT", 1)):
+        month = anchored(anchor, months) or (months[idx] if len(months) > idx else None)
+        weekday = anchored(anchor, weekdays) or (weekdays[idx] if len(weekdays) > idx else None)
+        if month:
+            found[f"{prefix}_month"] = FieldMatch(month[1], 0.9 if len(months) >= 2 else 0.7, month[0])
+        if weekday:
+            found[f"{prefix}_weekday"] = FieldMatch(weekday[1], 0.9 if len(weekdays) >= 2 else 0.7, weekday[0])
+        if not (month and weekday and year):
+            continue
+        month_no = _MONTH_INDEX[month[1]]
+        for pos, cand in days:
+            try:
+                dt = datetime(year, month_no, int(cand))
+            except ValueError:
+                continue
+            if dt.strftime("%A") == weekday[1]:
+                found[f"{prefix}_day"] = FieldMatch(cand, 0.9, pos)
+                break
+
+    # Cross-check the check-in date against the cancellation "from" date
+    cf = found.get("cancel_from_date")
+    if cf and "checkin_day" in found and "checkin_month" in found:
+        m = re.match(r"(\w+) (\d{1,2}), \d{4}", cf.value)
+        if m and m.group(1).upper() == found["checkin_month"].value and m.group(2) == found["checkin_day"].value:
+            for key in ("checkin_day", "checkin_month", "checkin_weekday"):
+                found[key].confidence = 0.97
+
+    # Nights and rooms/guests cells — small standalone numbers
+    if all(k in found for k in ("checkin_day", "checkin_month", "checkout_day", "checkout_month")) and year:
+        try:
+            ci = datetime(year, _MONTH_INDEX[found["checkin_month"].value], int(found["checkin_day"].value))
+            co_year = year + (1 if _MONTH_INDEX[found["checkout_month"].value] < ci.month else 0)
+            co = datetime(co_year, _MONTH_INDEX[found["checkout_month"].value], int(found["checkout_day"].value))
+            nights = str((co - ci).days)
+        except ValueError:
+            nights = None
+        if nights:
+            hit = _anchored_after(lines, "NIGHTS", lambda s: s == nights) or \
+                next(((p, s) for p, s in days if s == nights), None)
+            if hit:
+                found["num_nights"] = FieldMatch(nights, 0.9, hit[0])
+
+    display = found.get("num_guests_display")
+    if display:
+        count = display.value.split()[0]
+        hit = _anchored_after(lines, "ROOMS", lambda s: s == count) or \
+            _anchored_after(lines, "GUESTS", lambda s: s == count)
+        if hit:
+            found["num_guests"] = FieldMatch(count, 0.9, hit[0])
+        else:
+            hit = next(((p, s) for p, s in days if s == count
+                        and all(f.start != p for f in found.values())), None)
+            if hit:
+                found["num_guests"] = FieldMatch(count, 0.7, hit[0])
+
+
+def field_present(field: str, text: str) -> bool:
+    """Whether the document shows any sign of *field* (its anchor text)."""
+    anchor = FIELD_ANCHORS.get(field)
+    return anchor is None or re.search(anchor, text) is not None
+
+
+def text_windows(fields, text: str, radius: int = 300) -> str:
+    """Only the parts of *text* around the anchors of *fields*, merged.
+
+    Used to keep the LLM fallback prompt small.
+    """
+    spans = []
+    for field in fields:
+        anchor = FIELD_ANCHORS.get(field)
+        if anchor is None:
+            continue
+        for m in re.finditer(anchor, text):
+            spans.append((max(0, m.start() - radius), min(len(text), m.end() + radius)))
+    if not spans:
+        return text
+    spans.sort()
+    merged = [list(spans[0])]
+    for start, end in spans[1:]:
+        if start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return "\n...\n".join(text[s:e].strip() for s, e in merged)
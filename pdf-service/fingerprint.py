@@ -0,0 +1,224 @@
+"""
+Structural fingerprints for template PDFs.
+
+Booking.com confirmations for different hotels and guests share one
+structure: the same fonts, the same content-stream operators and text
+at the same heights — only the values differ. A fingerprint hashes that
+structure with every string masked out. Once a template has been
+detected, the text run holding each field is remembered as a pattern,
+so a new upload with a known fingerprint gets its ``field_mapping`` by
+position, without text extraction or an LLM call.
+
+Known templates are kept in the shared cache (``cache_store``) so every
+worker sees templates learned by the others.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Optional
+
+import pikepdf
+
+from cache_store import shared_cache
+from detect_fields import FIELD_DESCRIPTIONS
+from replace_text import ContentStream, content_streams, decode_pdf_string
+
+_TEXT_OPS = ("Tj", "TJ", "'", '"')
+
+
+@dataclass
+class TextRun:
+    page: int
+    font: str
+    size: float
+    y: float
+    text: str
+
+
+@dataclass
+class Fingerprint:
+    digest: str
+    runs: list[TextRun] = field(default_factory=list)
+
+
+# ---------------------------------------------------------------------------
+# Structure extraction
+# ---------------------------------------------------------------------------
+
+def _font_identity(font_obj) -> tuple[str, bool]:
+    """(BaseFont without the subset tag + subtype, is_type0)."""
+    try:
+        base = str(font_obj.get("/BaseFont", "")).lstrip("/")
+        subtype = str(font_obj.get("/Subtype", ""))
+    except Exception:
+        return "?", False
+    if "+" in base and len(base.split("+")[0]) == 6:
+        base = base.split("+", 1)[1]
+    return f"{base}{subtype}", subtype == "/Type0"
+
+
+def _walk_stream(content: ContentStream, page_no: int, skeleton: list, runs: list):
+    """Append the masked operator skeleton and text runs of one content stream."""
+    fonts = {name: _font_identity(font_obj) for name, font_obj in content.fonts.items()}
+    font, is_type0, size = "", False, 0.0
+    line_y = 0.0
+    leading = 0.0
+    for operands, operator in pikepdf.parse_content_stream(content.obj):
+        op = str(operator)
+        if op in _TEXT_OPS:
+            skeleton.append(op)
+            if op == "TJ":
+                arr = operands[0] if operands else []
+                text = "".join(decode_pdf_string(s, is_type0) for s in arr if isinstance(s, pikepdf.String))
+            else:
+                s = operands[-1] if operands else None
+                text = decode_pdf_string(s, is_type0) if isinstance(s, pikepdf.String) else ""
+            if op in ("'", '"'):
+                line_y -= leading
+            runs.append(TextRun(page_no, font, round(size, 1), round(line_y, 1), text))
+            continue
+        skeleton.append(op)
+        if op == "Tf" and len(operands) >= 2:
+            font, is_type0 = fonts.get(str(operands[0]), (str(operands[0]), False))
+            size = float(operands[1])
+            skeleton.append(font)
+        elif op == "Tm" and len(operands) >= 6:
+            line_y = float(operands[5])
+            if size == 1.0:
+                # Size carried by the matrix (Tf size 1 + scaled Tm)
+                size = float(operands[0])
+        elif op in ("Td", "TD") and len(operands) >= 2:
+            line_y += float(operands[1])
+            if op == "TD":
+                leading = -float(operands[1])
+        elif op == "TL" and operands:
+            leading = float(operands[0])
+        elif op == "T*":
+            line_y -= leading
+        elif op == "BT":
+            line_y = 0.0
+
+
+def compute_fingerprint(pdf) -> Fingerprint:
+    """Fingerprint an open ``pikepdf.Pdf``.
+
+    Walks the same streams as the text replacement
+    (``replace_text.content_streams``): pages, nested Form XObjects and
+    annotation appearances. A stream counts towards the page that first
+    draws it.
+    """
+    skeleton: list = []
+    runs: list[TextRun] = []
+    page_no = -1
+    for content in content_streams(pdf):
+        if content.is_page:
+            page_no += 1
+            box = [round(float(v)) for v in content.obj.mediabox]
+            skeleton.append(f"page{box}")
+        else:
+            skeleton.append("form")
+        _walk_stream(content, page_no, skeleton, runs)
+
+    h = hashlib.sha256()
+    h.update("\x1f".join(skeleton).encode())
+    for run in runs:
+        h.update(f"|{run.page}:{run.font}:{run.size}:{run.y}".encode())
+    return Fingerprint(h.hexdigest(), runs)
+
+
+def fingerprint_upload(spooled) -> Optional[Fingerprint]:
+    """Fingerprint a spooled upload; None if pikepdf cannot read it."""
+    try:
+        with spooled.open_pikepdf() as pdf:
+            return compute_fingerprint(pdf)
+    except Exception as e:
+        print(f"[fingerprint] skipped: {e}", file=sys.stderr, flush=True)
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Known templates
+# ---------------------------------------------------------------------------
+
+# Shared-cache entries: digest -> [{"run": index, "pattern": regex with
+# one named group per field}]
+_NAMESPACE = "fingerprint"
+
+
+def _run_patterns(runs: list[TextRun], mapping: dict) -> Optional[list[dict]]:
+    """Locate every mapped value in a text run and build per-run patterns.
+
+    Fields are assigned in detection-prompt order to the first run that
+    contains them, preferring runs that consist of exactly the value and
+    runs not yet claimed — so two fields with the same text (check-in
+    and check-out month, say) land on separate runs. Returns None if
+    some value cannot be located.
+    """
+    order = {name: i for i, name in enumerate(FIELD_DESCRIPTIONS)}
+    claims: dict[int, list[tuple[int, int, str]]] = {}
+    for name, value in sorted(mapping.items(), key=lambda kv: order.get(kv[0], len(order))):
+        value = str(value)
+        if not value:
+            continue
+
+        def free_at(i):
+            taken = claims.get(i, [])
+            start = 0
+            while True:
+                pos = runs[i].text.find(value, start)
+                if pos < 0:
+                    return -1
+                if all(pos + len(value) <= s or pos >= e for s, e, _ in taken):
+                    return pos
+                start = pos + 1
+
+        candidates = [i for i, r in enumerate(runs) if value in r.text]
+        candidates.sort(key=lambda i: (runs[i].text.strip() != value, i in claims, i))
+        for i in candidates:
+            pos = free_at(i)
+            if pos >= 0:
+                claims.setdefault(i, []).append((pos, pos + len(value), name))
+                break
+        else:
+            return None
+
+    out = []
+    for i, spans in sorted(claims.items()):
+        spans.sort()
+        text = runs[i].text
+        pattern, cursor = "", 0
+        for start, end, name in spans:
+            pattern += re.escape(text[cursor:start]) + f"(?P<{name}>.+?)"
+            cursor = end
+        pattern += re.escape(text[cursor:])
+        out.append({"run": i, "pattern": pattern})
+    return out
+
+
+def remember_template(fp: Fingerprint, mapping: dict) -> bool:
+    """Record where each field of *mapping* sits in the template *fp*."""
+    patterns = _run_patterns(fp.runs, mapping)
+    if not patterns:
+        return False
+    shared_cache().put_json(_NAMESPACE, fp.digest, patterns)
+    return True
+
+
+def match_template(fp: Fingerprint) -> Optional[dict]:
+    """``field_mapping`` derived by position if *fp* is a known template."""
+    patterns = shared_cache().get_json(_NAMESPACE, fp.digest)
+    if not patterns:
+        return None
+    mapping = {}
+    for entry in patterns:
+        i = entry["run"]
+        if i >= len(fp.runs):
+            return None
+        m = re.fullmatch(entry["pattern"], fp.runs[i].text, re.DOTALL)
+        if not m:
+            return None
+        mapping.update(m.groupdict())
+    return mapping
@@ -0,0 +1,308 @@
+"""
+Template-affinity gateway in front of several pdf-service replicas.
+
+Behind a plain load balancer, requests for one hotel template land on
+random replicas, so each replica's in-process template, font and
+static-page caches rarely hit. In gateway mode (``PDF_SERVICE_MODE=gateway``,
+same image and entry point) the app instead proxies every request to
+one of ``GATEWAY_REPLICAS``, chosen by consistent hashing with bounded
+loads:
+
+- The routing key is the template identity: ``template_url`` without
+  its query string (signed URLs change per request) for
+  ``/generate-booking``, the hotel for ``/generate-booking-html``.
+  Other requests have no affinity and go to the least-loaded replica.
+- Each replica has ``GATEWAY_VNODES`` points on a hash ring. A key goes
+  to the first healthy replica clockwise from its hash whose in-flight
+  count stays within ``GATEWAY_LOAD_FACTOR`` times the average, so a
+  hot template spills over to the next replica instead of overloading
+  one (Mirrokni et al., "Consistent Hashing with Bounded Loads").
+- Replicas are polled on ``/health`` every ``GATEWAY_HEALTH_INTERVAL_S``
+  and leave the ring after ``GATEWAY_HEALTH_FAILURES`` failed checks.
+  Only the keys of a departed replica move.
+- A request whose connection to the chosen replica fails is retried
+  once on the next replica for its key. Nothing was sent yet, so that
+  is safe. Errors after the request went out are not retried (the
+  replica may have done the work) and return 502. Neither marks the
+  replica down; that is left to the health checks.
+
+``/gateway/status`` shows membership, load and routing counters.
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import json
+import math
+import os
+import sys
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from config import env_float, env_int
+
+GATEWAY_REPLICAS = [u.strip().rstrip("/") for u in os.environ.get("GATEWAY_REPLICAS", "").split(",") if u.strip()]
+GATEWAY_VNODES = env_int("GATEWAY_VNODES", 100)
+GATEWAY_LOAD_FACTOR = env_float("GATEWAY_LOAD_FACTOR", 1.25)
+GATEWAY_HEALTH_INTERVAL_S = env_float("GATEWAY_HEALTH_INTERVAL_S", 5.0)
+GATEWAY_HEALTH_FAILURES = env_int("GATEWAY_HEALTH_FAILURES", 2)
+GATEWAY_TIMEOUT_S = env_float("GATEWAY_TIMEOUT_S", 300.0)
+
+# Hop-by-hop headers are not forwarded (RFC 9110 7.6.1)
+_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+# ---------------------------------------------------------------------------
+# Membership + ring
+# ---------------------------------------------------------------------------
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        self.failures = 0
+        self.in_flight = 0
+        self.routed = 0
+        self.spilled = 0   # routed here although the key's owner was full
+
+    def stats(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "routed": self.routed,
+            "spilled_in": self.spilled,
+        }
+
+
+class HashRing:
+    """Consistent-hash ring with bounded loads over a fixed replica set."""
+
+    def __init__(self, urls: list[str], vnodes: int = GATEWAY_VNODES, load_factor: float = GATEWAY_LOAD_FACTOR):
+        self.replicas = {url: Replica(url) for url in urls}
+        self.load_factor = max(1.0, load_factor)
+        points = sorted((_hash(f"{url}#{i}"), url) for url in urls for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [url for _, url in points]
+
+    def healthy(self) -> list[Replica]:
+        return [r for r in self.replicas.values() if r.healthy]
+
+    def _capacity(self, healthy: list[Replica]) -> int:
+        total = sum(r.in_flight for r in healthy) + 1   # including the new request
+        return max(1, math.ceil(self.load_factor * total / len(healthy)))
+
+    def pick(self, key: Optional[str], exclude: frozenset[str] = frozenset()) -> Optional[Replica]:
+        """Replica for *key*, skipping the URLs in *exclude*; None if there is none."""
+        healthy = [r for r in self.healthy() if r.url not in exclude]
+        if not healthy:
+            return None
+        if key is None or not self._hashes:
+            return min(healthy, key=lambda r: r.in_flight)
+
+        capacity = self._capacity(healthy)
+        start = bisect.bisect(self._hashes, _hash(key))
+        owner = None
+        seen = set()
+        for i in range(len(self._hashes)):
+            url = self._owners[(start + i) % len(self._hashes)]
+            if url in seen:
+                continue
+            seen.add(url)
+            replica = self.replicas[url]
+            if not replica.healthy or url in exclude:
+                continue
+            if owner is None:
+                owner = replica
+            if replica.in_flight < capacity:
+                if replica is not owner:
+                    replica.spilled += 1
+                return replica
+            if len(seen) == len(self.replicas):
+                break
+        return owner
+
+
+# ---------------------------------------------------------------------------
+# Routing keys
+# ---------------------------------------------------------------------------
+
+def _template_identity(url: str) -> str:
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+
+def routing_key(path: str, body: bytes, content_type: str) -> Optional[str]:
+    """Template identity of a request, or None when it has no affinity."""
+    if path not in ("/generate-booking", "/generate-booking-html") or "json" not in content_type:
+        return None
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict):
+        return None
+    if path == "/generate-booking":
+        url = payload.get("template_url")
+        return f"template:{_template_identity(url)}" if url else None
+    record = payload.get("hotel_record") or {}
+    if record.get("id"):
+        return f"hotel:{record['id']}"
+    config = payload.get("hotel_config")
+    if config:
+        return "hotel-config:" + hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+    return None
+
+
+# ---------------------------------------------------------------------------
+# App
+# ---------------------------------------------------------------------------
+
+class _ProxiedResponse(StreamingResponse):
+    """An upstream response streamed back to the client. The replica's
+    in-flight slot is released however the stream ends: complete,
+    upstream error or client gone."""
+
+    def __init__(self, upstream: httpx.Response, replica: Replica):
+        super().__init__(
+            upstream.aiter_raw(),
+            status_code=upstream.status_code,
+            headers={k: v for k, v in upstream.headers.items() if k.lower() not in _HOP_HEADERS},
+        )
+        self.upstream = upstream
+        self.replica = replica
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.replica.in_flight -= 1
+            await self.upstream.aclose()
+
+
+def create_app(replicas: Optional[list[str]] = None) -> FastAPI:
+    urls = replicas if replicas is not None else GATEWAY_REPLICAS
+    if not urls:
+        raise RuntimeError("Gateway mode needs GATEWAY_REPLICAS (comma-separated replica URLs)")
+
+    app = FastAPI(title="Booking PDF Service gateway")
+    ring = HashRing(urls)
+    counters = {"requests": 0, "affinity": 0, "no_replica": 0, "retried": 0, "upstream_errors": 0}
+    state: dict = {}
+
+    def _mark_failed(replica: Replica):
+        replica.failures += 1
+        if replica.healthy and replica.failures >= GATEWAY_HEALTH_FAILURES:
+            replica.healthy = False
+            print(f"[gateway] {replica.url} is down", file=sys.stderr, flush=True)
+
+    def _mark_ok(replica: Replica):
+        if not replica.healthy:
+            print(f"[gateway] {replica.url} is back", file=sys.stderr, flush=True)
+        replica.healthy = True
+        replica.failures = 0
+
+    async def _health_loop():
+        client: httpx.AsyncClient = state["client"]
+        while True:
+            async def check(replica: Replica):
+                try:
+                    resp = await client.get(f"{replica.url}/health", timeout=2.0)
+                    ok = resp.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                (_mark_ok if ok else _mark_failed)(replica)
+
+            await asyncio.gather(*(check(r) for r in ring.replicas.values()))
+            await asyncio.sleep(GATEWAY_HEALTH_INTERVAL_S)
+
+    @app.on_event("startup")
+    async def _start():
+        state["client"] = httpx.AsyncClient(
+            timeout=httpx.Timeout(GATEWAY_TIMEOUT_S, connect=3.0),
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+        )
+        state["health"] = asyncio.create_task(_health_loop())
+
+    @app.on_event("shutdown")
+    async def _stop():
+        state["health"].cancel()
+        await state["client"].aclose()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok" if ring.healthy() else "degraded", "mode": "gateway"}
+
+    @app.get("/gateway/status")
+    async def status():
+        return {
+            **counters,
+            "load_factor": ring.load_factor,
+            "replicas": {url: r.stats() for url, r in ring.replicas.items()},
+        }
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+    async def proxy(path: str, request: Request):
+        client: httpx.AsyncClient = state["client"]
+        body = await request.body()
+        key = routing_key(request.url.path, body, request.headers.get("content-type", ""))
+        counters["requests"] += 1
+        if key is not None:
+            counters["affinity"] += 1
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in _HOP_HEADERS]
+
+        # One retry on another replica when the chosen one can't be reached
+        tried: set[str] = set()
+        for attempt in range(2):
+            replica = ring.pick(key, exclude=frozenset(tried))
+            if replica is None:
+                break
+            tried.add(replica.url)
+            replica.in_flight += 1
+            replica.routed += 1
+            upstream = client.build_request(
+                request.method, f"{replica.url}{request.url.path}",
+                params=request.query_params, headers=headers, content=body,
+            )
+            resp = proxied = None
+            try:
+                resp = await client.send(upstream, stream=True)
+                # From here on the response releases the slot, see _ProxiedResponse
+                proxied = _ProxiedResponse(resp, replica)
+                return proxied
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                counters["retried"] += 1
+                print(f"[gateway] {replica.url}: {e!r}", file=sys.stderr, flush=True)
+                continue
+            except httpx.HTTPError as e:
+                counters["upstream_errors"] += 1
+                print(f"[gateway] {replica.url}: {e!r}", file=sys.stderr, flush=True)
+                return JSONResponse(
+                    {"status": "error", "error": f"pdf-service replica failed: {type(e).__name__}"},
+                    status_code=502,
+                )
+            finally:
+                # Failed, or the client went away while we waited for the replica
+                if proxied is None:
+                    replica.in_flight -= 1
+                    if resp is not None:
+                        await resp.aclose()
+
+        counters["no_replica"] += 1
+        return JSONResponse(
+            {"status": "error", "error": "No healthy pdf-service replica"},
+            status_code=503, headers={"Retry-After": "5"},
+        )
+
+    return app
@@ -218,17 +218,111 @@ def build_template_context(
 # Renderer
 # ---------------------------------------------------------------------------
 
+def _render_part(ctx: dict, part: str) -> str:
+    template = _jinja_env.get_template("booking_confirmation.html")
+    return template.render(**ctx, part=part)
+
+
 def render_booking_html(
     booking: BookingData,
     hotel_config: dict,
     hotel_record: dict,
+    optimize_images: bool = True,
+    part: str = "all",
 ) -> str:
     """
     Render the booking confirmation HTML string.
 
     The returned HTML is ready to be passed to WeasyPrint's
-    ``HTML(string=...).write_pdf()`` for A4 PDF output.
+    ``HTML(string=...).write_pdf()`` for A4 PDF output. With
+    *optimize_images* the hotel photo and map are inlined already
+    downsampled to their box size (see ``images``). *part* selects
+    "all", "dynamic" or "static" pages, see ``render_booking_pdf``.
     """
     ctx = build_template_context(booking, hotel_config, hotel_record)
-    template = _jinja_env.get_template("booking_confirmation.html")
-    return template.render(**ctx)
+    if optimize_images:
+        from images import optimize_context_images
+        optimize_context_images(ctx)
+    return _render_part(ctx, part)
+
+
+# ---------------------------------------------------------------------------
+# PDF rendering with cached hotel-static pages
+# ---------------------------------------------------------------------------
+
+# Pages at the end of the "dynamic" part that are overlaid on the static
+# part: page 2 with only its footer.
+STATIC_PAGES = 1
+
+# Booking that differs from any real one in every field. The static part
+# rendered for it must equal the one rendered for the real booking,
+# otherwise the template's static part depends on guest data.
+_PROBE_BOOKING = BookingData(
+    guest_name="Probe Guest",
+    guest_email="probe@example.invalid",
+    confirmation_number="0000.000.000",
+    pin_code="0000",
+    checkin_date="2000-02-01",
+    checkout_date="2000-02-29",
+    num_guests=99,
+    price_total_tl=1.0,
+    price_total_dkk=1.0,
+    refund_amount_tl=1.0,
+)
+
+
+def render_booking_pdf(
+    booking: BookingData,
+    hotel_config: dict,
+    hotel_record: dict,
+) -> bytes:
+    """
+    Render the booking confirmation to PDF, reusing hotel-static pages.
+
+    The template is rendered in two parts. The "static" part (page 2
+    without its footer) depends only on the hotel. Its PDF is cached in
+    the shared cache (namespace ``static-pages``) by the SHA-256 of its
+    HTML, so a new ``hotel_config`` version or template change is a new
+    entry. The "dynamic" part (page 1, plus page 2 with only the
+    absolutely positioned footer that names the guest's email) is
+    rendered per booking. Its trailing pages are overlaid on the cached
+    static pages with pikepdf.
+
+    Hotel texts on page 2 (``page2_contact_text``) have no length limit,
+    so the static part can flow onto more than ``STATIC_PAGES`` pages.
+    The overlays would then be misplaced, so such a hotel is rendered in
+    full instead.
+
+    Runs WeasyPrint in-process; call it from a render worker.
+    """
+    import hashlib
+    import sys
+
+    from cache_store import shared_cache
+    from html_render import page_count, render_html, splice_static_pages
+    from images import optimize_context_images
+
+    ctx = optimize_context_images(build_template_context(booking, hotel_config, hotel_record))
+    static_html = _render_part(ctx, "static")
+
+    probe = build_template_context(_PROBE_BOOKING, hotel_config, hotel_record)
+    probe.update(photo_url=ctx["photo_url"], map_url=ctx["map_url"])
+    if _render_part(probe, "static") != static_html:
+        print("[booking] static part depends on guest data, rendering in full", file=sys.stderr, flush=True)
+        return render_html(_render_part(ctx, "all"))
+
+    key = hashlib.sha256(static_html.encode()).hexdigest()
+    cached = shared_cache().get("static-pages", key)
+    if cached is not None:
+        static_pdf = cached[0]
+    else:
+        static_pdf = render_html(static_html)
+        shared_cache().put("static-pages", key, static_pdf)
+
+    pages = page_count(static_pdf)
+    if pages != STATIC_PAGES:
+        print(f"[booking] static part renders to {pages} pages, rendering in full", file=sys.stderr, flush=True)
+        return render_html(_render_part(ctx, "all"))
+
+    dynamic_pdf = render_html(_render_part(ctx, "dynamic"))
+    return splice_static_pages(dynamic_pdf, static_pdf, STATIC_PAGES)
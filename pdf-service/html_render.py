@@ -0,0 +1,149 @@
+"""
+WeasyPrint rendering, executed inside worker processes.
+
+Setup that does not depend on the document is done once per worker and
+reused across jobs: the font configuration, parsed shared stylesheets
+and fetched assets (images, fonts referenced by URL). A batch of
+letters that share a stylesheet and logo therefore pays for them once
+per worker instead of once per document.
+
+Fetched assets are kept for ``HTML_ASSET_CACHE_TTL_S`` seconds, so a
+logo or stylesheet replaced at the same URL is picked up, and up to
+``HTML_ASSET_CACHE_MAX_BYTES`` per worker in total.
+"""
+from __future__ import annotations
+
+import hashlib
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+from config import env_int
+
+HTML_ASSET_CACHE_TTL_S = env_int("HTML_ASSET_CACHE_TTL_S", 300)
+HTML_ASSET_CACHE_MAX_BYTES = env_int("HTML_ASSET_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+
+_font_config = None
+_stylesheets: OrderedDict = OrderedDict()
+_assets: OrderedDict = OrderedDict()   # url -> (fetched_at, size, result)
+_assets_size = 0
+
+
+def _get_font_config():
+    global _font_config
+    if _font_config is None:
+        from weasyprint.text.fonts import FontConfiguration
+        _font_config = FontConfiguration()
+    return _font_config
+
+
+def _get_stylesheet(css: str):
+    """Parsed ``weasyprint.CSS`` for *css*, cached per worker."""
+    from weasyprint import CSS
+    key = hashlib.sha256(css.encode()).hexdigest()
+    sheet = _stylesheets.get(key)
+    if sheet is None:
+        sheet = CSS(string=css, font_config=_get_font_config())
+        _stylesheets[key] = sheet
+        while len(_stylesheets) > 16:
+            _stylesheets.popitem(last=False)
+    else:
+        _stylesheets.move_to_end(key)
+    return sheet
+
+
+def _drop_asset(url: str):
+    global _assets_size
+    _, size, _ = _assets.pop(url)
+    _assets_size -= size
+
+
+def safe_url_fetcher(url, timeout=10, ssl_context=None):
+    """Only data: and https: URLs; https responses are cached per worker
+    for ``HTML_ASSET_CACHE_TTL_S``, LRU within ``HTML_ASSET_CACHE_MAX_BYTES``."""
+    global _assets_size
+    from weasyprint.urls import default_url_fetcher
+    if url.startswith("data:"):
+        return default_url_fetcher(url, timeout=timeout, ssl_context=ssl_context)
+    if not url.startswith("https://"):
+        raise ValueError(f"Blocked URL fetch: {url}")
+
+    entry = _assets.get(url)
+    if entry is not None and time.monotonic() - entry[0] < HTML_ASSET_CACHE_TTL_S:
+        _assets.move_to_end(url)
+        return dict(entry[2])
+    if entry is not None:
+        _drop_asset(url)
+
+    result = default_url_fetcher(url, timeout=timeout, ssl_context=ssl_context)
+    if "string" not in result:
+        result["string"] = result.pop("file_obj").read()
+    cached = {k: v for k, v in result.items() if k != "file_obj"}
+    size = len(cached["string"])
+    if size <= HTML_ASSET_CACHE_MAX_BYTES // 4:   # one big image must not flush the rest
+        _assets[url] = (time.monotonic(), size, cached)
+        _assets_size += size
+        while _assets_size > HTML_ASSET_CACHE_MAX_BYTES:
+            _drop_asset(next(iter(_assets)))
+    return dict(cached)
+
+
+def render_html(html: str, stylesheet: str = "", full_fonts: bool = False) -> bytes:
+    """Render one HTML document to PDF bytes.
+
+    With *full_fonts* the complete font programs are embedded rather than
+    subsets of the glyphs used, so the text can be changed afterwards.
+    """
+    from weasyprint import HTML
+    from workers import checkpoint
+    stylesheets = [_get_stylesheet(stylesheet)] if stylesheet else None
+    document = HTML(string=html, url_fetcher=safe_url_fetcher).render(
+        stylesheets=stylesheets, font_config=_get_font_config(), full_fonts=full_fonts
+    )
+    checkpoint()   # between layout and PDF output
+    return document.write_pdf(full_fonts=full_fonts)
+
+
+def merge_pdfs(pdfs: list[bytes]) -> bytes:
+    """Concatenate PDFs into one document."""
+    import pikepdf
+    from workers import checkpoint
+    merged = pikepdf.new()
+    for data in pdfs:
+        checkpoint()
+        with pikepdf.open(BytesIO(data)) as src:
+            merged.pages.extend(src.pages)
+    out = BytesIO()
+    merged.save(out)
+    return out.getvalue()
+
+
+def page_count(pdf: bytes) -> int:
+    import pikepdf
+    with pikepdf.open(BytesIO(pdf)) as doc:
+        return len(doc.pages)
+
+
+def splice_static_pages(dynamic: bytes, static: bytes, pages: int) -> bytes:
+    """Combine a per-request render with cached static pages.
+
+    The last *pages* pages of *dynamic* are overlays: each one is drawn
+    on top of the matching static page, which then takes its place.
+    Leading pages of *dynamic* are kept as they are. *static* must have
+    exactly *pages* pages, else an overlay would land on the wrong page.
+    """
+    import pikepdf
+    out = pikepdf.open(BytesIO(dynamic))
+    with pikepdf.open(BytesIO(static)) as src:
+        count = len(src.pages)
+        first = len(out.pages) - count
+        if count != pages or first < 0:
+            raise ValueError(f"{count} static pages cannot replace the last {pages} of {len(out.pages)} dynamic pages")
+        for i, page in enumerate(src.pages):
+            out.pages.append(page)
+            out.pages[-1].add_overlay(out.pages[first + i])
+        for _ in range(count):
+            del out.pages[first]
+        buf = BytesIO()
+        out.save(buf)
+    return buf.getvalue()
@@ -0,0 +1,163 @@
+"""
+Preprocessing of hotel photos and maps for the HTML booking template.
+
+``photo_path`` / ``map_path`` point at whatever was uploaded to the
+hotel-assets bucket, often multi-megapixel phone photos. Left alone,
+WeasyPrint decodes and embeds them at full size on every render. Here
+each image is scaled and center-cropped to the box it occupies in
+``booking_confirmation.html`` (the boxes use ``object-fit: cover``, so
+the crop is what would be visible anyway) at ``IMAGE_DPI``, then
+re-encoded as JPEG at ``IMAGE_JPEG_QUALITY`` and inlined as a data: URI.
+
+Processed variants are cached in the shared cache (namespace ``image``)
+by source SHA-256, box and encoding settings. The source URL -> SHA-256
+mapping (namespace ``image-src``) is trusted for ``IMAGE_URL_TTL``
+seconds, so repeat renders don't download the original at all.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import sys
+import time
+from io import BytesIO
+from typing import Optional
+
+from cache_store import shared_cache
+from config import env_int
+
+IMAGE_DPI = env_int("IMAGE_DPI", 200)
+IMAGE_JPEG_QUALITY = env_int("IMAGE_JPEG_QUALITY", 85)
+IMAGE_URL_TTL = env_int("IMAGE_URL_TTL", 3600)
+IMAGE_MAX_SOURCE_BYTES = env_int("IMAGE_MAX_SOURCE_BYTES", 20 * 1024 * 1024)
+
+# Rendered image boxes in booking_confirmation.html, in mm (width, height).
+# Content width is 210mm - 2 x 12mm padding = 186mm.
+IMAGE_BOXES_MM = {
+    "hero": (92.0, 45.0),    # .hero-side-by-side img: 50% of 186mm - 2mm gap
+    "thumb": (22.0, 22.0),   # .hotel-photo-small
+    "map": (186.0, 40.0),    # .map-section img
+}
+
+
+def _box_pixels(box: str, dpi: int) -> tuple[int, int]:
+    w_mm, h_mm = IMAGE_BOXES_MM[box]
+    return round(w_mm / 25.4 * dpi), round(h_mm / 25.4 * dpi)
+
+
+# ---------------------------------------------------------------------------
+# Processing
+# ---------------------------------------------------------------------------
+
+def process_image(data: bytes, width: int, height: int, quality: int = IMAGE_JPEG_QUALITY) -> bytes:
+    """Cover-crop and scale *data* to at most *width* x *height*, as JPEG.
+
+    Never upscales: a source smaller than the box keeps its resolution
+    and is only cropped to the box's aspect ratio.
+    """
+    from PIL import Image, ImageOps
+
+    img = Image.open(BytesIO(data))
+    # JPEG decoders can scale by 1/2, 1/4, 1/8 while decoding
+    img.draft("RGB", (width, height))
+    img = ImageOps.exif_transpose(img)
+
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        img = Image.new("RGB", rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.getchannel("A"))
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    # Crop to the box aspect ratio (what object-fit: cover shows) ...
+    box_ratio = width / height
+    src_w, src_h = img.size
+    if src_w / src_h > box_ratio:
+        crop_w, crop_h = round(src_h * box_ratio), src_h
+    else:
+        crop_w, crop_h = src_w, round(src_w / box_ratio)
+    left, top = (src_w - crop_w) // 2, (src_h - crop_h) // 2
+    img = img.crop((left, top, left + crop_w, top + crop_h))
+
+    # ... then scale down to the box pixels
+    if crop_w > width:
+        img = img.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+
+    out = BytesIO()
+    img.save(out, "JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+# ---------------------------------------------------------------------------
+# Fetch + cache
+# ---------------------------------------------------------------------------
+
+_MAX_REDIRECTS = 5
+
+
+def _fetch_source(url: str) -> bytes:
+    """Download *url*. Redirects are followed by hand so every hop is
+    held to the https-only rule, not just the first URL."""
+    import httpx
+    with httpx.Client(timeout=20) as client:
+        for _ in range(_MAX_REDIRECTS + 1):
+            with client.stream("GET", url) as resp:
+                if resp.is_redirect:
+                    url = str(resp.url.join(resp.headers["location"]))
+                    if not url.startswith("https://"):
+                        raise ValueError(f"Blocked redirect to {url}")
+                    continue
+                resp.raise_for_status()
+                buf = bytearray()
+                for chunk in resp.iter_bytes():
+                    buf += chunk
+                    if len(buf) > IMAGE_MAX_SOURCE_BYTES:
+                        raise ValueError(f"Image larger than {IMAGE_MAX_SOURCE_BYTES} bytes: {url}")
+                return bytes(buf)
+    raise ValueError(f"More than {_MAX_REDIRECTS} redirects: {url}")
+
+
+def optimized_image_uri(url: str, box: str, dpi: int = IMAGE_DPI, quality: int = IMAGE_JPEG_QUALITY) -> str:
+    """data: URI of *url* prepared for *box*; falls back to *url* on failure."""
+    # Same rule as html_render.safe_url_fetcher: only https sources
+    if not url.startswith("https://"):
+        return url
+    cache = shared_cache()
+    width, height = _box_pixels(box, dpi)
+    variant = f"{width}x{height}:q{quality}"
+
+    try:
+        src = cache.get_json("image-src", url)
+        source: Optional[bytes] = None
+        if src is None or time.time() - src["fetched_at"] > IMAGE_URL_TTL:
+            source = _fetch_source(url)
+            src = {"sha256": hashlib.sha256(source).hexdigest(), "fetched_at": time.time()}
+            cache.put_json("image-src", url, src)
+
+        key = f"{src['sha256']}:{variant}"
+        hit = cache.get("image", key)
+        if hit is not None:
+            jpeg = hit[0]
+        else:
+            if source is None:
+                source = _fetch_source(url)
+                src = {"sha256": hashlib.sha256(source).hexdigest(), "fetched_at": time.time()}
+                cache.put_json("image-src", url, src)
+                key = f"{src['sha256']}:{variant}"
+            jpeg = process_image(source, width, height, quality)
+            cache.put("image", key, jpeg)
+    except Exception as e:
+        print(f"[images] keeping original {url}: {e}", file=sys.stderr, flush=True)
+        return url
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg).decode()
+
+
+def optimize_context_images(ctx: dict) -> dict:
+    """Replace ``photo_url`` / ``map_url`` in a template context with
+    data: URIs sized for the boxes the current layout puts them in."""
+    side_by_side = ctx.get("layout") == "photo_map_side_by_side"
+    if ctx.get("photo_url"):
+        ctx["photo_url"] = optimized_image_uri(ctx["photo_url"], "hero" if side_by_side else "thumb")
+    if ctx.get("map_url"):
+        ctx["map_url"] = optimized_image_uri(ctx["map_url"], "hero" if side_by_side else "map")
+    return ctx
@@ -0,0 +1,135 @@
+"""
+Incremental parser for a JSON object that arrives in chunks.
+
+Gemini streams its answer a few tokens at a time. ``ObjectStreamParser``
+takes those chunks and returns every top-level ``key: value`` pair as
+soon as its value is complete, so callers can act on the first fields
+long before the closing brace arrives.
+
+Anything before the opening ``{`` (e.g. a Markdown code fence) is
+skipped. Each value is decoded with ``json.loads`` once its closing
+token has been seen, so escapes and nested values behave exactly as in a
+full parse.
+"""
+from __future__ import annotations
+
+import json
+
+_WHITESPACE = " \t\r\n"
+
+
+class ObjectStreamParser:
+    """Feed chunks with :meth:`feed`; it returns the pairs completed so far."""
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._state = "start"        # start, key, colon, value, comma, done
+        self._key: str | None = None
+        self.result: dict = {}
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, chunk: str) -> list[tuple[str, object]]:
+        self._buf += chunk
+        pairs = []
+        while self._state != "done":
+            self._skip_whitespace()
+            if self._pos >= len(self._buf):
+                break
+            if self._state == "start":
+                start = self._buf.find("{", self._pos)
+                if start < 0:
+                    self._pos = len(self._buf)
+                    break
+                self._pos = start + 1
+                self._state = "key"
+            elif self._state == "key":
+                if self._buf[self._pos] == "}":
+                    self._pos += 1
+                    self._state = "done"
+                    break
+                end = self._string_end(self._pos)
+                if end is None:
+                    break
+                self._key = json.loads(self._buf[self._pos:end])
+                self._pos = end
+                self._state = "colon"
+            elif self._state == "colon":
+                if self._buf[self._pos] != ":":
+                    raise ValueError(f"Expected ':' at {self._pos}")
+                self._pos += 1
+                self._state = "value"
+            elif self._state == "value":
+                end = self._value_end(self._pos)
+                if end is None:
+                    break
+                value = json.loads(self._buf[self._pos:end])
+                self.result[self._key] = value
+                pairs.append((self._key, value))
+                self._pos = end
+                self._state = "comma"
+            elif self._state == "comma":
+                char = self._buf[self._pos]
+                self._pos += 1
+                if char == "}":
+                    self._state = "done"
+                elif char == ",":
+                    self._state = "key"
+                else:
+                    raise ValueError(f"Expected ',' or '}}' at {self._pos - 1}")
+        # Drop consumed input so long streams don't grow the buffer
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        return pairs
+
+    def _skip_whitespace(self):
+        while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+            self._pos += 1
+
+    def _string_end(self, start: int) -> int | None:
+        """Index just past the string starting at *start*, None if incomplete."""
+        if self._buf[start] != '"':
+            raise ValueError(f"Expected string at {start}")
+        i = start + 1
+        while i < len(self._buf):
+            char = self._buf[i]
+            if char == "\\":
+                i += 2
+                continue
+            if char == '"':
+                return i + 1
+            i += 1
+        return None
+
+    def _value_end(self, start: int) -> int | None:
+        """Index just past the value starting at *start*, None if incomplete."""
+        char = self._buf[start]
+        if char == '"':
+            return self._string_end(start)
+        if char in "{[":
+            depth = 0
+            i = start
+            while i < len(self._buf):
+                char = self._buf[i]
+                if char == '"':
+                    end = self._string_end(i)
+                    if end is None:
+                        return None
+                    i = end
+                    continue
+                if char in "{[":
+                    depth += 1
+                elif char in "}]":
+                    depth -= 1
+                    if depth == 0:
+                        return i + 1
+                i += 1
+            return None
+        # Number, true, false, null: complete once a delimiter follows
+        i = start
+        while i < len(self._buf) and self._buf[i] not in ",}" + _WHITESPACE:
+            i += 1
+        return i if i < len(self._buf) else None
@@ -0,0 +1,353 @@
+"""
+Resilient client for the Gemini ``generateContent`` API.
+
+One slow or failing upstream call used to stall ``/detect-fields`` for
+its full 60 s timeout. Here every call gets:
+
+- a deadline (``GEMINI_DEADLINE_S``) covering all attempts,
+- a hedged second request once the first has run longer than the
+  observed p95 latency (``GEMINI_HEDGE_AFTER_S`` until enough samples
+  exist); whichever answers first wins and the other is cancelled,
+- retries with full-jitter exponential backoff on 429, 5xx and
+  transport errors, honouring ``Retry-After``,
+- a circuit breaker: after ``GEMINI_BREAKER_FAILURES`` consecutive
+  failed calls it opens for ``GEMINI_BREAKER_COOLDOWN_S`` and calls fail
+  immediately with ``LLMUnavailable``. Then one probe call is let
+  through, and its outcome closes or re-opens the breaker.
+
+Successful responses are kept in the shared cache (namespace ``llm``) by
+prompt hash, so callers can fall back to them while the breaker is open.
+
+``stream_content`` is the streaming (SSE) variant, for callers that
+want to act on the answer while it is still being generated.
+
+All calls share one pooled ``httpx.AsyncClient`` per process.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from cache_store import shared_cache
+from config import env_float, env_int
+
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+# Point at a stand-in (e.g. loadtest.py's mock) instead of Google
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+
+GEMINI_DEADLINE_S = env_float("GEMINI_DEADLINE_S", 30.0)
+GEMINI_HEDGE_AFTER_S = env_float("GEMINI_HEDGE_AFTER_S", 8.0)   # 0 disables hedging
+GEMINI_MAX_RETRIES = env_int("GEMINI_MAX_RETRIES", 3)
+GEMINI_RETRY_BASE_S = env_float("GEMINI_RETRY_BASE_S", 0.5)
+GEMINI_BREAKER_FAILURES = env_int("GEMINI_BREAKER_FAILURES", 5)
+GEMINI_BREAKER_COOLDOWN_S = env_float("GEMINI_BREAKER_COOLDOWN_S", 30.0)
+GEMINI_MAX_CONNECTIONS = env_int("GEMINI_MAX_CONNECTIONS", 20)
+
+# Latency samples needed before the hedge delay follows the observed p95
+_MIN_SAMPLES = 20
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """The call failed (after retries) or ran out of its deadline."""
+
+
+class LLMUnavailable(LLMError):
+    """The circuit breaker is open; the upstream was not called."""
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"Gemini returned HTTP {response.status_code}")
+        self.response = response
+
+
+# ---------------------------------------------------------------------------
+# Shared state
+# ---------------------------------------------------------------------------
+
+_client: Optional[httpx.AsyncClient] = None
+_latencies: deque = deque(maxlen=200)
+
+_consecutive_failures = 0
+_opened_at: Optional[float] = None
+_probe_in_flight = False
+_counters = {"calls": 0, "hedged": 0, "hedge_wins": 0, "retries": 0, "failures": 0, "rejected": 0}
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(GEMINI_DEADLINE_S, connect=5.0),
+            limits=httpx.Limits(max_connections=GEMINI_MAX_CONNECTIONS, max_keepalive_connections=GEMINI_MAX_CONNECTIONS),
+        )
+    return _client
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _hedge_delay() -> float:
+    if GEMINI_HEDGE_AFTER_S <= 0:
+        return 0.0
+    if len(_latencies) < _MIN_SAMPLES:
+        return GEMINI_HEDGE_AFTER_S
+    ordered = sorted(_latencies)
+    return ordered[int(len(ordered) * 0.95) - 1]
+
+
+# ---------------------------------------------------------------------------
+# Circuit breaker
+# ---------------------------------------------------------------------------
+
+def breaker_state() -> str:
+    if _opened_at is None:
+        return "closed"
+    if time.monotonic() - _opened_at < GEMINI_BREAKER_COOLDOWN_S:
+        return "open"
+    return "half-open"
+
+
+def _admit() -> bool:
+    """Whether a call may go upstream; claims the probe when half-open."""
+    global _probe_in_flight
+    state = breaker_state()
+    if state == "closed":
+        return True
+    if state == "half-open" and not _probe_in_flight:
+        _probe_in_flight = True
+        return True
+    return False
+
+
+def _record(success: bool):
+    global _consecutive_failures, _opened_at, _probe_in_flight
+    _probe_in_flight = False
+    if success:
+        if _opened_at is not None:
+            print("[llm] upstream healthy again, closing circuit", file=sys.stderr, flush=True)
+        _consecutive_failures = 0
+        _opened_at = None
+        return
+    _counters["failures"] += 1
+    _consecutive_failures += 1
+    if _opened_at is not None or _consecutive_failures >= GEMINI_BREAKER_FAILURES:
+        if _opened_at is None:
+            print(f"[llm] {_consecutive_failures} consecutive failures, opening circuit", file=sys.stderr, flush=True)
+        _opened_at = time.monotonic()
+
+
+# ---------------------------------------------------------------------------
+# Calls
+# ---------------------------------------------------------------------------
+
+async def _post(payload: dict) -> dict:
+    started = time.monotonic()
+    resp = await _get_client().post(
+        f"{GEMINI_BASE_URL}/v1beta/models/{GEMINI_MODEL}:generateContent",
+        params={"key": GEMINI_API_KEY},
+        json=payload,
+    )
+    if resp.status_code in _RETRY_STATUSES:
+        raise _RetryableStatus(resp)
+    resp.raise_for_status()
+    _latencies.append(time.monotonic() - started)
+    return resp.json()
+
+
+async def _hedged(payload: dict) -> dict:
+    """One attempt, duplicated once it runs past the hedge delay."""
+    delay = _hedge_delay()
+    first = asyncio.ensure_future(_post(payload))
+    pending = {first}
+    try:
+        if delay:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+            _counters["hedged"] += 1
+            pending.add(asyncio.ensure_future(_post(payload)))
+
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        _counters["hedge_wins"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # Also reached when the caller's deadline cancels us
+        for task in pending:
+            task.cancel()
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    if isinstance(error, _RetryableStatus):
+        value = error.response.headers.get("retry-after", "")
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+async def generate_content(payload: dict, deadline_s: Optional[float] = None) -> dict:
+    """POST *payload* to ``generateContent``; returns the response JSON.
+
+    Raises ``LLMUnavailable`` without calling upstream while the circuit
+    is open, and ``LLMError`` when all attempts fail or *deadline_s*
+    (default ``GEMINI_DEADLINE_S``) runs out.
+    """
+    global _probe_in_flight
+    if not _admit():
+        _counters["rejected"] += 1
+        raise LLMUnavailable("Gemini circuit is open after repeated failures")
+    _counters["calls"] += 1
+    try:
+        return await _call_with_retries(payload, time.monotonic() + (deadline_s or GEMINI_DEADLINE_S))
+    except asyncio.CancelledError:
+        # Caller went away: neither a success nor an upstream failure
+        _probe_in_flight = False
+        raise
+
+
+async def _call_with_retries(payload: dict, deadline: float) -> dict:
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            result = await asyncio.wait_for(_hedged(payload), timeout=max(0.0, remaining))
+        except (asyncio.TimeoutError, _RetryableStatus, httpx.TransportError) as e:
+            error = e
+        except Exception as e:
+            # 4xx other than 429, bad JSON: retrying won't help
+            _record(False)
+            raise LLMError(f"Gemini request failed: {e}") from e
+        else:
+            _record(True)
+            return result
+
+        attempt += 1
+        backoff = random.uniform(0, GEMINI_RETRY_BASE_S * 2 ** attempt)
+        backoff = max(backoff, _retry_after(error) or 0.0)
+        if attempt > GEMINI_MAX_RETRIES or time.monotonic() + backoff >= deadline:
+            _record(False)
+            reason = "deadline exceeded" if isinstance(error, asyncio.TimeoutError) else str(error) or type(error).__name__
+            raise LLMError(f"Gemini request failed after {attempt} attempt(s): {reason}") from error
+        _counters["retries"] += 1
+        await asyncio.sleep(backoff)
+
+
+def _chunk_text(event: dict) -> str:
+    parts = (event.get("candidates") or [{}])[0].get("content", {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+
+async def stream_content(payload: dict, deadline_s: Optional[float] = None) -> AsyncIterator[str]:
+    """Text chunks of a ``streamGenerateContent`` (SSE) response, as they arrive.
+
+    Same deadline, retries and circuit breaker as :func:`generate_content`,
+    but no hedging, and retries only until the first chunk arrived
+    (a half-consumed stream can't be replayed to the caller).
+    """
+    global _probe_in_flight
+    if not _admit():
+        _counters["rejected"] += 1
+        raise LLMUnavailable("Gemini circuit is open after repeated failures")
+    _counters["calls"] += 1
+    deadline = time.monotonic() + (deadline_s or GEMINI_DEADLINE_S)
+    url = f"{GEMINI_BASE_URL}/v1beta/models/{GEMINI_MODEL}:streamGenerateContent"
+
+    attempt = 0
+    received = False
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                async with asyncio.timeout_at(_loop_deadline(deadline)):
+                    async with _get_client().stream(
+                        "POST", url, params={"alt": "sse", "key": GEMINI_API_KEY}, json=payload
+                    ) as resp:
+                        if resp.status_code in _RETRY_STATUSES:
+                            await resp.aread()
+                            raise _RetryableStatus(resp)
+                        resp.raise_for_status()
+                        async for line in resp.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            text = _chunk_text(json.loads(line[5:]))
+                            if text:
+                                if not received:
+                                    received = True
+                                    _latencies.append(time.monotonic() - started)
+                                yield text
+                _record(True)
+                return
+            except (TimeoutError, _RetryableStatus, httpx.TransportError) as e:
+                error = e
+                if received:
+                    raise
+            attempt += 1
+            backoff = max(random.uniform(0, GEMINI_RETRY_BASE_S * 2 ** attempt), _retry_after(error) or 0.0)
+            if attempt > GEMINI_MAX_RETRIES or time.monotonic() + backoff >= deadline:
+                raise error
+            _counters["retries"] += 1
+            await asyncio.sleep(backoff)
+    except (GeneratorExit, asyncio.CancelledError):
+        # Consumer stopped reading: neither a success nor an upstream failure
+        _probe_in_flight = False
+        raise
+    except Exception as e:
+        _record(False)
+        reason = "deadline exceeded" if isinstance(e, TimeoutError) else str(e) or type(e).__name__
+        raise LLMError(f"Gemini stream failed after {attempt + 1} attempt(s): {reason}") from e
+
+
+def _loop_deadline(deadline: float) -> float:
+    """*deadline* (time.monotonic) on the event loop's clock."""
+    loop = asyncio.get_running_loop()
+    return loop.time() + (deadline - time.monotonic())
+
+
+# ---------------------------------------------------------------------------
+# Response cache
+# ---------------------------------------------------------------------------
+
+def _prompt_key(prompt: str) -> str:
+    return hashlib.sha256(f"{GEMINI_MODEL}\n{prompt}".encode()).hexdigest()
+
+
+async def remember_response(prompt: str, value):
+    await shared_cache().aput_json("llm", _prompt_key(prompt), value)
+
+
+async def cached_response(prompt: str):
+    return await shared_cache().aget_json("llm", _prompt_key(prompt))
+
+
+def stats() -> dict:
+    return {
+        **_counters,
+        "breaker": breaker_state(),
+        "consecutive_failures": _consecutive_failures,
+        "hedge_after_s": round(_hedge_delay(), 3),
+        "latency_samples": len(_latencies),
+    }
@@ -0,0 +1,512 @@
+"""
+End-to-end load test for the PDF service, with local stand-ins.
+
+Starts the FastAPI app (uvicorn, as in the Dockerfile) next to:
+
+- a static file server for ``template_url`` (serves ``--fixtures``,
+  plus a generated ``booking.pdf`` when no template is given), and
+- a mock Gemini ``generateContent`` endpoint with configurable latency,
+  wired into the app through ``GEMINI_API_KEY`` / ``GEMINI_BASE_URL``,
+
+then drives a mix of ``/generate-booking``, ``/html-to-pdf``,
+``/detect-fields`` and ``/extract-text`` at a fixed concurrency and
+reports throughput, p50/p95/p99 latency per endpoint and the RSS of the
+app and its render workers.
+
+    python loadtest.py --concurrency 8 --requests 400
+    python loadtest.py --mix generate-booking=8,extract-text=2 --duration 60
+    python loadtest.py --replay shapes.jsonl --concurrency 16 --json
+
+``--replay`` takes recorded, anonymized request shapes, one JSON object
+per line:
+
+    {"endpoint": "/generate-booking", "body": {...}}
+    {"endpoint": "/extract-text", "file": "fixtures/long.pdf"}
+    {"endpoint": "/html-to-pdf", "body": {"html": "..."}, "at_ms": 1250}
+
+``{static}`` inside a body is replaced with the static server's URL, so
+``"template_url": "{static}/hotel-17.pdf"`` resolves to a fixture.
+With ``at_ms`` the original arrival times are kept (open loop);
+otherwise lines are sent back to back by the concurrent clients.
+
+``--target URL`` skips starting the app and loads an already running
+service instead. Its RSS then comes from ``/metrics``, and Gemini is
+whatever that service is configured with.
+
+Environment for the started app is inherited, so e.g.
+``WORKER_PROCESSES=4 python loadtest.py`` sizes its worker pool.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Optional
+
+import httpx
+
+from memory import rss_bytes
+
+ENDPOINTS = ("generate-booking", "html-to-pdf", "detect-fields", "extract-text")
+DEFAULT_MIX = "generate-booking=5,html-to-pdf=2,detect-fields=1,extract-text=2"
+_MB = 1024 * 1024
+
+
+# ---------------------------------------------------------------------------
+# Stand-ins
+# ---------------------------------------------------------------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(handler, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"stand-in-{port}", daemon=True).start()
+    return server
+
+
+class _QuietStaticHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def start_static_server(directory: str) -> tuple[ThreadingHTTPServer, str]:
+    port = _free_port()
+    server = _serve(partial(_QuietStaticHandler, directory=directory), port)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def start_mock_gemini(latency_ms: float, jitter_ms: float) -> tuple[ThreadingHTTPServer, str]:
+    """Answers ``generateContent`` with a value for every field named in the prompt."""
+    from detect_fields import FIELD_DESCRIPTIONS
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            prompt = "".join(
+                part.get("text", "")
+                for content in body.get("contents", [])
+                for part in content.get("parts", [])
+            )
+            time.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+            mapping = {name: f"mock-{name}" for name in FIELD_DESCRIPTIONS if f"- {name}:" in prompt}
+            payload = json.dumps({
+                "candidates": [{"content": {"parts": [{"text": json.dumps(mapping)}]}}],
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    port = _free_port()
+    return _serve(Handler, port), f"http://127.0.0.1:{port}"
+
+
+def sample_booking_pdf() -> bytes:
+    """A one-page booking-like PDF for hosts without a real template."""
+    import pikepdf
+
+    lines = [
+        "Booking confirmation",
+        "CONFIRMATION NUMBER: 4821.553.017",
+        "PIN CODE: 7391",
+        "Guest name: JOHN SAMPLE",
+        "Check-in Thursday 14 MAY 2026 Check-out Sunday 17 MAY 2026",
+        "3 nights, 2 adults",
+        "Price TL 10,988 VAT 2,747 Total TL 13,735 (DKK 2,005.20)",
+        "Free cancellation until May 11, 2026 11:59 PM",
+        "john.sample@example.com",
+    ]
+    text = "BT /F1 11 Tf 56 780 Td 16 TL " + " ".join(
+        "(" + line.replace("(", r"\(").replace(")", r"\)") + ") Tj T*" for line in lines
+    ) + " ET"
+    pdf = pikepdf.new()
+    font = pdf.make_indirect(pikepdf.Dictionary(
+        Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1,
+        BaseFont=pikepdf.Name.Helvetica, Encoding=pikepdf.Name.WinAnsiEncoding,
+    ))
+    pdf.pages.append(pikepdf.Page(pikepdf.Dictionary(
+        Type=pikepdf.Name.Page,
+        MediaBox=[0, 0, 595, 842],
+        Resources=pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font)),
+        Contents=pdf.make_stream(text.encode()),
+    )))
+    out = BytesIO()
+    pdf.save(out)
+    return out.getvalue()
+
+
+def start_app(port: int, env: dict) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, **env},
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"App exited during startup with code {proc.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("App did not become healthy within 60 s")
+
+
+# ---------------------------------------------------------------------------
+# RSS sampling
+# ---------------------------------------------------------------------------
+
+def _process_tree(pid: int) -> list[int]:
+    pids = [pid]
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/task/{p}/children") as f:
+                pids.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+class RssSampler:
+    """Samples app + worker RSS: from /proc for a local app, else /metrics."""
+
+    def __init__(self, pid: Optional[int], base_url: str, interval: float = 0.5):
+        self.pid, self.base_url, self.interval = pid, base_url, interval
+        self.samples: list[tuple[int, int]] = []   # (web, workers) bytes
+
+    async def _sample(self, client: httpx.AsyncClient) -> tuple[int, int]:
+        if self.pid is not None:
+            tree = _process_tree(self.pid)
+            return rss_bytes(self.pid), sum(rss_bytes(p) for p in tree[1:])
+        resp = await client.get(f"{self.base_url}/metrics")
+        data = resp.json()
+        return data["memory"]["rss_bytes"], sum(data["workers"]["rss_bytes"].values())
+
+    async def run(self, stop: asyncio.Event):
+        async with httpx.AsyncClient(timeout=5) as client:
+            while not stop.is_set():
+                try:
+                    self.samples.append(await self._sample(client))
+                except (httpx.HTTPError, KeyError, ValueError):
+                    pass
+                try:
+                    await asyncio.wait_for(stop.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {}
+        totals = [web + wk for web, wk in self.samples]
+        return {
+            "web_peak_mb": round(max(web for web, _ in self.samples) / _MB, 1),
+            "workers_peak_mb": round(max(wk for _, wk in self.samples) / _MB, 1),
+            "total_peak_mb": round(max(totals) / _MB, 1),
+            "total_final_mb": round(totals[-1] / _MB, 1),
+        }
+
+
+# ---------------------------------------------------------------------------
+# Traffic
+# ---------------------------------------------------------------------------
+
+def parse_mix(spec: str) -> list[tuple[str, int]]:
+    mix = []
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition("=")
+        name = name.strip().lstrip("/")
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint in --mix: {name} (expected {', '.join(ENDPOINTS)})")
+        mix.append((name, int(weight or 1)))
+    return mix
+
+
+def _substitute(obj, static_url: str):
+    if isinstance(obj, str):
+        return obj.replace("{static}", static_url)
+    if isinstance(obj, list):
+        return [_substitute(v, static_url) for v in obj]
+    if isinstance(obj, dict):
+        return {k: _substitute(v, static_url) for k, v in obj.items()}
+    return obj
+
+
+class Synthetic:
+    """Request shapes for the generated traffic mix."""
+
+    def __init__(self, static_url: str, template_name: str, template_bytes: bytes):
+        self.template_url = f"{static_url}/{template_name}"
+        self.template_bytes = template_bytes
+
+    def generate_booking(self) -> dict:
+        day = random.randint(1, 20)
+        return {"endpoint": "/generate-booking", "body": {
+            "template_url": self.template_url,
+            "guest_name": random.choice(["Ayse Yilmaz", "Jens Hansen", "Maria Garcia"]),
+            "guest_email": "guest@example.com",
+            "checkin_date": f"2026-06-{day:02d}",
+            "checkout_date": f"2026-06-{day + random.randint(1, 7):02d}",
+            "num_guests": random.randint(1, 4),
+            "price_total_tl": round(random.uniform(2000, 30000), 2),
+            "price_total_dkk": round(random.uniform(300, 4500), 2),
+            "field_mapping": {
+                "confirmation_number": "4821.553.017",
+                "pin_code": "7391",
+                "guest_name": "JOHN SAMPLE",
+                "price_total_tl": "13,735",
+            },
+        }}
+
+    def html_to_pdf(self) -> dict:
+        rows = "".join(f"<tr><td>Item {i}</td><td>{random.randint(10, 999)}</td></tr>" for i in range(random.randint(5, 60)))
+        return {"endpoint": "/html-to-pdf", "body": {
+            "html": f"<html><body><h1>Invoice</h1><table>{rows}</table></body></html>",
+        }}
+
+    def _upload(self, endpoint: str) -> dict:
+        # Unique bytes per request, so /detect-fields can't answer from its cache
+        return {"endpoint": endpoint, "content": self.template_bytes + f"\n%{random.getrandbits(64):x}\n".encode()}
+
+    def next(self, endpoint: str) -> dict:
+        if endpoint == "generate-booking":
+            return self.generate_booking()
+        if endpoint == "html-to-pdf":
+            return self.html_to_pdf()
+        return self._upload(f"/{endpoint}")
+
+
+def load_replay(path: str, static_url: str) -> list[dict]:
+    base = os.path.dirname(os.path.abspath(path))
+    shapes = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            shape = _substitute(json.loads(line), static_url)
+            if "file" in shape:
+                with open(os.path.join(base, shape.pop("file")), "rb") as pdf:
+                    shape["content"] = pdf.read()
+            shapes.append(shape)
+    return shapes
+
+
+async def send(client: httpx.AsyncClient, base_url: str, api_key: str, shape: dict) -> tuple[str, float, bool]:
+    endpoint = shape["endpoint"]
+    headers = {"X-API-Key": api_key} if api_key else {}
+    started = time.perf_counter()
+    ok = False
+    try:
+        if "content" in shape:
+            resp = await client.post(
+                f"{base_url}{endpoint}", headers=headers,
+                files={"file": ("document.pdf", shape["content"], "application/pdf")},
+            )
+        else:
+            resp = await client.post(f"{base_url}{endpoint}", headers=headers, json=shape.get("body", {}))
+        ok = resp.status_code == 200 and not (
+            resp.headers.get("content-type", "").startswith("application/json")
+            and resp.json().get("status") == "error"
+        )
+    except httpx.HTTPError:
+        pass
+    return endpoint, time.perf_counter() - started, ok
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(results: list[tuple[str, float, bool]], elapsed: float, rss: dict) -> dict:
+    groups = defaultdict(list)
+    for endpoint, latency, ok in results:
+        groups[endpoint].append((latency, ok))
+        groups["all"].append((latency, ok))
+
+    endpoints = {}
+    for name, items in sorted(groups.items()):
+        latencies = sorted(latency for latency, _ in items)
+        endpoints[name] = {
+            "requests": len(items),
+            "errors": sum(1 for _, ok in items if not ok),
+            "throughput_rps": round(len(items) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+            "max_ms": round(latencies[-1] * 1000, 1),
+        }
+    return {"elapsed_s": round(elapsed, 2), "endpoints": endpoints, "rss": rss}
+
+
+def print_report(report: dict):
+    print(f"\n{report['elapsed_s']} s")
+    print(f"{'endpoint':<20}{'reqs':>7}{'errs':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, s in report["endpoints"].items():
+        print(
+            f"{name:<20}{s['requests']:>7}{s['errors']:>6}{s['throughput_rps']:>9}"
+            f"{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}{s['max_ms']:>9}"
+        )
+    if report["rss"]:
+        r = report["rss"]
+        print(
+            f"RSS peak: web {r['web_peak_mb']} MB, workers {r['workers_peak_mb']} MB, "
+            f"total {r['total_peak_mb']} MB (final {r['total_final_mb']} MB)"
+        )
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+async def run_load(args, base_url: str, static_url: str, app_pid: Optional[int], synthetic: Synthetic) -> dict:
+    results: list[tuple[str, float, bool]] = []
+    stop = asyncio.Event()
+    sampler = RssSampler(app_pid, base_url)
+    sampler_task = asyncio.create_task(sampler.run(stop))
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+
+        if args.replay:
+            shapes = load_replay(args.replay, static_url)
+            if any("at_ms" in s for s in shapes):
+                # Open loop: keep recorded arrival times, bounded by --concurrency
+                slots = asyncio.Semaphore(args.concurrency)
+
+                async def fire(shape):
+                    await asyncio.sleep(max(0.0, shape.get("at_ms", 0) / 1000 - (time.perf_counter() - started)))
+                    async with slots:
+                        results.append(await send(client, base_url, args.api_key, shape))
+
+                await asyncio.gather(*(fire(s) for s in shapes))
+                source = None
+            else:
+                source = iter(shapes)
+        else:
+            mix = parse_mix(args.mix)
+            names = [name for name, _ in mix]
+            weights = [weight for _, weight in mix]
+            total = args.requests if not args.duration else None
+            counter = itertools.count() if total is None else iter(range(total))
+            source = (synthetic.next(random.choices(names, weights)[0]) for _ in counter)
+
+        if source is not None:
+            deadline = started + args.duration if args.duration else None
+
+            async def client_loop():
+                for shape in source:
+                    if deadline and time.perf_counter() >= deadline:
+                        return
+                    results.append(await send(client, base_url, args.api_key, shape))
+
+            await asyncio.gather(*(client_loop() for _ in range(args.concurrency)))
+
+        elapsed = time.perf_counter() - started
+
+    stop.set()
+    await sampler_task
+    return summarize(results, elapsed, sampler.summary())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=200, help="total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="run for this many seconds instead")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"endpoint weights (default {DEFAULT_MIX})")
+    parser.add_argument("--replay", help="JSONL file of recorded request shapes")
+    parser.add_argument("--template", help="template PDF for /generate-booking and uploads (default: generated)")
+    parser.add_argument("--fixtures", help="directory served as {static} (default: a temp dir)")
+    parser.add_argument("--gemini-latency-ms", type=float, default=800)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=200)
+    parser.add_argument("--target", help="load an already running service at this URL")
+    parser.add_argument("--api-key", default=os.environ.get("PDF_SERVICE_API_KEY", ""))
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="pdf-loadtest-") as tmp:
+        fixtures = args.fixtures or tmp
+        if args.template:
+            with open(args.template, "rb") as f:
+                template_bytes = f.read()
+            template_name = os.path.basename(args.template)
+            if not os.path.exists(os.path.join(fixtures, template_name)):
+                with open(os.path.join(fixtures, template_name), "wb") as f:
+                    f.write(template_bytes)
+        else:
+            template_bytes, template_name = sample_booking_pdf(), "booking.pdf"
+            with open(os.path.join(fixtures, template_name), "wb") as f:
+                f.write(template_bytes)
+
+        static, static_url = start_static_server(fixtures)
+        gemini, gemini_url = start_mock_gemini(args.gemini_latency_ms, args.gemini_jitter_ms)
+        app = None
+        try:
+            if args.target:
+                base_url, app_pid = args.target.rstrip("/"), None
+            else:
+                port = _free_port()
+                app = start_app(port, {
+                    "GEMINI_API_KEY": "loadtest",
+                    "GEMINI_BASE_URL": gemini_url,
+                    "PDF_SERVICE_API_KEY": args.api_key,
+                    "CACHE_DB_PATH": os.path.join(tmp, "cache.sqlite3"),
+                })
+                base_url, app_pid = f"http://127.0.0.1:{port}", app.pid
+
+            synthetic = Synthetic(static_url, template_name, template_bytes)
+            report = asyncio.run(run_load(args, base_url, static_url, app_pid, synthetic))
+        finally:
+            if app is not None:
+                app.terminate()
+                try:
+                    app.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    app.kill()
+            static.shutdown()
+            gemini.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0 if all(s["errors"] == 0 for s in report["endpoints"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,47 @@
 import os
-import io
+import asyncio
+import tempfile
+import time
 import unicodedata
 from typing import Optional
 from datetime import datetime, timedelta
-from fastapi import FastAPI, File, Header, HTTPException, UploadFile
+from fastapi import FastAPI, File, Form, Header, HTTPException, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 import httpx
 import base64
+import json
 import random
-from replace_text import replace_text_in_pdf
+from replace_text import replace_text_with_stats
+import html_render
+import llm_client
+import workers
+import memory
+import profiling
+import cancellation
+from pdf_output import resolve_profile
+from text_extract import extract_pdf_text, extract_text_parallel
+from admission import limiter, snapshot as admission_snapshot
+from cache_store import shared_cache
+from config import env_int
+from storage import storage_enabled, upload_pdf
+from uploads import (
+    BUNDLE_MAX_BYTES, DETECT_BATCH_MAX_BYTES, UPLOAD_MAX_BYTES, UPLOAD_TMP_DIR,
+    read_upload, reject_oversized_uploads, spooled_upload,
+)
 
 app = FastAPI(title="Booking PDF Service")
+app.middleware("http")(reject_oversized_uploads)
+app.middleware("http")(memory.memory_middleware)
+app.middleware("http")(workers.request_class_middleware)
+app.add_middleware(cancellation.CancellationMiddleware)
+memory.start_tracing()
+memory.register_shrinker("cache", lambda: shared_cache().memory.shrink(0.25))
 PORT = int(os.environ.get("PORT", 8000))
 
 PDF_SERVICE_API_KEY = os.environ.get("PDF_SERVICE_API_KEY", "")
+TEMPLATE_CACHE_TTL = env_int("TEMPLATE_CACHE_TTL", 300)
 
 
 def verify_api_key(x_api_key: str = Header(default="")):
@@ -21,6 +49,55 @@ def verify_api_key(x_api_key: str = Header(default="")):
         raise HTTPException(status_code=401, detail="Invalid API key")
 
 
+def verify_storage(storage_path: Optional[str]):
+    if storage_path and not storage_enabled():
+        raise HTTPException(status_code=400, detail="storage_path given but storage upload is not configured")
+
+
+def require_configured_api_key(what: str):
+    """Refuse *what* outright when the service runs without an API key:
+    ``verify_api_key`` lets everyone through then."""
+    if not PDF_SERVICE_API_KEY:
+        raise HTTPException(status_code=403, detail=f"{what} requires PDF_SERVICE_API_KEY to be set")
+
+
+def verify_profile(x_profile: Optional[str]) -> Optional[str]:
+    """Profile mode from ``X-Profile``; only honoured behind a configured API key."""
+    try:
+        mode = profiling.requested_mode(x_profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if mode:
+        require_configured_api_key("Profiling")
+    return mode
+
+
+def verify_output_profile(name: Optional[str]) -> str:
+    try:
+        return resolve_profile(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def run_profiled(mode: Optional[str], runner, fn, *args):
+    """``await runner(fn, *args)``, under profiler *mode* when one is set.
+
+    Returns ``(result, artifact)``; artifact is None without profiling.
+    """
+    if not mode:
+        return await runner(fn, *args), None
+    return await runner(profiling.profiled_call, mode, fn, *args)
+
+
+async def pdf_result(pdf_bytes: bytes, storage_path: Optional[str]) -> dict:
+    """Success response: the PDF as base64, or, with *storage_path*, only
+    where it was stored and its checksum."""
+    if not storage_path:
+        return {"status": "success", "pdf_base64": base64.b64encode(pdf_bytes).decode()}
+    stored = await asyncio.to_thread(upload_pdf, pdf_bytes, storage_path)
+    return {"status": "success", **stored}
+
+
 # ---------------------------------------------------------------------------
 # /generate-booking — download template PDF, replace text, return new PDF
 # ---------------------------------------------------------------------------
@@ -39,29 +116,77 @@ class BookingRequest(BaseModel):
     refund_amount_tl: float = 0.0
     field_mapping: dict = {}
     cancel_days_before: int = 3
+    storage_path: Optional[str] = None   # upload to S3_BUCKET instead of returning base64
+    output_profile: Optional[str] = None  # pdf_output profile: fast, small or web
 
 
 @app.post("/generate-booking")
-async def generate_booking(req: BookingRequest, x_api_key: str = Header(default="")):
+async def generate_booking(
+    req: BookingRequest,
+    x_api_key: str = Header(default=""),
+    x_profile: Optional[str] = Header(default=None),
+):
     verify_api_key(x_api_key)
-    try:
-        # Download template PDF
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            resp = await client.get(req.template_url)
-            resp.raise_for_status()
-            template_bytes = resp.content
-
-        conf = req.confirmation_number or f"{random.randint(1000,9999)}.{random.randint(100,999)}.{random.randint(100,999)}"
-        pin = req.pin_code or f"{random.randint(1000,9999)}"
-
-        replacements = _build_replacements(req, conf, pin)
-        pdf_bytes = replace_text_in_pdf(template_bytes, replacements)
-
-        return {"status": "success", "pdf_base64": base64.b64encode(pdf_bytes).decode()}
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return {"status": "error", "error": str(e)}
+    verify_storage(req.storage_path)
+    profile = verify_profile(x_profile)
+    output_profile = verify_output_profile(req.output_profile)
+    async with limiter("generate-booking").slot():
+        try:
+            template_bytes = await _fetch_template(req.template_url)
+
+            conf = req.confirmation_number or f"{random.randint(1000,9999)}.{random.randint(100,999)}.{random.randint(100,999)}"
+            pin = req.pin_code or f"{random.randint(1000,9999)}"
+
+            replacements = _build_replacements(req, conf, pin)
+            (pdf_bytes, output), artifact = await run_profiled(
+                profile, workers.run, replace_text_with_stats, template_bytes, replacements, output_profile
+            )
+
+            result = await pdf_result(pdf_bytes, req.storage_path)
+            result["output"] = output
+            if artifact:
+                result["profile"] = profiling.profile_response(artifact, "/generate-booking")
+            return result
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return {"status": "error", "error": str(e)}
+
+
+async def _fetch_template(url: str) -> bytes:
+    """Template PDF bytes, from the shared cache when fresh.
+
+    Entries older than TEMPLATE_CACHE_TTL seconds are revalidated with a
+    conditional GET, so a re-uploaded template is picked up.
+    """
+    cache = shared_cache()
+    cached = await cache.aget("template", url)
+    now = time.time()
+    headers = {}
+    if cached is not None:
+        data, meta = cached
+        meta = meta or {}
+        if now - meta.get("fetched_at", 0) < TEMPLATE_CACHE_TTL:
+            return data
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        resp = await client.get(url, headers=headers)
+        if resp.status_code == 304 and cached is not None:
+            await cache.atouch("template", url, {**(cached[1] or {}), "fetched_at": now})
+            return cached[0]
+        resp.raise_for_status()
+        template_bytes = resp.content
+
+    await cache.aput("template", url, template_bytes, {
+        "fetched_at": now,
+        "etag": resp.headers.get("etag"),
+        "last_modified": resp.headers.get("last-modified"),
+    })
+    return template_bytes
 
 
 _TR_MAP = str.maketrans("çÇğĞıİöÖşŞüÜ", "cCgGiIoOsSuU")
@@ -122,6 +247,7 @@ def _build_replacements(req: BookingRequest, conf: str, pin: str) -> dict[str, s
         "num_nights": str(nights),
         "num_guests": str(req.num_guests),
         "num_guests_display": f"{req.num_guests} adult" if req.num_guests == 1 else f"{req.num_guests} adults",
+        "num_guests_note": f"(for {req.num_guests} guest)",
         "price_rooms": _fmt_tl(base_tl),
         "price_vat": _fmt_tl(vat_tl),
         "price_total_tl": _fmt_tl(total_tl),
@@ -152,22 +278,333 @@ def _build_replacements(req: BookingRequest, conf: str, pin: str) -> dict[str, s
     return replacements
 
 
+# ---------------------------------------------------------------------------
+# /generate-booking-html — render booking_confirmation.html with WeasyPrint
+# ---------------------------------------------------------------------------
+
+class BookingHtmlRequest(BaseModel):
+    guest_name: str
+    guest_email: str = ""
+    checkin_date: str          # YYYY-MM-DD
+    checkout_date: str         # YYYY-MM-DD
+    confirmation_number: Optional[str] = None
+    pin_code: Optional[str] = None
+    num_guests: int = 1
+    price_total_tl: float = 0.0
+    price_total_dkk: float = 0.0
+    refund_amount_tl: float = 0.0
+    hotel_config: dict = {}    # hotel_config JSONB from booking_hotels
+    hotel_record: dict = {}    # basic hotel fields (name, country, ...)
+    storage_path: Optional[str] = None
+    # "render": WeasyPrint per booking; "replace": text replacement on a
+    # per-hotel sentinel template (see booking_templates)
+    engine: str = "render"
+    output_profile: Optional[str] = None  # engine="replace" only, see pdf_output
+
+
+@app.post("/generate-booking-html")
+async def generate_booking_html(
+    req: BookingHtmlRequest,
+    x_api_key: str = Header(default=""),
+    x_profile: Optional[str] = Header(default=None),
+):
+    verify_api_key(x_api_key)
+    verify_storage(req.storage_path)
+    profile = verify_profile(x_profile)
+    output_profile = verify_output_profile(req.output_profile)
+    async with limiter("generate-booking-html").slot():
+        try:
+            if req.engine == "replace":
+                return await _generate_booking_replace(req, profile, output_profile)
+            if req.engine != "render":
+                raise ValueError(f"Unknown engine: {req.engine}")
+            from generate_booking_html import BookingData, render_booking_pdf
+            booking = BookingData(
+                guest_name=req.guest_name,
+                guest_email=req.guest_email,
+                confirmation_number=req.confirmation_number or f"{random.randint(1000,9999)}.{random.randint(100,999)}.{random.randint(100,999)}",
+                pin_code=req.pin_code or f"{random.randint(1000,9999)}",
+                checkin_date=req.checkin_date,
+                checkout_date=req.checkout_date,
+                num_guests=req.num_guests,
+                price_total_tl=req.price_total_tl,
+                price_total_dkk=req.price_total_dkk,
+                refund_amount_tl=req.refund_amount_tl,
+            )
+            pdf_bytes, artifact = await run_profiled(
+                profile, workers.run, render_booking_pdf, booking, req.hotel_config, req.hotel_record
+            )
+            result = await pdf_result(pdf_bytes, req.storage_path)
+            if artifact:
+                result["profile"] = profiling.profile_response(artifact, "/generate-booking-html")
+            return result
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return {"status": "error", "error": str(e)}
+
+
+async def _generate_booking_replace(req: BookingHtmlRequest, profile: Optional[str], output_profile: str) -> dict:
+    from booking_templates import sentinel_template
+
+    template_bytes, field_mapping = await workers.run(
+        sentinel_template, req.hotel_config, req.hotel_record, bool(req.refund_amount_tl)
+    )
+    booking = BookingRequest(
+        template_url="",
+        guest_name=req.guest_name,
+        guest_email=req.guest_email,
+        checkin_date=req.checkin_date,
+        checkout_date=req.checkout_date,
+        num_guests=req.num_guests,
+        price_total_tl=req.price_total_tl,
+        price_total_dkk=req.price_total_dkk,
+        refund_amount_tl=req.refund_amount_tl,
+        field_mapping=field_mapping,
+        cancel_days_before=int(req.hotel_config.get("cancel_days_before", 1)),
+    )
+    conf = req.confirmation_number or f"{random.randint(1000,9999)}.{random.randint(100,999)}.{random.randint(100,999)}"
+    pin = req.pin_code or f"{random.randint(1000,9999)}"
+    replacements = _build_replacements(booking, conf, pin)
+    if "guest_email" in field_mapping and not req.guest_email:
+        # Blank it rather than leave the sentinel address in the document
+        replacements[field_mapping["guest_email"]] = ""
+
+    (pdf_bytes, output), artifact = await run_profiled(
+        profile, workers.run, replace_text_with_stats, template_bytes, replacements, output_profile
+    )
+    result = await pdf_result(pdf_bytes, req.storage_path)
+    result["output"] = output
+    if artifact:
+        result["profile"] = profiling.profile_response(artifact, "/generate-booking-html")
+    return result
+
+
 # ---------------------------------------------------------------------------
 # /detect-fields — AI-powered field detection from uploaded PDF
 # ---------------------------------------------------------------------------
 
+async def _detection_result(detection, fp, sha256: str) -> dict:
+    """/detect-fields response for *detection*; cached unless degraded."""
+    result = {
+        "status": "success",
+        "field_mapping": detection.mapping,
+        "confidence": detection.confidence,
+        "sources": detection.sources,
+        "template_fingerprint": fp.digest if fp else None,
+    }
+    if detection.fallback:
+        # Degraded answer: don't let it stick in the cache
+        result["fallback"] = detection.fallback
+    else:
+        await shared_cache().aput_json("detection", sha256, result)
+    return result
+
+
+async def _cached_or_template_detection(pdf):
+    """``(cached response, detection from a known template, fingerprint)``;
+    the first two are None when the upload needs a full detection."""
+    from detect_fields import FieldDetection
+    from fingerprint import fingerprint_upload, match_template
+
+    # Same file seen before (by any worker)
+    cached = await shared_cache().aget_json("detection", pdf.sha256)
+    if cached is not None:
+        return {**cached, "cached": True}, None, None
+
+    # Known template structure: derive the mapping by position
+    fp = await asyncio.to_thread(fingerprint_upload, pdf)
+    mapping = await asyncio.to_thread(match_template, fp) if fp else None
+    if mapping is not None:
+        detection = FieldDetection(
+            mapping,
+            {name: 0.95 for name in mapping},
+            {name: "template" for name in mapping},
+        )
+        return None, detection, fp
+    return None, None, fp
+
+
 @app.post("/detect-fields")
 async def detect_fields(file: UploadFile = File(...), x_api_key: str = Header(default="")):
     verify_api_key(x_api_key)
+    async with limiter("detect-fields").slot():
+        try:
+            from detect_fields import detect_booking_fields_detailed
+            from fingerprint import remember_template
+            async with spooled_upload(file) as pdf:
+                cached, detection, fp = await _cached_or_template_detection(pdf)
+                if cached is not None:
+                    return cached
+                if detection is None:
+                    detection = await detect_booking_fields_detailed(pdf.path if pdf.on_disk else pdf.read_bytes())
+                    if fp and not detection.fallback:
+                        await asyncio.to_thread(remember_template, fp, detection.mapping)
+                result = await _detection_result(detection, fp, pdf.sha256)
+            return result
+        except HTTPException:
+            raise
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return {"status": "error", "error": str(e)}
+
+
+DETECT_BATCH_MAX_FILES = env_int("DETECT_BATCH_MAX_FILES", 50)
+
+
+@app.post("/detect-fields/batch")
+async def detect_fields_batch(files: list[UploadFile] = File(...), x_api_key: str = Header(default="")):
+    """/detect-fields for many PDFs (e.g. a hotel chain) at once.
+
+    Text is extracted from all uploads in parallel in the render workers,
+    and the fields local rules miss are asked about in as few Gemini
+    calls as the token budget allows (see
+    ``detect_fields.detect_fields_batch``). ``documents`` has one entry
+    per upload, in order, each either the usual /detect-fields body plus
+    ``filename`` or ``{"filename", "status": "error", "error"}``.
+    """
+    verify_api_key(x_api_key)
+    if not files or len(files) > DETECT_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"files must contain 1-{DETECT_BATCH_MAX_FILES} PDFs")
+    async with limiter("detect-fields-batch").slot():
+        from detect_fields import detect_fields_batch as detect_batch, extract_document_text
+        from fingerprint import remember_template
+
+        documents: list[Optional[dict]] = [None] * len(files)
+        spooled = {}
+        try:
+            budget = DETECT_BATCH_MAX_BYTES
+            for i, f in enumerate(files):
+                try:
+                    pdf = await read_upload(f, min(UPLOAD_MAX_BYTES, budget))
+                except HTTPException as e:
+                    documents[i] = {"status": "error", "error": e.detail}
+                    continue
+                spooled[i] = pdf
+                budget -= pdf.size
+
+            # Cached and known-template documents need no extraction
+            fingerprints = {}
+            for i, pdf in spooled.items():
+                try:
+                    cached, detection, fp = await _cached_or_template_detection(pdf)
+                except Exception as e:
+                    documents[i] = {"status": "error", "error": str(e)}
+                    continue
+                fingerprints[i] = fp
+                if cached is not None:
+                    documents[i] = cached
+                elif detection is not None:
+                    documents[i] = await _detection_result(detection, fp, pdf.sha256)
+
+            todo = [i for i in spooled if documents[i] is None]
+            texts = await asyncio.gather(
+                *(workers.run(extract_document_text, spooled[i].path if spooled[i].on_disk else spooled[i].read_bytes())
+                  for i in todo),
+                return_exceptions=True,
+            )
+            extracted = [(i, text) for i, text in zip(todo, texts) if not isinstance(text, BaseException)]
+            for i, text in zip(todo, texts):
+                if isinstance(text, BaseException):
+                    documents[i] = {"status": "error", "error": str(text)}
+
+            detections, model_calls = await detect_batch([text for _, text in extracted])
+            for (i, _), detection in zip(extracted, detections):
+                if isinstance(detection, Exception):
+                    documents[i] = {"status": "error", "error": str(detection)}
+                    continue
+                fp = fingerprints.get(i)
+                if fp and not detection.fallback:
+                    await asyncio.to_thread(remember_template, fp, detection.mapping)
+                documents[i] = await _detection_result(detection, fp, spooled[i].sha256)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return {"status": "error", "error": str(e)}
+        finally:
+            for pdf in spooled.values():
+                pdf.close()
+
+    return {
+        "status": "success",
+        "documents": [{"filename": f.filename, **doc} for f, doc in zip(files, documents)],
+        "model_calls": model_calls,
+    }
+
+
+def _sse(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+async def _replay_events(result: dict):
+    for name, value in result.get("field_mapping", {}).items():
+        yield _sse("field", {
+            "name": name,
+            "value": value,
+            "confidence": result.get("confidence", {}).get(name),
+            "source": result.get("sources", {}).get(name),
+        })
+    yield _sse("done", result)
+
+
+async def _detection_events(text: str, fp, sha256: str):
+    from detect_fields import stream_fields_in_text
+    from fingerprint import remember_template
     try:
-        from detect_fields import detect_booking_fields
-        pdf_bytes = await file.read()
-        mapping = await detect_booking_fields(pdf_bytes)
-        return {"status": "success", "field_mapping": mapping}
+        async for kind, payload in stream_fields_in_text(text):
+            if kind == "field":
+                yield _sse("field", payload)
+                continue
+            if fp and not payload.fallback:
+                await asyncio.to_thread(remember_template, fp, payload.mapping)
+            yield _sse("done", await _detection_result(payload, fp, sha256))
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return {"status": "error", "error": str(e)}
+        yield _sse("error", {"status": "error", "error": str(e)})
+
+
+def _event_stream(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/detect-fields/stream")
+async def detect_fields_stream(file: UploadFile = File(...), x_api_key: str = Header(default="")):
+    """/detect-fields as server-sent events.
+
+    ``field`` events carry ``{name, value, confidence, source}`` as soon
+    as a field is known: local and template matches first, Gemini fields
+    as the model streams them. A final ``done`` event carries the same
+    body /detect-fields returns; failures end with an ``error`` event.
+
+    The admission slot covers the CPU part (spooling, fingerprinting,
+    text extraction), not the wait for Gemini.
+    """
+    verify_api_key(x_api_key)
+    async with limiter("detect-fields").slot():
+        try:
+            async with spooled_upload(file) as pdf:
+                cached, detection, fp = await _cached_or_template_detection(pdf)
+                if cached is not None:
+                    return _event_stream(_replay_events(cached))
+                if detection is not None:
+                    return _event_stream(_replay_events(await _detection_result(detection, fp, pdf.sha256)))
+                text = (await extract_text_parallel(pdf.path if pdf.on_disk else pdf.read_bytes())).strip()
+                sha256 = pdf.sha256
+            if not text:
+                raise ValueError("Could not extract text from PDF")
+        except HTTPException:
+            raise
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return _event_stream(iter([_sse("error", {"status": "error", "error": str(e)})]))
+    return _event_stream(_detection_events(text, fp, sha256))
 
 
 # ---------------------------------------------------------------------------
@@ -176,25 +613,207 @@ async def detect_fields(file: UploadFile = File(...), x_api_key: str = Header(de
 
 class HtmlToPdfRequest(BaseModel):
     html: str
+    storage_path: Optional[str] = None
 
 @app.post("/html-to-pdf")
-async def html_to_pdf(req: HtmlToPdfRequest, x_api_key: str = Header(default="")):
+async def html_to_pdf(
+    req: HtmlToPdfRequest,
+    x_api_key: str = Header(default=""),
+    x_profile: Optional[str] = Header(default=None),
+):
     verify_api_key(x_api_key)
-    try:
-        from weasyprint import HTML
-        from weasyprint.urls import default_url_fetcher
+    verify_storage(req.storage_path)
+    profile = verify_profile(x_profile)
+    async with limiter("html-to-pdf").slot():
+        try:
+            pdf_bytes, artifact = await run_profiled(profile, workers.run, html_render.render_html, req.html)
+            result = await pdf_result(pdf_bytes, req.storage_path)
+            if artifact:
+                result["profile"] = profiling.profile_response(artifact, "/html-to-pdf")
+            return result
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return {"status": "error", "error": str(e)}
 
-        def safe_url_fetcher(url, timeout=10, ssl_context=None):
-            if url.startswith("data:") or url.startswith("https://"):
-                return default_url_fetcher(url, timeout=timeout, ssl_context=ssl_context)
-            raise ValueError(f"Blocked URL fetch: {url}")
 
-        pdf_bytes = HTML(string=req.html, url_fetcher=safe_url_fetcher).write_pdf()
-        return {"status": "success", "pdf_base64": base64.b64encode(pdf_bytes).decode()}
+# ---------------------------------------------------------------------------
+# /html-to-pdf/batch — many documents sharing stylesheet and assets
+# ---------------------------------------------------------------------------
+
+HTML_BATCH_MAX_DOCUMENTS = env_int("HTML_BATCH_MAX_DOCUMENTS", 100)
+
+
+class HtmlBatchDocument(BaseModel):
+    html: str
+    name: Optional[str] = None
+    storage_path: Optional[str] = None   # "stream" output only
+
+
+class HtmlToPdfBatchRequest(BaseModel):
+    documents: list[HtmlBatchDocument]
+    stylesheet: str = ""        # CSS applied to every document, parsed once per worker
+    output: str = "stream"      # "stream" (NDJSON, one PDF per line) | "merged"
+    storage_path: Optional[str] = None   # "merged" output only
+
+
+@app.post("/html-to-pdf/batch")
+async def html_to_pdf_batch(req: HtmlToPdfBatchRequest, x_api_key: str = Header(default="")):
+    verify_api_key(x_api_key)
+    if req.output not in ("stream", "merged"):
+        raise HTTPException(status_code=400, detail="output must be 'stream' or 'merged'")
+    if not req.documents or len(req.documents) > HTML_BATCH_MAX_DOCUMENTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"documents must contain 1-{HTML_BATCH_MAX_DOCUMENTS} entries",
+        )
+    verify_storage(req.storage_path)
+    for doc in req.documents:
+        verify_storage(doc.storage_path)
+
+    lim = limiter("html-to-pdf-batch")
+    await lim.acquire()
+    renders: list = []
+    stream = None
+    try:
+        renders = [
+            asyncio.ensure_future(workers.run(html_render.render_html, doc.html, req.stylesheet))
+            for doc in req.documents
+        ]
+        if req.output == "stream":
+            # Stream each PDF as soon as it is rendered; from here on the
+            # response owns the slot and the renders.
+            stream = _BatchStream(renders, req.documents, lim)
+            return stream
+
+        pdfs = await asyncio.gather(*renders)
+        merged = await workers.run(html_render.merge_pdfs, pdfs)
+        return {**await pdf_result(merged, req.storage_path), "count": len(pdfs)}
     except Exception as e:
         import traceback
         traceback.print_exc()
         return {"status": "error", "error": str(e)}
+    finally:
+        if stream is None:
+            _end_batch(renders, lim)
+
+
+def _end_batch(renders: list, lim):
+    for r in renders:
+        r.cancel()
+    lim.release()
+
+
+class _BatchStream(StreamingResponse):
+    """NDJSON lines of a batch, in the order the renders finish.
+
+    The admission slot and unfinished renders are released however the
+    response ends: all lines sent, client gone before or during the
+    stream, or an error on the way out. The body generator's own
+    ``finally`` would not run if the stream never started.
+    """
+
+    def __init__(self, renders: list, documents, lim):
+        super().__init__(_stream_batch(renders, documents), media_type="application/x-ndjson")
+        self.renders = renders
+        self.lim = lim
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            _end_batch(self.renders, self.lim)
+
+
+async def _stream_batch(renders: list, documents):
+    index = {r: i for i, r in enumerate(renders)}
+    done: asyncio.Queue = asyncio.Queue()
+    for r in renders:
+        r.add_done_callback(done.put_nowait)
+    for _ in range(len(renders)):
+        fut = await done.get()
+        i = index[fut]
+        line = {"index": i, "name": documents[i].name}
+        try:
+            line.update(await pdf_result(fut.result(), documents[i].storage_path))
+        except Exception as e:
+            line["status"] = "error"
+            line["error"] = str(e)
+        yield json.dumps(line) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# /bundle — merge several PDFs into one dossier, sharing font programs
+# ---------------------------------------------------------------------------
+
+BUNDLE_MAX_FILES = env_int("BUNDLE_MAX_FILES", 20)
+
+
+@app.post("/bundle")
+async def bundle(
+    files: list[UploadFile] = File(...),
+    storage_path: Optional[str] = Form(None),
+    x_api_key: str = Header(default=""),
+):
+    """Merge the uploaded PDFs, in upload order, into one PDF.
+
+    Returns the merged PDF directly (``application/pdf``), streamed from
+    a temporary file; sizes and deduplication stats are in the
+    ``X-Bundle-*`` response headers. ``X-Bundle-Fonts-Deduplicated``
+    counts byte-identical font programs only, see ``bundle``. With *storage_path* the dossier is
+    uploaded to storage instead and the response is JSON.
+    """
+    verify_api_key(x_api_key)
+    verify_storage(storage_path)
+    if not files or len(files) > BUNDLE_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"files must contain 1-{BUNDLE_MAX_FILES} PDFs")
+    from bundle import build_bundle
+    async with limiter("bundle").slot():
+        spooled = []
+        out_path = None
+        try:
+            budget = BUNDLE_MAX_BYTES
+            for f in files:
+                pdf = await read_upload(f, min(UPLOAD_MAX_BYTES, budget))
+                spooled.append(pdf)
+                budget -= pdf.size
+
+            fd, out_path = tempfile.mkstemp(prefix="bundle-", suffix=".pdf", dir=UPLOAD_TMP_DIR)
+            os.close(fd)
+            # Spooled files are handed to the worker by path, small ones as bytes
+            sources = [pdf.path if pdf.on_disk else pdf.read_bytes() for pdf in spooled]
+            stats = await workers.run(build_bundle, sources, out_path)
+            if storage_path:
+                stored = await asyncio.to_thread(upload_pdf, out_path, storage_path)
+                os.unlink(out_path)
+                return {"status": "success", **stored, "bundle": stats}
+        except HTTPException:
+            if out_path:
+                os.unlink(out_path)
+            raise
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            if out_path:
+                os.unlink(out_path)
+            return {"status": "error", "error": str(e)}
+        finally:
+            for pdf in spooled:
+                pdf.close()
+
+    return FileResponse(
+        out_path,
+        media_type="application/pdf",
+        filename="dossier.pdf",
+        headers={
+            "X-Bundle-Documents": str(stats["documents"]),
+            "X-Bundle-Pages": str(stats["pages"]),
+            "X-Bundle-Input-Bytes": str(stats["input_bytes"]),
+            "X-Bundle-Output-Bytes": str(stats["output_bytes"]),
+            "X-Bundle-Fonts-Deduplicated": str(stats["fonts_deduplicated"]),
+        },
+        background=BackgroundTask(os.unlink, out_path),
+    )
 
 
 # ---------------------------------------------------------------------------
@@ -202,17 +821,38 @@ async def html_to_pdf(req: HtmlToPdfRequest, x_api_key: str = Header(default="")
 # ---------------------------------------------------------------------------
 
 @app.post("/extract-text")
-async def extract_text(file: UploadFile = File(...), x_api_key: str = Header(default="")):
+async def extract_text(
+    file: UploadFile = File(...),
+    x_api_key: str = Header(default=""),
+    x_profile: Optional[str] = Header(default=None),
+):
     verify_api_key(x_api_key)
-    try:
-        from pdfminer.high_level import extract_text as pdfminer_extract
-        content = await file.read()
-        text = pdfminer_extract(io.BytesIO(content))
-        return {"status": "success", "text": text.strip()}
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return {"status": "error", "error": str(e)}
+    profile = verify_profile(x_profile)
+    async with limiter("extract-text").slot():
+        try:
+            async with spooled_upload(file) as pdf:
+                source = pdf.path if pdf.on_disk else pdf.read_bytes()
+                if profile:
+                    # One process, so the profile covers the whole extraction
+                    text, artifact = await run_profiled(profile, workers.run, extract_pdf_text, source)
+                else:
+                    text, artifact = await extract_text_parallel(source), None
+            result = {"status": "success", "text": text.strip()}
+            if artifact:
+                result["profile"] = profiling.profile_response(artifact, "/extract-text")
+            return result
+        except HTTPException:
+            raise
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return {"status": "error", "error": str(e)}
+
+
+@app.on_event("shutdown")
+async def _shutdown_workers():
+    workers.shutdown()
+    await llm_client.aclose()
 
 
 @app.get("/health")
@@ -220,6 +860,41 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Per-endpoint queue depth and slot utilization (for autoscaling)."""
+    return {
+        "endpoints": admission_snapshot(),
+        "cache": await shared_cache().astats(),
+        "memory": memory.stats(),
+        "workers": workers.stats(),
+        "llm": llm_client.stats(),
+        "cancellation": cancellation.stats(),
+    }
+
+
+@app.get("/debug/memory")
+async def debug_memory(
+    limit: int = 25,
+    group_by: str = "lineno",
+    reset: bool = False,
+    x_api_key: str = Header(default=""),
+):
+    """Top allocation sites since the last reset (tracemalloc snapshot diff).
+
+    Exposes source paths, so only served behind a configured API key.
+    """
+    require_configured_api_key("/debug/memory")
+    verify_api_key(x_api_key)
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    try:
+        allocations = await asyncio.to_thread(memory.top_allocations, limit, group_by, reset)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {**memory.stats(), "workers": workers.stats(), "allocations": allocations}
+
+
 @app.get("/debug")
 async def debug():
     """Debug endpoint to check environment."""
@@ -253,3 +928,12 @@ async def debug():
     info["segoeuib.ttf"] = os.path.exists(segoe_bold)
 
     return info
+
+
+# ---------------------------------------------------------------------------
+# Gateway mode: same image and entry point, but route to replicas instead
+# ---------------------------------------------------------------------------
+
+if os.environ.get("PDF_SERVICE_MODE", "").strip().lower() == "gateway":
+    import gateway
+    app = gateway.create_app()  # noqa: F811
@@ -0,0 +1,271 @@
+"""
+Memory governance for the web process and its workers.
+
+pikepdf documents, WeasyPrint layouts and fontTools objects are large
+and glibc rarely hands freed arenas back, so RSS creeps on long-running
+pods. This module:
+
+- measures RSS (``/proc``) of the web process and the render workers,
+- tracks per-request peak Python allocation with ``tracemalloc`` when
+  ``MEMORY_TRACE`` is on (it costs ~10-30 % CPU, keep it off normally):
+  in the web process, and for each job in the render workers, which
+  report it back with the job's result,
+- calls registered shrink hooks (cache trimming, ``gc``, ``malloc_trim``)
+  once RSS crosses ``MEMORY_SOFT_LIMIT_MB``,
+- asks the web process to restart itself (SIGTERM, graceful) after
+  ``MAX_REQUESTS`` requests or above ``MAX_RSS_MB``; run it under a
+  supervisor that restarts it (Kubernetes, gunicorn, systemd),
+- produces top allocation sites as a tracemalloc snapshot diff for
+  ``/debug/memory``.
+
+Worker recycling (``WORKER_MAX_TASKS``, ``WORKER_MAX_RSS_MB``) lives in
+``workers``.
+
+Every limit defaults to 0 = disabled.
+"""
+from __future__ import annotations
+
+import contextvars
+import ctypes
+import gc
+import os
+import signal
+import sys
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+from config import env_bool, env_int
+
+MEMORY_TRACE = env_bool("MEMORY_TRACE")
+MEMORY_TRACE_FRAMES = env_int("MEMORY_TRACE_FRAMES", 8)
+MEMORY_SOFT_LIMIT_MB = env_int("MEMORY_SOFT_LIMIT_MB", 0)
+MAX_REQUESTS = env_int("MAX_REQUESTS", 0)
+MAX_RSS_MB = env_int("MAX_RSS_MB", 0)
+# RSS is read from /proc every this many requests, not on each one
+MEMORY_CHECK_EVERY = max(1, env_int("MEMORY_CHECK_EVERY", 10))
+# Minimum seconds between two shrinks while RSS stays above the soft limit
+MEMORY_SHRINK_INTERVAL = env_int("MEMORY_SHRINK_INTERVAL", 30)
+
+_MB = 1024 * 1024
+
+_shrinkers: list[tuple[str, Callable[[], None]]] = []
+_baseline: Optional[tracemalloc.Snapshot] = None
+
+_requests = 0
+_in_flight = 0
+_recycling = False
+_shrinks = 0
+_last_shrink = 0.0
+_last_rss = 0
+# Route template -> largest per-request peaks seen, web process and worker job
+_peaks: dict[str, dict[str, int]] = {}
+_request_peaks: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_peaks", default=None)
+
+
+# ---------------------------------------------------------------------------
+# Measurements
+# ---------------------------------------------------------------------------
+
+def rss_bytes(pid="self") -> int:
+    """Resident set size of *pid* from /proc (0 where /proc is unavailable)."""
+    try:
+        with open(f"/proc/{pid}/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def start_tracing():
+    global _baseline
+    if MEMORY_TRACE and not tracemalloc.is_tracing():
+        tracemalloc.start(MEMORY_TRACE_FRAMES)
+        _baseline = tracemalloc.take_snapshot()
+
+
+def traced_call(fn, *args):
+    """``(fn(*args), peak bytes it allocated)``; the peak is 0 when not tracing.
+
+    Exact only where nothing else allocates meanwhile, as in a worker
+    process running one job at a time.
+    """
+    if not tracemalloc.is_tracing():
+        return fn(*args), 0
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    result = fn(*args)
+    return result, max(0, tracemalloc.get_traced_memory()[1] - start)
+
+
+def record_worker_peak(peak: int):
+    """Count a worker job's peak allocation towards the current request."""
+    request = _request_peaks.get()
+    if request is not None and peak > request["worker"]:
+        request["worker"] = peak
+
+
+# ---------------------------------------------------------------------------
+# Pressure handling
+# ---------------------------------------------------------------------------
+
+def register_shrinker(name: str, fn: Callable[[], None]):
+    """Register *fn* to release memory (e.g. trim a cache) under pressure."""
+    _shrinkers.append((name, fn))
+
+
+def _malloc_trim():
+    """Return freed heap pages to the OS (glibc only)."""
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def shrink():
+    """Run every shrink hook, then collect garbage and trim the heap."""
+    global _shrinks, _last_shrink
+    _shrinks += 1
+    _last_shrink = time.monotonic()
+    for name, fn in _shrinkers:
+        try:
+            fn()
+        except Exception as e:
+            print(f"[memory] shrinker {name} failed: {e}", file=sys.stderr, flush=True)
+    gc.collect()
+    _malloc_trim()
+
+
+def _recycle(reason: str):
+    """Ask the server to shut down gracefully so the supervisor restarts it."""
+    global _recycling
+    if _recycling:
+        return
+    _recycling = True
+    print(f"[memory] recycling web process: {reason}", file=sys.stderr, flush=True)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _check():
+    global _last_rss
+    rss = rss_bytes()
+    _last_rss = rss
+    if (
+        MEMORY_SOFT_LIMIT_MB
+        and rss > MEMORY_SOFT_LIMIT_MB * _MB
+        and time.monotonic() - _last_shrink >= MEMORY_SHRINK_INTERVAL
+    ):
+        before = rss
+        shrink()
+        _last_rss = rss = rss_bytes()
+        print(
+            f"[memory] RSS {before // _MB} MB over soft limit, shrank to {rss // _MB} MB",
+            file=sys.stderr, flush=True,
+        )
+    if MAX_RSS_MB and rss > MAX_RSS_MB * _MB:
+        _recycle(f"RSS {rss // _MB} MB > MAX_RSS_MB={MAX_RSS_MB}")
+    elif MAX_REQUESTS and _requests >= MAX_REQUESTS:
+        _recycle(f"served {_requests} requests (MAX_REQUESTS={MAX_REQUESTS})")
+
+
+# ---------------------------------------------------------------------------
+# Middleware
+# ---------------------------------------------------------------------------
+
+async def memory_middleware(request, call_next):
+    """Per-request peak allocation (when tracing) and periodic RSS checks."""
+    global _requests, _in_flight
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # The peak is process-wide: with overlapping requests it is an
+        # upper bound for each of them.
+        if _in_flight == 0:
+            tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        request_peaks = {"worker": 0}
+        _request_peaks.set(request_peaks)
+    _in_flight += 1
+    try:
+        response = await call_next(request)
+    finally:
+        _in_flight -= 1
+        _requests += 1
+
+    if tracing:
+        _, peak = tracemalloc.get_traced_memory()
+        used = max(0, peak - start)
+        worker = request_peaks["worker"]
+        response.headers["X-Memory-Peak-KB"] = str(used // 1024)
+        if worker:
+            response.headers["X-Worker-Memory-Peak-KB"] = str(worker // 1024)
+        # By route template, so unmatched and parametrized paths don't
+        # add entries without bound
+        route = getattr(request.scope.get("route"), "path", None)
+        if route is not None:
+            seen = _peaks.setdefault(route, {"web": 0, "worker": 0})
+            seen["web"] = max(seen["web"], used)
+            seen["worker"] = max(seen["worker"], worker)
+
+    if _requests % MEMORY_CHECK_EVERY == 0:
+        _check()
+    return response
+
+
+# ---------------------------------------------------------------------------
+# Diagnostics
+# ---------------------------------------------------------------------------
+
+def stats() -> dict:
+    out = {
+        "rss_bytes": _last_rss or rss_bytes(),
+        "requests": _requests,
+        "shrinks": _shrinks,
+        "tracing": tracemalloc.is_tracing(),
+        "limits_mb": {"soft": MEMORY_SOFT_LIMIT_MB, "max_rss": MAX_RSS_MB},
+        "max_requests": MAX_REQUESTS,
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        out["traced_bytes"] = current
+        out["request_peaks_bytes"] = dict(sorted(_peaks.items()))
+    return out
+
+
+def top_allocations(limit: int = 25, group_by: str = "lineno", reset: bool = False) -> dict:
+    """Top allocation sites, as growth since the baseline snapshot.
+
+    The baseline is taken when tracing starts; *reset* moves it to now
+    (after computing the diff), so the next call shows only new growth.
+    """
+    global _baseline
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is off; start the service with MEMORY_TRACE=1")
+    started = time.perf_counter()
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    diff = snapshot.compare_to(_baseline, group_by) if _baseline is not None else snapshot.statistics(group_by)
+    sites = []
+    for stat in diff[:limit]:
+        site = {
+            "size_bytes": stat.size,
+            "count": stat.count,
+            "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+        }
+        if hasattr(stat, "size_diff"):
+            site["size_diff_bytes"] = stat.size_diff
+            site["count_diff"] = stat.count_diff
+        sites.append(site)
+    if reset:
+        _baseline = snapshot
+    return {
+        "group_by": group_by,
+        "traced_bytes": tracemalloc.get_traced_memory()[0],
+        "sites": sites,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
@@ -0,0 +1,149 @@
+"""
+On-demand profiling of a single request.
+
+A caller holding the service API key can send ``X-Profile: cprofile`` or
+``X-Profile: stacks`` to ``/generate-booking``, ``/html-to-pdf`` or
+``/extract-text``. The expensive part of the request then runs under a
+profiler, and the profile is returned next to the normal result. This
+makes it possible to see why one particular hotel template is slow
+without reproducing it locally.
+
+- ``cprofile``: deterministic, via ``cProfile``. The artifact is a
+  ``pstats`` dump (load it with ``pstats.Stats`` or snakeviz), plus a
+  text summary of the top functions by cumulative time.
+- ``stacks``: sampling. A helper thread records the stack of the
+  working thread every ``PROFILE_SAMPLE_INTERVAL_MS``. The output is
+  collapsed stacks ("a;b;c 42" per line), ready for flamegraph.pl or
+  speedscope. The overhead is low enough for large documents.
+
+With ``PROFILE_DIR`` set, artifacts are written there and only their
+path is returned.
+
+``profiled_call`` is picklable, so the same wrapper works for work run
+in a thread (``asyncio.to_thread``) and in a render worker
+(``workers.run``).
+"""
+from __future__ import annotations
+
+import base64
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from config import env_int
+
+PROFILE_MODES = ("cprofile", "stacks")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "")
+PROFILE_SAMPLE_INTERVAL_MS = max(1, env_int("PROFILE_SAMPLE_INTERVAL_MS", 5))
+_SUMMARY_LINES = 30
+
+
+# ---------------------------------------------------------------------------
+# Profilers
+# ---------------------------------------------------------------------------
+
+def _run_cprofile(fn, args) -> tuple[object, dict]:
+    prof = cProfile.Profile()
+    result = prof.runcall(fn, *args)
+    prof.create_stats()
+
+    summary = io.StringIO()
+    pstats.Stats(prof, stream=summary).sort_stats("cumulative").print_stats(_SUMMARY_LINES)
+    return result, {
+        "format": "pstats",
+        "data": marshal.dumps(prof.stats),
+        "summary": summary.getvalue(),
+    }
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _run_sampler(fn, args) -> tuple[object, dict]:
+    target = threading.get_ident()
+    interval = PROFILE_SAMPLE_INTERVAL_MS / 1000.0
+    samples: Counter = Counter()
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                samples[";".join(reversed(stack))] += 1
+
+    sampler = threading.Thread(target=sample, name="profile-sampler", daemon=True)
+    sampler.start()
+    try:
+        result = fn(*args)
+    finally:
+        done.set()
+        sampler.join()
+
+    collapsed = "\n".join(f"{stack} {n}" for stack, n in samples.most_common())
+    top = Counter()
+    for stack, n in samples.items():
+        top[stack.rsplit(";", 1)[-1]] += n
+    total = sum(samples.values())
+    summary = "\n".join(f"{n * 100 / total:5.1f}%  {fn_}" for fn_, n in top.most_common(_SUMMARY_LINES))
+    return result, {
+        "format": "collapsed",
+        "data": collapsed.encode(),
+        "summary": f"{total} samples every {PROFILE_SAMPLE_INTERVAL_MS} ms (self time)\n{summary}",
+    }
+
+
+def profiled_call(mode: str, fn, *args) -> tuple[object, dict]:
+    """Run ``fn(*args)`` under profiler *mode*; returns ``(result, artifact)``."""
+    started = time.perf_counter()
+    if mode == "cprofile":
+        result, artifact = _run_cprofile(fn, args)
+    elif mode == "stacks":
+        result, artifact = _run_sampler(fn, args)
+    else:
+        raise ValueError(f"Unknown profile mode: {mode}")
+    artifact["mode"] = mode
+    artifact["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result, artifact
+
+
+# ---------------------------------------------------------------------------
+# Response shaping
+# ---------------------------------------------------------------------------
+
+def profile_response(artifact: dict, endpoint: str) -> dict:
+    """JSON-ready profile: inline as base64, or the file path under ``PROFILE_DIR``."""
+    data = artifact.pop("data")
+    if PROFILE_DIR:
+        ext = "prof" if artifact["format"] == "pstats" else "folded"
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint.strip('/').replace('/', '-')}-{os.getpid()}.{ext}"
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        artifact["path"] = path
+    else:
+        artifact["data_base64"] = base64.b64encode(data).decode()
+    return artifact
+
+
+def requested_mode(header: Optional[str]) -> Optional[str]:
+    """Profile mode asked for by the ``X-Profile`` header, or None."""
+    if not header:
+        return None
+    mode = header.strip().lower()
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"X-Profile must be one of {', '.join(PROFILE_MODES)}")
+    return mode
@@ -8,88 +8,185 @@ glyphs so that new characters (digits, letters) are always available.
 
 After replacement, text positioning (Tm operators) is adjusted so that
 centered text stays centered and right-aligned text stays right-aligned.
+
+All phases work on one list of content streams (``content_streams``):
+pages, Form XObjects and annotation appearance streams, each visited
+once however many pages share it.
+
+The result is saved under one of the ``pdf_output`` profiles.
 """
 from __future__ import annotations
 
 import os
 import sys
+from dataclasses import dataclass
+
 import pikepdf
 from io import BytesIO
 from fontTools.ttLib import TTFont
 
+from pdf_output import resolve_profile, save_pdf
+from workers import checkpoint
+
 FONTS_DIR = os.path.join(os.path.dirname(__file__), "fonts")
 
+# Set on fonts that already embed their complete program (booking
+# templates): they keep their own glyphs and widths, no Segoe UI swap
+COMPLETE_FONT = "/PDFServiceCompleteFont"
+
+
+def replace_text_in_pdf(template_bytes: bytes, replacements: dict[str, str], output_profile: str | None = None) -> bytes:
+    return replace_text_with_stats(template_bytes, replacements, output_profile)[0]
 
-def replace_text_in_pdf(template_bytes: bytes, replacements: dict[str, str]) -> bytes:
+
+def replace_text_with_stats(
+    template_bytes: bytes,
+    replacements: dict[str, str],
+    output_profile: str | None = None,
+) -> tuple[bytes, dict]:
+    """:func:`replace_text_in_pdf` plus the output stats of ``pdf_output.save_pdf``."""
+    profile = resolve_profile(output_profile)
     if not replacements:
-        return template_bytes
+        return template_bytes, {"profile": profile, "save_ms": 0.0, "output_bytes": len(template_bytes), "unchanged": True}
 
     sorted_reps = sorted(replacements.items(), key=lambda x: len(x[0]), reverse=True)
 
     pdf = pikepdf.open(BytesIO(template_bytes))
+    streams = content_streams(pdf)
 
     # Extend subsetted fonts so replacement characters have glyphs
-    _extend_subsetted_fonts(pdf)
+    _extend_subsetted_fonts(pdf, streams)
 
     # Collect font width tables for position adjustment
-    font_widths = _collect_font_widths(pdf)
+    widths_by_font = _collect_font_widths(streams)
 
-    for page in pdf.pages:
-        _replace_in_page(page, sorted_reps, pdf, font_widths)
+    for content in streams:
+        checkpoint()
+        _replace_in_stream(content, sorted_reps, pdf, widths_by_font)
 
-    out = BytesIO()
-    pdf.save(out)
-    return out.getvalue()
+    checkpoint()
+    return save_pdf(pdf, profile)
 
 
 # ---------------------------------------------------------------------------
-# Font width collection — for calculating text widths after replacement
+# Traversal — every content stream and font exactly once
 # ---------------------------------------------------------------------------
 
-def _collect_font_widths(pdf) -> dict[str, list[int]]:
-    """Collect {font_name: {char_code: width}} for all fonts in the PDF."""
+@dataclass
+class ContentStream:
+    """A page or Form XObject content stream with the fonts it can select."""
+    obj: object                  # pikepdf.Page, or a Form XObject stream
+    fonts: dict[str, object]     # resource name ("/F1") -> font dictionary
+    is_page: bool = False
+
+
+def _obj_key(obj) -> tuple:
+    objgen = obj.objgen
+    return objgen if objgen != (0, 0) else ("direct", id(obj))
+
+
+def _font_resources(resources) -> dict[str, object]:
+    fonts = resources.get("/Font") if resources is not None else None
+    if fonts is None:
+        return {}
     result = {}
+    for name in fonts.keys():
+        font_obj = fonts[name]
+        if isinstance(font_obj, pikepdf.Dictionary):
+            result[str(name)] = font_obj
+    return result
+
+
+def content_streams(pdf) -> list[ContentStream]:
+    """Every content stream reachable from the pages, each listed once.
+
+    Covers page contents, Form XObjects (nested ones too) and annotation
+    appearance streams (/AP /N, /R, /D, including per-state entries).
+    Streams are keyed by object ID, so a Form XObject shared by many
+    pages is parsed and rewritten once. A Form without /Resources uses
+    those of the stream that first drew it.
+    """
+    result: list[ContentStream] = []
+    seen: set = set()
+
+    def _visit(obj, resources, is_page=False):
+        key = _obj_key(obj.obj if is_page else obj)
+        if key in seen:
+            return
+        seen.add(key)
+        own = obj.get("/Resources")
+        if own is not None:
+            resources = own
+        result.append(ContentStream(obj, _font_resources(resources), is_page))
+        xobjects = resources.get("/XObject") if resources is not None else None
+        if xobjects is None:
+            return
+        for name in xobjects.keys():
+            _visit_form(xobjects[name], resources)
+
+    def _visit_form(xobj, resources, appearance=False):
+        if not isinstance(xobj, pikepdf.Stream):
+            return
+        subtype = xobj.get("/Subtype")
+        # Appearance streams are Forms, but writers often omit /Subtype
+        if subtype == pikepdf.Name.Form or (appearance and subtype is None):
+            _visit(xobj, resources)
+
     for page in pdf.pages:
-        resources = page.get("/Resources")
-        if resources is None:
-            continue
-        _collect_widths_from_resources(resources, result)
-        xobjects = resources.get("/XObject")
-        if xobjects:
-            for xobj_name in xobjects.keys():
-                xobj = xobjects[xobj_name]
-                if not isinstance(xobj, pikepdf.Stream):
-                    continue
-                subtype = xobj.get("/Subtype")
-                if subtype is not None and str(subtype) == "/Form":
-                    xobj_resources = xobj.get("/Resources")
-                    if xobj_resources:
-                        _collect_widths_from_resources(xobj_resources, result)
+        page_resources = page.get("/Resources")
+        _visit(page, page_resources, is_page=True)
+        for annot in page.get("/Annots") or []:
+            appearances = annot.get("/AP") if isinstance(annot, pikepdf.Dictionary) else None
+            if appearances is None:
+                continue
+            for kind in ("/N", "/R", "/D"):
+                ap = appearances.get(kind)
+                if isinstance(ap, pikepdf.Stream):
+                    _visit_form(ap, None, appearance=True)
+                elif isinstance(ap, pikepdf.Dictionary):
+                    for state in ap.keys():
+                        _visit_form(ap[state], None, appearance=True)
     return result
 
 
-def _collect_widths_from_resources(resources, result: dict):
-    """Extract font width tables from a Resources dictionary."""
-    fonts = resources.get("/Font")
-    if fonts is None:
-        return
-    for font_name in fonts.keys():
-        fn = str(font_name)
-        if fn in result:
-            continue
-        font_obj = fonts[font_name]
+def _unique_fonts(streams: list[ContentStream]) -> list:
+    """Font dictionaries used by *streams*, each once."""
+    fonts = {}
+    for content in streams:
+        for font_obj in content.fonts.values():
+            fonts.setdefault(_obj_key(font_obj), font_obj)
+    return list(fonts.values())
+
+
+# ---------------------------------------------------------------------------
+# Font width collection — for calculating text widths after replacement
+# ---------------------------------------------------------------------------
+
+def _collect_font_widths(streams: list[ContentStream]) -> dict[tuple, dict[int, int]]:
+    """Collect {font object key: {char_code: width}} for every font in use."""
+    result = {}
+    for font_obj in _unique_fonts(streams):
         try:
-            if hasattr(font_obj, 'resolve') and not isinstance(font_obj, pikepdf.Dictionary):
-                font_obj = font_obj.resolve()
             first_char = int(font_obj.get("/FirstChar", 0))
             widths_arr = font_obj.get("/Widths")
             if widths_arr:
                 widths = {}
                 for i, w in enumerate(widths_arr):
                     widths[first_char + i] = int(w)
-                result[fn] = widths
+                result[_obj_key(font_obj)] = widths
         except Exception:
             pass
+    return result
+
+
+def _stream_font_widths(content: ContentStream, widths_by_font: dict) -> dict[str, dict[int, int]]:
+    """Width tables of *content*'s fonts, by the resource names it uses."""
+    result = {}
+    for name, font_obj in content.fonts.items():
+        widths = widths_by_font.get(_obj_key(font_obj))
+        if widths is not None:
+            result[name] = widths
+    return result
 
 
 def _text_width_pt(text: str, font_widths: dict[int, int], font_size: float) -> float:
@@ -106,17 +203,57 @@ def _text_width_pt(text: str, font_widths: dict[int, int], font_size: float) ->
 # Font extension — replace subsetted font programs with full Segoe UI
 # ---------------------------------------------------------------------------
 
-def _get_font_key(font_obj) -> str:
-    """Get a stable dedup key for a font object using PDF object reference."""
-    try:
-        objgen = font_obj.objgen
-        return f"{objgen[0]}:{objgen[1]}"
-    except Exception:
-        # Fallback: use BaseFont name
-        return str(font_obj.get("/BaseFont", "")) + "|" + str(font_obj.get("/Subtype", ""))
+# Segoe UI programs and their metrics, loaded once per process. The
+# metrics are also kept in the shared cache so new workers skip parsing
+# the TTF files with fontTools.
+_segoe_fonts: dict[str, tuple[bytes, dict]] = {}
+
+
+def _load_segoe(path: str) -> tuple[bytes, dict]:
+    """Return (font file bytes, metrics) for a Segoe UI variant."""
+    loaded = _segoe_fonts.get(path)
+    if loaded is not None:
+        return loaded
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    from cache_store import shared_cache
+    st = os.stat(path)
+    cache_key = f"{os.path.basename(path)}:{st.st_size}:{int(st.st_mtime)}"
+    metrics = shared_cache().get_json("font", cache_key)
+    if metrics is None:
+        metrics = _compute_segoe_metrics(TTFont(BytesIO(data)))
+        shared_cache().put_json("font", cache_key, metrics)
 
+    _segoe_fonts[path] = (data, metrics)
+    return data, metrics
 
-def _extend_subsetted_fonts(pdf):
+
+def _compute_segoe_metrics(tt) -> dict:
+    """Widths (1000 units/em) for codes 32..255 and the space width."""
+    cmap = tt.getBestCmap()
+    hmtx = tt["hmtx"]
+    scale = 1000.0 / tt["head"].unitsPerEm
+
+    widths = []
+    for code in range(32, 256):
+        if cmap and code in cmap:
+            glyph_name = cmap[code]
+            if glyph_name in hmtx.metrics:
+                widths.append(int(hmtx.metrics[glyph_name][0] * scale))
+            else:
+                widths.append(600)
+        else:
+            widths.append(None)  # not in the font
+
+    space = None
+    if cmap and 32 in cmap and cmap[32] in hmtx.metrics:
+        space = int(hmtx.metrics[cmap[32]][0] * scale)
+    return {"widths": widths, "space": space}
+
+
+def _extend_subsetted_fonts(pdf, streams: list[ContentStream]):
     """Find all subsetted TrueType fonts and replace their font programs
     with the full Segoe UI, ensuring all Latin characters are available."""
     segoe_regular = os.path.join(FONTS_DIR, "segoeui.ttf")
@@ -133,51 +270,11 @@ def _extend_subsetted_fonts(pdf):
         "italic": segoe_italic,
     }
 
-    # Cache font data
+    # Font streams shared by all fonts in this PDF, keyed by variant
     segoe_data = {}
-    segoe_ttfonts = {}
-
-    seen_fonts = set()  # avoid processing the same font object twice
-
-    def _process_font(font_obj, font_name=""):
-        """Process a single font, deduplicating by PDF object reference."""
-        if not isinstance(font_obj, pikepdf.Dictionary):
-            try:
-                font_obj = font_obj.resolve() if hasattr(font_obj, 'resolve') else font_obj
-            except Exception:
-                return
 
-        font_key = _get_font_key(font_obj)
-        if font_key in seen_fonts:
-            return
-        seen_fonts.add(font_key)
-
-        _try_extend_font(font_obj, segoe_variants, segoe_data, segoe_ttfonts, pdf)
-
-    for page in pdf.pages:
-        resources = page.get("/Resources")
-        if resources is None:
-            continue
-        fonts = resources.get("/Font")
-        if fonts:
-            for font_name in fonts.keys():
-                _process_font(fonts[font_name], font_name)
-
-        # Also check fonts inside Form XObjects
-        xobjects = resources.get("/XObject")
-        if xobjects:
-            for xobj_name in xobjects.keys():
-                xobj = xobjects[xobj_name]
-                if not isinstance(xobj, pikepdf.Stream):
-                    continue
-                subtype = xobj.get("/Subtype")
-                if subtype is not None and str(subtype) == "/Form":
-                    xobj_resources = xobj.get("/Resources")
-                    if xobj_resources:
-                        xobj_fonts = xobj_resources.get("/Font")
-                        if xobj_fonts:
-                            for fn in xobj_fonts.keys():
-                                _process_font(xobj_fonts[fn], fn)
+    for font_obj in _unique_fonts(streams):
+        _try_extend_font(font_obj, segoe_variants, segoe_data, pdf)
 
 
 def _pick_segoe_variant(base_font: str, segoe_variants: dict) -> str:
@@ -192,11 +289,11 @@ def _pick_segoe_variant(base_font: str, segoe_variants: dict) -> str:
     return segoe_variants["regular"]
 
 
-def _try_extend_font(font_obj, segoe_variants, segoe_data, segoe_ttfonts, pdf):
+def _try_extend_font(font_obj, segoe_variants, segoe_data, pdf):
     """Extend a single font if it's a subsetted TrueType font."""
     try:
         subtype = str(font_obj.get("/Subtype", ""))
-        if subtype not in ("/TrueType", "/Type0"):
+        if subtype not in ("/TrueType", "/Type0") or font_obj.get(COMPLETE_FONT):
             return
 
         base_font = str(font_obj.get("/BaseFont", ""))
@@ -207,14 +304,14 @@ def _try_extend_font(font_obj, segoe_variants, segoe_data, segoe_ttfonts, pdf):
         is_subsetted = "+" in clean_name and len(clean_name.split("+")[0]) == 6
 
         if subtype == "/TrueType":
-            _extend_truetype_font(font_obj, is_subsetted, base_font, segoe_variants, segoe_data, segoe_ttfonts, pdf)
+            _extend_truetype_font(font_obj, is_subsetted, base_font, segoe_variants, segoe_data, pdf)
         elif subtype == "/Type0":
-            _extend_type0_font(font_obj, is_subsetted, base_font, segoe_variants, segoe_data, segoe_ttfonts, pdf)
+            _extend_type0_font(font_obj, is_subsetted, base_font, segoe_variants, segoe_data, pdf)
     except Exception as e:
         print(f"[extend_fonts] ERROR: {base_font}: {e}", file=sys.stderr, flush=True)
 
 
-def _extend_truetype_font(font_obj, is_subsetted, base_font, segoe_variants, segoe_data, segoe_ttfonts, pdf):
+def _extend_truetype_font(font_obj, is_subsetted, base_font, segoe_variants, segoe_data, pdf):
     """Extend a simple TrueType font by replacing its FontFile2 with full Segoe UI."""
     descriptor = font_obj.get("/FontDescriptor")
     if descriptor is None:
@@ -227,18 +324,13 @@ def _extend_truetype_font(font_obj, is_subsetted, base_font, segoe_variants, seg
     # Pick Segoe variant based on original font style (bold/italic/regular)
     segoe_path = _pick_segoe_variant(base_font, segoe_variants)
 
-    if segoe_path not in segoe_data:
-        with open(segoe_path, "rb") as f:
-            segoe_data[segoe_path] = f.read()
-        segoe_ttfonts[segoe_path] = TTFont(segoe_path)
-
-    segoe_tt = segoe_ttfonts[segoe_path]
+    font_bytes, metrics = _load_segoe(segoe_path)
 
     # Replace the embedded font data with full Segoe UI (shared stream)
     stream_key = ("tt_stream", segoe_path)
     if stream_key not in segoe_data:
-        segoe_data[stream_key] = pdf.make_stream(segoe_data[segoe_path])
-        segoe_data[stream_key][pikepdf.Name("/Length1")] = len(segoe_data[segoe_path])
+        segoe_data[stream_key] = pdf.make_stream(font_bytes)
+        segoe_data[stream_key][pikepdf.Name("/Length1")] = len(font_bytes)
     descriptor[pikepdf.Name("/FontFile2")] = segoe_data[stream_key]
 
     # Reset encoding to standard WinAnsiEncoding so all character codes
@@ -258,11 +350,8 @@ def _extend_truetype_font(font_obj, is_subsetted, base_font, segoe_variants, seg
     new_first = 32
     new_last = 255
 
-    # Build Segoe UI widths for reference
-    cmap = segoe_tt.getBestCmap()
-    units_per_em = segoe_tt["head"].unitsPerEm
-    hmtx = segoe_tt["hmtx"]
-    scale = 1000.0 / units_per_em
+    # Segoe UI widths for reference
+    segoe_widths = metrics["widths"]
 
     new_widths = []
     for code in range(new_first, new_last + 1):
@@ -275,22 +364,15 @@ def _extend_truetype_font(font_obj, is_subsetted, base_font, segoe_variants, seg
                 continue
 
         # New/missing char: use Segoe UI metrics
-        if cmap and code in cmap:
-            glyph_name = cmap[code]
-            if glyph_name in hmtx.metrics:
-                width = int(hmtx.metrics[glyph_name][0] * scale)
-                new_widths.append(width)
-            else:
-                new_widths.append(600)
-        else:
-            new_widths.append(0)
+        width = segoe_widths[code - 32]
+        new_widths.append(width if width is not None else 0)
 
     font_obj[pikepdf.Name("/FirstChar")] = new_first
     font_obj[pikepdf.Name("/LastChar")] = new_last
     font_obj[pikepdf.Name("/Widths")] = pikepdf.Array(new_widths)
 
 
-def _extend_type0_font(font_obj, is_subsetted, base_font, segoe_variants, segoe_data, segoe_ttfonts, pdf):
+def _extend_type0_font(font_obj, is_subsetted, base_font, segoe_variants, segoe_data, pdf):
     """Extend a Type0 (CID) font by replacing the descendant's font file."""
     descendants = font_obj.get("/DescendantFonts")
     if descendants is None or len(descendants) == 0:
@@ -313,33 +395,22 @@ def _extend_type0_font(font_obj, is_subsetted, base_font, segoe_variants, segoe_
 
     segoe_path = _pick_segoe_variant(base_font, segoe_variants)
 
-    if segoe_path not in segoe_data:
-        with open(segoe_path, "rb") as f:
-            segoe_data[segoe_path] = f.read()
-        segoe_ttfonts[segoe_path] = TTFont(segoe_path)
+    font_bytes, metrics = _load_segoe(segoe_path)
 
     # Shared font stream across all Type0 fonts using the same variant
     stream_key = ("cid_stream", segoe_path)
     if stream_key not in segoe_data:
-        segoe_data[stream_key] = pdf.make_stream(segoe_data[segoe_path])
-        segoe_data[stream_key][pikepdf.Name("/Length1")] = len(segoe_data[segoe_path])
+        segoe_data[stream_key] = pdf.make_stream(font_bytes)
+        segoe_data[stream_key][pikepdf.Name("/Length1")] = len(font_bytes)
     descriptor[pikepdf.Name("/FontFile2")] = segoe_data[stream_key]
 
     # Set CIDToGIDMap to Identity so CID values map directly to glyph indices
     # in the full Segoe UI font (where glyph indices match Unicode code points)
     cid_font[pikepdf.Name("/CIDToGIDMap")] = pikepdf.Name("/Identity")
 
-    # Update DW (default width) from Segoe UI metrics
-    segoe_tt = segoe_ttfonts[segoe_path]
-    units_per_em = segoe_tt["head"].unitsPerEm
-    scale = 1000.0 / units_per_em
-    hmtx = segoe_tt["hmtx"]
-    # Default width: use space glyph width
-    cmap = segoe_tt.getBestCmap()
-    if cmap and 32 in cmap:
-        glyph_name = cmap[32]
-        if glyph_name in hmtx.metrics:
-            cid_font[pikepdf.Name("/DW")] = int(hmtx.metrics[glyph_name][0] * scale)
+    # Update DW (default width) from Segoe UI metrics: use space glyph width
+    if metrics["space"] is not None:
+        cid_font[pikepdf.Name("/DW")] = metrics["space"]
 
 
 
@@ -347,73 +418,26 @@ def _extend_type0_font(font_obj, is_subsetted, base_font, segoe_variants, segoe_
 # Text replacement in content streams
 # ---------------------------------------------------------------------------
 
-def _get_type0_fonts(page) -> set:
-    """Return the set of font names that are Type0 (CID) fonts on this page."""
-    type0 = set()
-    resources = page.get("/Resources") if isinstance(page, pikepdf.Dictionary) else (page.get("/Resources") if hasattr(page, 'get') else None)
-    if resources is None:
-        return type0
-    fonts = resources.get("/Font")
-    if fonts is None:
-        return type0
-    for name in fonts.keys():
-        font_obj = fonts[name]
-        try:
-            if hasattr(font_obj, 'resolve') and not isinstance(font_obj, pikepdf.Dictionary):
-                font_obj = font_obj.resolve()
-            subtype = str(font_obj.get("/Subtype", ""))
-            if subtype == "/Type0":
-                type0.add(str(name))
-        except Exception:
-            pass
-    return type0
-
+def _type0_names(content: ContentStream) -> set:
+    """Resource names of the Type0 (CID) fonts *content* can select."""
+    return {name for name, font_obj in content.fonts.items()
+            if str(font_obj.get("/Subtype", "")) == "/Type0"}
 
-def _replace_in_page(page, sorted_reps, pdf, font_widths):
-    """Replace text in a page's main content stream + Form XObjects."""
-    type0_fonts = _get_type0_fonts(page)
 
+def _replace_in_stream(content: ContentStream, sorted_reps, pdf, widths_by_font):
+    """Replace text in one page, Form XObject or appearance stream."""
     try:
-        ops = pikepdf.parse_content_stream(page)
-        new_ops = _process_operators(ops, sorted_reps, type0_fonts, font_widths)
-        page.Contents = pdf.make_stream(pikepdf.unparse_content_stream(new_ops))
+        ops = pikepdf.parse_content_stream(content.obj)
+        new_ops = _process_operators(ops, sorted_reps, _type0_names(content),
+                                     _stream_font_widths(content, widths_by_font))
+        data = pikepdf.unparse_content_stream(new_ops)
+        if content.is_page:
+            content.obj.Contents = pdf.make_stream(data)
+        else:
+            content.obj.write(data)
     except Exception:
         pass
 
-    resources = page.get("/Resources")
-    if resources is None:
-        return
-    xobjects = resources.get("/XObject")
-    if xobjects is None:
-        return
-    for key in xobjects.keys():
-        xobj = xobjects[key]
-        if not isinstance(xobj, pikepdf.Stream):
-            continue
-        subtype = xobj.get("/Subtype")
-        if subtype is not None and str(subtype) == "/Form":
-            try:
-                xobj_type0 = set()
-                xobj_resources = xobj.get("/Resources")
-                if xobj_resources:
-                    xobj_fonts_dict = xobj_resources.get("/Font")
-                    if xobj_fonts_dict:
-                        for fn in xobj_fonts_dict.keys():
-                            fo = xobj_fonts_dict[fn]
-                            try:
-                                if hasattr(fo, 'resolve') and not isinstance(fo, pikepdf.Dictionary):
-                                    fo = fo.resolve()
-                                if str(fo.get("/Subtype", "")) == "/Type0":
-                                    xobj_type0.add(str(fn))
-                            except Exception:
-                                pass
-
-                ops = pikepdf.parse_content_stream(xobj)
-                new_ops = _process_operators(ops, sorted_reps, xobj_type0, font_widths)
-                xobj.write(pikepdf.unparse_content_stream(new_ops))
-            except Exception:
-                pass
-
 
 def _process_operators(ops, sorted_reps, type0_fonts: set, font_widths: dict):
     """Walk content-stream operators; replace text in Tj / TJ / ' / \" ops.
@@ -544,13 +568,33 @@ def _process_operators(ops, sorted_reps, type0_fonts: set, font_widths: dict):
     return result
 
 
+def text_runs(pdf) -> list[str]:
+    """Text of every text-showing operator, decoded exactly as the
+    replacement pass sees it (TJ pieces joined), over all
+    ``content_streams``. Used to check that template placeholders are
+    findable."""
+    runs = []
+    for content in content_streams(pdf):
+        type0_fonts = _type0_names(content)
+        is_type0 = False
+        for operands, operator in pikepdf.parse_content_stream(content.obj):
+            op_name = str(operator)
+            if op_name == "Tf" and operands:
+                is_type0 = str(operands[0]) in type0_fonts
+            elif op_name in ("Tj", "'", '"'):
+                runs.append(_get_text(operands[-1:], op_name, is_type0))
+            elif op_name == "TJ":
+                runs.append(_get_TJ_text(operands, is_type0))
+    return runs
+
+
 def _get_text(operands, op_name: str, is_type0: bool) -> str:
     """Extract plain text from Tj/' /\" operands."""
     if not operands:
         return ""
     s = operands[0]
     if isinstance(s, pikepdf.String):
-        return _pdf_str(s, is_type0)
+        return decode_pdf_string(s, is_type0)
     return ""
 
 
@@ -564,7 +608,7 @@ def _get_TJ_text(operands, is_type0: bool) -> str:
     joined = ""
     for item in arr:
         if isinstance(item, pikepdf.String):
-            joined += _pdf_str(item, is_type0)
+            joined += decode_pdf_string(item, is_type0)
     return joined
 
 
@@ -692,12 +736,12 @@ def _find_column_center(result: list, td_index: int, font_widths: dict,
                 if m_op_name in ("Tj", "TJ"):
                     # Found the text rendered at the parent Tm position
                     if m_op_name == "Tj" and isinstance(m_operands[0], pikepdf.String):
-                        text = _pdf_str(m_operands[0])
+                        text = decode_pdf_string(m_operands[0])
                     elif m_op_name == "TJ" and isinstance(m_operands[0], pikepdf.Array):
                         text = ""
                         for item in m_operands[0]:
                             if isinstance(item, pikepdf.String):
-                                text += _pdf_str(item)
+                                text += decode_pdf_string(item)
                     else:
                         break
 
@@ -764,7 +808,7 @@ def _detect_alignment(old_text: str, new_text: str, font_size_pt: float) -> str:
 # Helpers
 # ---------------------------------------------------------------------------
 
-def _pdf_str(s, is_type0: bool = False) -> str:
+def decode_pdf_string(s, is_type0: bool = False) -> str:
     """Decode a pikepdf.String to a Python str.
     For Type0 (CID) fonts, decode 2-byte big-endian to Unicode."""
     raw = bytes(s)
@@ -816,7 +860,7 @@ def _replace_tj(operands, sorted_reps, is_type0: bool = False):
     s = operands[0]
     if not isinstance(s, pikepdf.String):
         return operands
-    text, changed = _apply(_pdf_str(s, is_type0), sorted_reps)
+    text, changed = _apply(decode_pdf_string(s, is_type0), sorted_reps)
     if changed:
         return [_make_pdf_str(text, is_type0)]
     return operands
@@ -833,7 +877,7 @@ def _replace_TJ(operands, sorted_reps, is_type0: bool = False):
     any_changed = False
     for item in arr:
         if isinstance(item, pikepdf.String):
-            text, changed = _apply(_pdf_str(item, is_type0), sorted_reps)
+            text, changed = _apply(decode_pdf_string(item, is_type0), sorted_reps)
             if changed:
                 any_changed = True
             new_arr.append(_make_pdf_str(text, is_type0))
@@ -847,7 +891,7 @@ def _replace_TJ(operands, sorted_reps, is_type0: bool = False):
     joined = ""
     for item in arr:
         if isinstance(item, pikepdf.String):
-            joined += _pdf_str(item, is_type0)
+            joined += decode_pdf_string(item, is_type0)
 
     new_joined, changed = _apply(joined, sorted_reps)
     if changed:
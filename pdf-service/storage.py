@@ -0,0 +1,117 @@
+"""
+Direct upload of generated PDFs to S3-compatible storage.
+
+Without this, the caller receives the PDF as base64, decodes it and
+uploads it again to the ``generated-docs`` bucket, so every document
+crosses the network twice. When a request carries ``storage_path`` the
+service writes the PDF to the bucket itself and returns only the path
+and checksum.
+
+Works with anything that speaks the S3 API: Supabase Storage (its
+``/storage/v1/s3`` endpoint), MinIO for local testing, or AWS itself.
+
+Settings (env):
+    S3_ENDPOINT_URL          e.g. https://<project>.supabase.co/storage/v1/s3
+                             or http://localhost:9000 for MinIO
+    S3_ACCESS_KEY_ID / S3_SECRET_ACCESS_KEY
+    S3_REGION                default us-east-1
+    S3_BUCKET                default generated-docs
+    S3_MAX_POOL_CONNECTIONS  size of the shared HTTP connection pool
+    S3_MULTIPART_THRESHOLD / S3_MULTIPART_CHUNKSIZE
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from io import BytesIO
+from typing import Optional, Union
+
+from config import env_int
+
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "")
+S3_ACCESS_KEY_ID = os.environ.get("S3_ACCESS_KEY_ID", "")
+S3_SECRET_ACCESS_KEY = os.environ.get("S3_SECRET_ACCESS_KEY", "")
+S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+S3_BUCKET = os.environ.get("S3_BUCKET", "generated-docs")
+S3_MAX_POOL_CONNECTIONS = env_int("S3_MAX_POOL_CONNECTIONS", 16)
+S3_MULTIPART_THRESHOLD = env_int("S3_MULTIPART_THRESHOLD", 8 * 1024 * 1024)
+S3_MULTIPART_CHUNKSIZE = env_int("S3_MULTIPART_CHUNKSIZE", 8 * 1024 * 1024)
+
+_client = None
+_transfer_config = None
+_lock = threading.Lock()
+
+
+def storage_enabled() -> bool:
+    return bool(S3_ENDPOINT_URL and S3_ACCESS_KEY_ID and S3_SECRET_ACCESS_KEY)
+
+
+def _get_client():
+    """One boto3 client per process; its connection pool is shared by all threads."""
+    global _client, _transfer_config
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import boto3
+                from boto3.s3.transfer import TransferConfig
+                from botocore.config import Config
+
+                _transfer_config = TransferConfig(
+                    multipart_threshold=S3_MULTIPART_THRESHOLD,
+                    multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+                    max_concurrency=4,
+                    use_threads=True,
+                )
+                _client = boto3.client(
+                    "s3",
+                    endpoint_url=S3_ENDPOINT_URL,
+                    aws_access_key_id=S3_ACCESS_KEY_ID,
+                    aws_secret_access_key=S3_SECRET_ACCESS_KEY,
+                    region_name=S3_REGION,
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        retries={"max_attempts": 3, "mode": "standard"},
+                        # Supabase Storage and MinIO want path-style URLs
+                        s3={"addressing_style": "path"},
+                    ),
+                )
+    return _client
+
+
+def _sha256_file(path: str) -> tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def upload_pdf(source: Union[bytes, str], key: str, bucket: Optional[str] = None) -> dict:
+    """Upload PDF *source* (bytes, or a file path) to ``bucket/key``.
+
+    Blocking; call it via ``asyncio.to_thread``. Large objects go up as
+    multipart uploads. Returns ``{"bucket", "storage_path", "sha256", "size"}``.
+    """
+    if not storage_enabled():
+        raise RuntimeError("Storage upload is not configured (S3_ENDPOINT_URL / S3 credentials)")
+    key = key.lstrip("/")
+    if not key or ".." in key.split("/"):
+        raise ValueError(f"Invalid storage path: {key!r}")
+    bucket = bucket or S3_BUCKET
+
+    client = _get_client()
+    if isinstance(source, (bytes, bytearray)):
+        sha256, size = hashlib.sha256(source).hexdigest(), len(source)
+    else:
+        sha256, size = _sha256_file(source)
+    extra = {"ContentType": "application/pdf", "Metadata": {"sha256": sha256}}
+
+    if isinstance(source, (bytes, bytearray)):
+        client.upload_fileobj(BytesIO(source), bucket, key, ExtraArgs=extra, Config=_transfer_config)
+    else:
+        client.upload_file(source, bucket, key, ExtraArgs=extra, Config=_transfer_config)
+
+    return {"bucket": bucket, "storage_path": key, "sha256": sha256, "size": size}
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# Modules live flat in pdf-service/, as the Dockerfile runs them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(tmp_path, monkeypatch):
+    """A separate, empty shared cache for every test."""
+    import cache_store
+    monkeypatch.setattr(cache_store, "CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(cache_store, "_cache", None)
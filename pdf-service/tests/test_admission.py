@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import admission
+from admission import EndpointLimiter
+
+
+def test_full_queue_is_shed_with_503_and_retry_after():
+    async def scenario():
+        lim = EndpointLimiter("render", max_concurrent=1, max_queue=1, retry_after=7)
+        await lim.acquire()
+        waiter = asyncio.ensure_future(lim.acquire())
+        await asyncio.sleep(0)
+        assert (lim.active, lim.queued) == (1, 1)
+        with pytest.raises(HTTPException) as e:
+            await lim.acquire()
+        lim.release()   # handed straight to the waiter
+        await waiter
+        return lim, e.value
+
+    lim, shed = asyncio.run(scenario())
+    assert shed.status_code == 503 and shed.headers == {"Retry-After": "7"}
+    assert (lim.active, lim.queued, lim.admitted, lim.rejected) == (1, 0, 2, 1)
+
+
+def test_waiter_that_times_out_leaves_the_queue():
+    async def scenario():
+        lim = EndpointLimiter("render", max_concurrent=1, max_queue=2, retry_after=1)
+        await lim.acquire()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(lim.acquire(), 0.01)
+        assert lim.queued == 0
+        # The next waiter is not stuck behind the one that gave up
+        later = asyncio.ensure_future(lim.acquire())
+        await asyncio.sleep(0)
+        lim.release()
+        await later
+        lim.release()
+        return lim
+
+    lim = asyncio.run(scenario())
+    assert (lim.active, lim.queued, lim.admitted) == (0, 0, 2)
+
+
+def test_slot_handed_to_a_cancelled_waiter_is_passed_on():
+    async def scenario():
+        lim = EndpointLimiter("render", max_concurrent=1, max_queue=2, retry_after=1)
+        await lim.acquire()
+        first = asyncio.ensure_future(lim.acquire())
+        second = asyncio.ensure_future(lim.acquire())
+        await asyncio.sleep(0)
+        lim.release()    # first gets the slot ...
+        first.cancel()   # ... but goes away before it runs
+        await asyncio.gather(first, return_exceptions=True)
+        await second
+        return lim, first
+
+    lim, first = asyncio.run(scenario())
+    assert first.cancelled()
+    assert (lim.active, lim.queued) == (1, 0)
+
+
+def test_overloaded_endpoint_answers_503(monkeypatch):
+    monkeypatch.setattr(admission, "_limiters", {})
+    monkeypatch.setenv("SLOW_CONCURRENCY", "1")
+    monkeypatch.setenv("SLOW_QUEUE", "0")
+    app = FastAPI()
+    lim = admission.limiter("slow")
+
+    @app.get("/slow")
+    async def slow():
+        async with lim.slot():
+            return {"status": "ok"}
+
+    with TestClient(app) as client:
+        assert client.get("/slow").status_code == 200
+        lim.active = 1   # a request in progress
+        resp = client.get("/slow")
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == str(admission.RETRY_AFTER_SECONDS)
+    assert admission.snapshot()["slow"]["rejected"] == 1
@@ -0,0 +1,126 @@
+import os
+from io import BytesIO
+
+import pikepdf
+import pytest
+
+from booking_templates import simplify_type0_fonts
+from replace_text import COMPLETE_FONT, replace_text_with_stats
+
+DEJAVU = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+SENTINEL = "XQZSENT"
+GUEST = "Jürgen Ødegård"
+
+
+def _chars(pdf_bytes: bytes) -> list[tuple[str, str, float]]:
+    """(text, font, advance in text space units) of every character."""
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTChar
+
+    def walk(item):
+        if isinstance(item, LTChar):
+            yield item.get_text(), item.fontname, round(item.adv / item.size * 1000)
+        for child in getattr(item, "_objs", []):
+            yield from walk(child)
+
+    return [c for page in extract_pages(BytesIO(pdf_bytes)) for c in walk(page)]
+
+
+def _type0_pdf(font_path: str, text: str) -> bytes:
+    """A one-line PDF shaped like WeasyPrint's output with ``full_fonts``:
+    an Identity-H Type0 font whose codes are glyph IDs, with ToUnicode
+    and /W covering every glyph of the complete embedded program."""
+    from fontTools.ttLib import TTFont
+
+    with open(font_path, "rb") as f:
+        data = f.read()
+    tt = TTFont(BytesIO(data))
+    gids = {name: i for i, name in enumerate(tt.getGlyphOrder())}
+    scale = 1000 / tt["head"].unitsPerEm
+    to_unicode = {}
+    for code, name in sorted(tt.getBestCmap().items()):
+        if code < 0x10000:
+            to_unicode.setdefault(gids[name], code)
+    bfchar = "".join(f"<{gid:04X}> <{code:04X}>\n" for gid, code in to_unicode.items())
+    cmap = (
+        "/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n"
+        "/CMapName /Adobe-Identity-UCS def /CMapType 2 def\n"
+        "1 begincodespacerange <0000> <FFFF> endcodespacerange\n"
+        f"{len(to_unicode)} beginbfchar\n{bfchar}endbfchar\n"
+        "endcmap CMapName currentdict /CMap defineresource pop end end"
+    )
+    widths = [round(tt["hmtx"][name][0] * scale) for name in tt.getGlyphOrder()]
+
+    pdf = pikepdf.new()
+    descriptor = pikepdf.Dictionary(
+        Type=pikepdf.Name.FontDescriptor, FontName=pikepdf.Name("/DejaVuSans"), Flags=4,
+        FontBBox=[-1021, -463, 1793, 1232], ItalicAngle=0, Ascent=928, Descent=-236,
+        CapHeight=700, StemV=80, FontFile2=pdf.make_stream(data),
+    )
+    font = pdf.make_indirect(pikepdf.Dictionary(
+        Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type0, BaseFont=pikepdf.Name("/DejaVuSans"),
+        Encoding=pikepdf.Name("/Identity-H"), ToUnicode=pdf.make_stream(cmap.encode()),
+        DescendantFonts=[pikepdf.Dictionary(
+            Type=pikepdf.Name.Font, Subtype=pikepdf.Name.CIDFontType2, BaseFont=pikepdf.Name("/DejaVuSans"),
+            CIDSystemInfo=pikepdf.Dictionary(Registry="Adobe", Ordering="Identity", Supplement=0),
+            FontDescriptor=descriptor, CIDToGIDMap=pikepdf.Name.Identity, W=[0, widths],
+        )],
+    ))
+    glyphs = "".join(f"{gids[tt.getBestCmap()[ord(ch)]]:04X}" for ch in text)
+    page = pdf.add_blank_page(page_size=(400, 200))
+    page.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font))
+    page.Contents = pdf.make_stream(f"BT /F1 12 Tf 20 100 Td <{glyphs}> Tj ET".encode())
+    out = BytesIO()
+    pdf.save(out)
+    return out.getvalue()
+
+
+def _template(pdf_bytes: bytes) -> bytes:
+    pdf = pikepdf.open(BytesIO(pdf_bytes))
+    assert simplify_type0_fonts(pdf) == 1
+    out = BytesIO()
+    pdf.save(out)
+    return out.getvalue()
+
+
+def _font_programs(pdf_bytes: bytes) -> list[bytes]:
+    with pikepdf.open(BytesIO(pdf_bytes)) as pdf:
+        return [
+            font.FontDescriptor.FontFile2.read_bytes()
+            for page in pdf.pages for font in page.Resources.Font.values()
+        ]
+
+
+@pytest.mark.skipif(not os.path.exists(DEJAVU), reason="DejaVu Sans not installed")
+def test_replace_keeps_complete_template_fonts():
+    with open(DEJAVU, "rb") as f:
+        dejavu = f.read()
+    template = _template(_type0_pdf(DEJAVU, f"Guest: {SENTINEL}"))
+    with pikepdf.open(BytesIO(template)) as pdf:
+        assert pdf.pages[0].Resources.Font.F1.get(COMPLETE_FONT)
+
+    replaced, _ = replace_text_with_stats(template, {SENTINEL: GUEST})
+
+    # Still the template's own font program, not Segoe UI
+    assert _font_programs(replaced) == [dejavu]
+    # Same text and glyph advances as the font itself lays out
+    expected = _chars(_type0_pdf(DEJAVU, f"Guest: {GUEST}"))
+    assert [(t, w) for t, _, w in _chars(replaced)] == [(t, w) for t, _, w in expected]
+
+
+def test_render_and_replace_engines_agree():
+    try:
+        import weasyprint  # noqa: F401
+    except (ImportError, OSError) as e:
+        pytest.skip(f"WeasyPrint unavailable: {e}")
+    from booking_templates import _SENTINEL_STYLESHEET
+    from html_render import render_html
+
+    html = "<p style='font-family: sans-serif'>Guest: {}</p>"
+    rendered = render_html(html.format(GUEST))
+    template = _template(render_html(html.format(SENTINEL), _SENTINEL_STYLESHEET, full_fonts=True))
+    replaced, _ = replace_text_with_stats(template, {SENTINEL: GUEST})
+
+    render_chars, replace_chars = _chars(rendered), _chars(replaced)
+    assert "".join(t for t, _, _ in replace_chars) == "".join(t for t, _, _ in render_chars)
+    assert [w for _, _, w in replace_chars] == [w for _, _, w in render_chars]
@@ -0,0 +1,71 @@
+import json
+from io import BytesIO
+
+import pikepdf
+
+import bulk_generate
+
+
+def _template(path):
+    pdf = pikepdf.new()
+    page = pdf.add_blank_page()
+    page.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=pdf.make_indirect(pikepdf.Dictionary(
+        Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1, BaseFont=pikepdf.Name.Helvetica,
+    ))))
+    page.Contents = pdf.make_stream(b"BT /F1 12 Tf 72 700 Td (Guest: GUESTNAME) Tj ET")
+    out = BytesIO()
+    pdf.save(out)
+    path.write_bytes(out.getvalue())
+
+
+def _booking(doc_id: str, template: str) -> str:
+    return json.dumps({
+        "id": doc_id, "template_url": template, "guest_name": f"Guest {doc_id}",
+        "checkin_date": "2027-05-01", "checkout_date": "2027-05-04", "pin_code": "1234",
+        "field_mapping": {"guest_name": "GUESTNAME"},
+    })
+
+
+def _manifest(out) -> list[dict]:
+    with open(out / "manifest.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def _run(source, out) -> dict:
+    return bulk_generate.run(str(source), str(out), processes=1, chunk_size=2, output_profile=None, progress_s=0)
+
+
+def test_resume_skips_done_bookings_and_retries_the_rest(tmp_path):
+    template = tmp_path / "template.pdf"
+    _template(template)
+    source, out = tmp_path / "bookings.jsonl", tmp_path / "out"
+    source.write_text("\n".join([
+        _booking("a", str(template)),
+        _booking("b", str(template)),
+        json.dumps({"id": "invalid", "template_url": str(template)}),   # no guest data
+        _booking("c", f"file://{template}"),
+        _booking("missing", str(tmp_path / "nowhere.pdf")),
+    ]) + "\n")
+
+    first = _run(source, out)
+    assert (first["total"], first["generated"], first["failed"], first["skipped"]) == (5, 3, 2, 0)
+    entries = {entry["id"]: entry for entry in _manifest(out)}
+    assert {i for i, e in entries.items() if e["status"] == "success"} == {"a", "b", "c"}
+    assert entries["a"]["pin_code"] == "1234" and entries["a"]["file"] == "a.pdf"
+    with pikepdf.open(out / "a.pdf") as pdf:
+        assert len(pdf.pages) == 1
+
+    # b's file is gone and the last manifest line was cut off mid-write
+    (out / "b.pdf").unlink()
+    with open(out / "manifest.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"id": "c", "sta')
+
+    second = _run(source, out)
+    assert (second["skipped"], second["generated"], second["failed"]) == (2, 1, 2)
+    assert (out / "b.pdf").exists()
+    with open(out / "manifest.jsonl", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert lines[len(entries)] == '{"id": "c", "sta'
+    retried = [json.loads(line)["id"] for line in lines[len(entries) + 1:]]
+    assert sorted(retried) == ["b", "invalid", "missing"]
+    assert not list(out.glob("*.tmp"))
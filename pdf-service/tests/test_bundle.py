@@ -0,0 +1,49 @@
+import os
+from io import BytesIO
+
+import pikepdf
+from pikepdf import Dictionary, Name
+
+from bundle import build_bundle
+
+FULL_FONT = os.urandom(4000)
+
+
+def _document(program: bytes) -> bytes:
+    """One page with a TrueType font embedding *program*."""
+    pdf = pikepdf.new()
+    descriptor = Dictionary(Type=Name.FontDescriptor, FontName=Name("/ABCDEF+SegoeUI"),
+                            Flags=32, FontFile2=pdf.make_stream(program))
+    font = Dictionary(Type=Name.Font, Subtype=Name.TrueType, BaseFont=Name("/ABCDEF+SegoeUI"),
+                      FontDescriptor=pdf.make_indirect(descriptor))
+    page = pdf.add_blank_page()
+    page.Resources = Dictionary(Font=Dictionary(F1=pdf.make_indirect(font)))
+    page.Contents = pdf.make_stream(b"BT /F1 12 Tf 72 700 Td (Booking) Tj ET")
+    out = BytesIO()
+    pdf.save(out)
+    return out.getvalue()
+
+
+def _font_programs(path) -> set[bytes]:
+    with pikepdf.open(path) as pdf:
+        return {page.Resources.Font.F1.FontDescriptor.FontFile2.read_bytes() for page in pdf.pages}
+
+
+def test_identical_font_programs_are_stored_once(tmp_path):
+    out = str(tmp_path / "bundle.pdf")
+    stats = build_bundle([_document(FULL_FONT)] * 3, out)
+    assert (stats["documents"], stats["pages"]) == (3, 3)
+    assert stats["fonts_deduplicated"] == 2 and stats["font_bytes_saved"] > 0
+    assert _font_programs(out) == {FULL_FONT}
+    with pikepdf.open(out) as pdf:
+        streams = {page.Resources.Font.F1.FontDescriptor.FontFile2.objgen for page in pdf.pages}
+    assert len(streams) == 1
+
+
+def test_different_subsets_of_one_font_stay_separate(tmp_path):
+    # Same font, one glyph apart: not byte-identical, so not merged
+    subset_a, subset_b = FULL_FONT[:3000], FULL_FONT[:2999] + bytes([FULL_FONT[2999] ^ 0xFF])
+    out = str(tmp_path / "bundle.pdf")
+    stats = build_bundle([_document(subset_a), _document(subset_b), _document(subset_a)], out)
+    assert (stats["fonts_deduplicated"], stats["pages"]) == (1, 3)
+    assert _font_programs(out) == {subset_a, subset_b}
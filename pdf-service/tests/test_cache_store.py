@@ -0,0 +1,96 @@
+import asyncio
+import sqlite3
+
+import cache_store
+from cache_store import MemoryLRU, SharedCache
+
+
+def test_memory_lru_evicts_least_recently_used_by_bytes():
+    lru = MemoryLRU(400)
+    for name in "abcd":
+        lru.put(name, b"x" * 100, None)
+    lru.get("a")
+    lru.put("e", b"x" * 100, None)
+    assert lru.get("b") is None
+    assert all(lru.get(name) is not None for name in "acde")
+    assert lru.size == 400
+
+    lru.put("big", b"x" * 101, None)   # over a quarter of the budget
+    assert lru.get("big") is None
+
+    lru.shrink(0.5)
+    assert lru.size == 200
+    # "d" and "e" were the two used last (by the membership check above)
+    assert lru.get("d") is not None and lru.get("e") is not None
+
+
+def test_sqlite_evicts_least_recently_accessed(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_store, "_TOUCH_INTERVAL", 0)
+    cache = SharedCache(str(tmp_path / "c.sqlite3"), max_bytes=1000, memory_bytes=0)
+    for i in range(8):
+        cache.put("ns", f"k{i}", b"x" * 100)
+    assert cache.get("ns", "k0") is not None   # k0 is now the most recent
+    for i in range(8, 16):   # entries this large run an eviction pass on every put
+        cache.put("ns", f"k{i}", b"x" * 100)
+
+    conn = sqlite3.connect(cache.path)
+    keys = {key for (key,) in conn.execute("SELECT key FROM entries")}
+    total = conn.execute("SELECT SUM(size) FROM entries").fetchone()[0]
+    assert total <= 1000
+    assert "k0" in keys and "k1" not in keys
+    assert {f"k{i}" for i in range(10, 16)} <= keys
+
+
+def test_memory_hits_see_other_processes_changes(tmp_path, monkeypatch):
+    path = str(tmp_path / "c.sqlite3")
+    mine, other = SharedCache(path, 1 << 20, 1 << 20), SharedCache(path, 1 << 20, 1 << 20)
+    mine.put("template", "t", b"v1", {"etag": "1"})
+
+    monkeypatch.setattr(cache_store, "CACHE_MEMORY_TTL_S", 3600)
+    other.put("template", "t", b"v2", {"etag": "2"})
+    assert mine.get("template", "t") == (b"v1", {"etag": "1"})   # within the TTL
+
+    monkeypatch.setattr(cache_store, "CACHE_MEMORY_TTL_S", 0)
+    assert mine.get("template", "t") == (b"v2", {"etag": "2"})
+    other.touch("template", "t", {"etag": "3"})
+    assert mine.get("template", "t") == (b"v2", {"etag": "3"})
+    other.delete("template", "t")
+    assert mine.get("template", "t") is None
+
+
+def test_adds_version_column_to_an_older_database(tmp_path):
+    path = str(tmp_path / "c.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE entries (namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+        " meta TEXT, size INTEGER NOT NULL, last_access REAL NOT NULL, PRIMARY KEY (namespace, key))"
+    )
+    conn.execute("INSERT INTO entries VALUES ('ns', 'k', x'01', NULL, 1, 0)")
+    conn.commit()
+    conn.close()
+
+    cache = SharedCache(path, 1 << 20, 1 << 20)
+    assert cache.get("ns", "k") == (b"\x01", None)
+    cache.put("ns", "k2", b"\x02")
+    assert cache.get("ns", "k2") == (b"\x02", None)
+
+
+def test_async_calls_leave_the_event_loop_free_while_sqlite_is_locked(tmp_path):
+    cache = SharedCache(str(tmp_path / "c.sqlite3"), 1 << 20, 1 << 20)
+    cache.put("ns", "k", b"v1")
+    writer = sqlite3.connect(cache.path, isolation_level=None, check_same_thread=False)
+    writer.execute("BEGIN IMMEDIATE")   # another process holding the write lock
+
+    async def scenario():
+        put = asyncio.ensure_future(cache.aput("ns", "k", b"v2"))
+        ticks = 0
+        while not put.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+            if ticks == 20:
+                writer.execute("COMMIT")
+        await put
+        return ticks
+
+    assert asyncio.run(scenario()) >= 20
+    assert asyncio.run(cache.aget("ns", "k")) == (b"v2", None)
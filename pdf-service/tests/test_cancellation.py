@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import cancellation
+from cancellation import CancellationMiddleware
+
+
+@pytest.fixture(autouse=True)
+def counts(monkeypatch):
+    monkeypatch.setattr(cancellation, "_counts", {"disconnected": 0, "deadline_exceeded": 0})
+    return cancellation._counts
+
+
+def _scope(*headers):
+    return {"type": "http", "method": "POST", "path": "/render", "headers": list(headers)}
+
+
+class Connection:
+    """The server side of one request: body first, then a disconnect on demand."""
+
+    def __init__(self):
+        self.gone = asyncio.Event()
+        self.sent = []
+        self._body_sent = False
+
+    async def receive(self):
+        if not self._body_sent:
+            self._body_sent = True
+            return {"type": "http.request", "body": b"{}", "more_body": False}
+        await self.gone.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+def _slow_app(events):
+    async def app(scope, receive, send):
+        await receive()
+        events.append("started")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+    return app
+
+
+async def _serve(app, scope):
+    conn = Connection()
+    await asyncio.wait_for(CancellationMiddleware(app)(scope, conn.receive, conn.send), 1)
+    return conn
+
+
+def test_client_disconnect_cancels_the_handler(counts):
+    events = []
+
+    async def scenario():
+        conn = Connection()
+        served = asyncio.ensure_future(CancellationMiddleware(_slow_app(events))(_scope(), conn.receive, conn.send))
+        await asyncio.sleep(0.01)
+        conn.gone.set()
+        await asyncio.wait_for(served, 1)
+        return conn
+
+    conn = asyncio.run(scenario())
+    assert events == ["started", "cancelled"]
+    assert conn.sent == []   # nobody to answer
+    assert counts == {"disconnected": 1, "deadline_exceeded": 0}
+
+
+def test_deadline_cancels_the_handler_and_answers_504(counts):
+    events = []
+    conn = asyncio.run(_serve(_slow_app(events), _scope((b"x-request-timeout-ms", b"20"))))
+    assert events == ["started", "cancelled"]
+    assert conn.sent[0]["status"] == 504
+    assert counts["deadline_exceeded"] == 1
+
+
+def test_completed_request_is_left_alone(counts):
+    async def app(scope, receive, send):
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    conn = asyncio.run(_serve(app, _scope((b"x-request-timeout-ms", b"1000"))))
+    assert [m.get("status") for m in conn.sent] == [200, None]
+    assert counts == {"disconnected": 0, "deadline_exceeded": 0}
+
+
+def test_invalid_timeout_header_is_a_400():
+    events = []
+    conn = asyncio.run(_serve(_slow_app(events), _scope((b"x-request-timeout-ms", b"0"))))
+    assert conn.sent[0]["status"] == 400 and events == []
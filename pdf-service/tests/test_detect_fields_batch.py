@@ -0,0 +1,46 @@
+import asyncio
+
+import detect_fields
+from detect_fields import FieldDetection
+
+
+def _local_pass(text):
+    result = FieldDetection()
+    result.mapping["guest_name"] = f"GUEST {text}"
+    result.confidence["guest_name"] = 0.99
+    result.sources["guest_name"] = "local"
+    return result, ["pin_code"]
+
+
+def test_garbage_answer_for_one_group_keeps_the_others(monkeypatch):
+    monkeypatch.setattr(detect_fields, "_local_pass", _local_pass)
+    monkeypatch.setattr(detect_fields, "DETECT_BATCH_MAX_DOCUMENTS", 1)
+
+    async def ask_gemini(prompt, max_output_tokens=2048):
+        if "=== Document doc2 ===" in prompt:
+            raise ValueError("Expecting value: line 1 column 1 (char 0)")
+        doc = "doc1" if "=== Document doc1 ===" in prompt else "doc3"
+        return {doc: {"pin_code": "1234"}}
+
+    monkeypatch.setattr(detect_fields, "ask_gemini", ask_gemini)
+    results, calls = asyncio.run(detect_fields.detect_fields_batch(["a", "b", "c"]))
+
+    assert calls == 3
+    assert all(isinstance(r, FieldDetection) for r in results)
+    assert results[0].mapping["pin_code"] == "1234"
+    assert results[2].mapping["pin_code"] == "1234"
+    assert "pin_code" not in results[1].mapping
+    assert results[1].fallback == "local"
+
+
+def test_answer_without_a_section_falls_back(monkeypatch):
+    monkeypatch.setattr(detect_fields, "_local_pass", _local_pass)
+
+    async def ask_gemini(prompt, max_output_tokens=2048):
+        return {"doc1": ["not", "an", "object"]}
+
+    monkeypatch.setattr(detect_fields, "ask_gemini", ask_gemini)
+    results, calls = asyncio.run(detect_fields.detect_fields_batch(["a", "b"]))
+
+    assert calls == 1
+    assert [r.fallback for r in results] == ["local", "local"]
@@ -0,0 +1,92 @@
+from detect_rules import detect_fields_locally, field_present, text_windows
+
+SAMPLE = """Booking.com
+Booking confirmation
+CONFIRMATION NUMBER: 4821.337.902
+PIN CODE: 5930
+
+CHECK-IN
+14
+MAY
+Thursday
+
+CHECK-OUT
+17
+MAY
+Sunday
+
+GUESTS
+2
+
+NIGHTS
+3
+
+Guest name: JANE DOE
+jane.doe@example.com
+2 adults
+
+1 room TL 21,726
+25 % VAT TL 5,432
+Price approx. TL 27,158
+(for your information: DKK 3,915.20)
+
+Cancellation cost
+until May 13, 2026 11:59 PM [Europe/Istanbul]: TL 0
+from May 14, 2026 12:00 AM [Europe/Istanbul]: TL 27,158
+"""
+
+
+def _values(found):
+    return {name: (m.value, m.confidence) for name, m in found.items()}
+
+
+def test_labelled_confirmation_fields_and_their_confidences():
+    found = detect_fields_locally(SAMPLE)
+    assert _values(found) == {
+        "confirmation_number": ("4821.337.902", 0.99),
+        "pin_code": ("5930", 0.99),
+        "guest_name": ("JANE DOE", 0.95),
+        "guest_email": ("jane.doe@example.com", 0.95),
+        "num_guests_display": ("2 adults", 0.9),
+        "cancel_until_date": ("May 13, 2026", 0.95),
+        "cancel_from_date": ("May 14, 2026", 0.9),
+        # Rooms + 25 % VAT add up to the total, which lifts it from 0.9
+        "price_total_tl": ("27,158", 0.95),
+        "price_rooms": ("21,726", 0.95),
+        "price_vat": ("5,432", 0.95),
+        "price_total_dkk": ("3,915.20", 0.9),
+        # Check-in agrees with the cancellation "from" date
+        "checkin_day": ("14", 0.97),
+        "checkin_month": ("MAY", 0.97),
+        "checkin_weekday": ("Thursday", 0.97),
+        "checkout_day": ("17", 0.9),
+        "checkout_month": ("MAY", 0.9),
+        "checkout_weekday": ("Sunday", 0.9),
+        "num_nights": ("3", 0.9),
+        "num_guests": ("2", 0.9),
+    }
+    # Every match points at its own text
+    for m in found.values():
+        assert SAMPLE[m.start:m.start + len(m.value)] == m.value
+
+
+def test_unlabelled_or_inconsistent_values_get_lower_confidence():
+    text = (SAMPLE.replace("CONFIRMATION NUMBER: ", "")
+            .replace("Price approx. TL", "Price TL")
+            .replace("TL 5,432", "TL 5,000")
+            .replace("Thursday", "Friday"))
+    found = _values(detect_fields_locally(text))
+    assert found["confirmation_number"] == ("4821.337.902", 0.85)
+    # Largest TL amount, with nothing adding up to it
+    assert found["price_total_tl"] == ("27,158", 0.6)
+    assert "price_rooms" not in found and "price_vat" not in found
+    # May 14, 2026 is not a Friday: no check-in day, so no cross-checks
+    assert "checkin_day" not in found and "num_nights" not in found
+    assert found["checkin_month"] == ("MAY", 0.9)
+
+
+def test_anchor_windows_for_the_llm_fallback():
+    assert field_present("pin_code", SAMPLE)
+    assert not field_present("refund_amount", SAMPLE)
+    window = text_windows(["pin_code"], SAMPLE, radius=20)
+    assert "PIN CODE: 5930" in window and "Cancellation" not in window
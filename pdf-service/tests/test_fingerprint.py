@@ -0,0 +1,41 @@
+import pikepdf
+from pikepdf import Array, Dictionary, Name
+
+from fingerprint import compute_fingerprint, match_template, remember_template
+
+
+def _template(guest: str, pin: str, inner_size: int = 9) -> pikepdf.Pdf:
+    """One page drawing a form that draws a nested form."""
+    pdf = pikepdf.new()
+    font = pdf.make_indirect(Dictionary(Type=Name.Font, Subtype=Name.Type1, BaseFont=Name.Helvetica))
+
+    def form(content: bytes, **xobjects):
+        stream = pikepdf.Stream(pdf, content)
+        stream.Type, stream.Subtype, stream.BBox = Name.XObject, Name.Form, Array([0, 0, 612, 792])
+        stream.Resources = Dictionary(Font=Dictionary(F1=font))
+        if xobjects:
+            stream.Resources.XObject = Dictionary(**xobjects)
+        return pdf.make_indirect(stream)
+
+    inner = form(f"BT /F1 {inner_size} Tf 72 600 Td (PIN: {pin}) Tj ET".encode())
+    outer = form(b"q /Inner Do Q", Inner=inner)
+    page = pdf.add_blank_page()
+    page.Resources = Dictionary(Font=Dictionary(F1=font), XObject=Dictionary(Fm0=outer))
+    page.Contents = pdf.make_stream(f"BT /F1 12 Tf 72 700 Td (Guest: {guest}) Tj ET q /Fm0 Do Q".encode())
+    return pdf
+
+
+def test_nested_forms_are_part_of_the_fingerprint():
+    with _template("Ann", "1234") as a, _template("Bob", "9876") as b, _template("Ann", "1234", 10) as c:
+        fp_a, fp_b, fp_c = compute_fingerprint(a), compute_fingerprint(b), compute_fingerprint(c)
+    # Values are masked out; a change of structure inside the nested form is not
+    assert fp_a.digest == fp_b.digest
+    assert fp_a.digest != fp_c.digest
+    assert [(r.page, r.size, r.text) for r in fp_a.runs] == [(0, 12.0, "Guest: Ann"), (0, 9.0, "PIN: 1234")]
+
+
+def test_known_template_gives_the_mapping_by_position():
+    with _template("Ann Example", "1234") as known, _template("Bob Other", "9876") as upload:
+        fp_known, fp_upload = compute_fingerprint(known), compute_fingerprint(upload)
+    assert remember_template(fp_known, {"guest_name": "Ann Example", "pin_code": "1234"})
+    assert match_template(fp_upload) == {"guest_name": "Bob Other", "pin_code": "9876"}
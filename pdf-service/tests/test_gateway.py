@@ -0,0 +1,166 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import gateway
+from gateway import HashRing
+
+URLS = ["http://a:8000", "http://b:8000", "http://c:8000"]
+KEYS = [f"template:https://cdn.example/hotel-{i}.pdf" for i in range(300)]
+
+
+def _owners(ring: HashRing) -> dict[str, str]:
+    return {key: ring.pick(key).url for key in KEYS}
+
+
+def test_keys_stick_to_a_replica_and_spread_over_all():
+    ring = HashRing(URLS)
+    owners = _owners(ring)
+    assert owners == _owners(ring)
+    assert set(owners.values()) == set(URLS)
+
+
+def test_only_a_departed_replicas_keys_move():
+    ring = HashRing(URLS)
+    before = _owners(ring)
+    ring.replicas[URLS[0]].healthy = False
+    after = _owners(ring)
+    assert URLS[0] not in after.values()
+    assert all(after[key] == url for key, url in before.items() if url != URLS[0])
+
+
+def test_hot_key_spills_over_bounded_load():
+    ring = HashRing(URLS, load_factor=1.25)
+    key = KEYS[0]
+    owner = ring.pick(key)
+    # capacity = ceil(1.25 * (in flight + 1) / 3) = 2 with three in flight
+    owner.in_flight = 3
+    spilled = ring.pick(key)
+    assert spilled is not owner
+    assert spilled.spilled == 1
+    # Every replica full: the owner still takes it
+    for replica in ring.replicas.values():
+        replica.in_flight = 10
+    assert ring.pick(key) is owner
+
+
+def test_pick_skips_excluded_replicas():
+    ring = HashRing(URLS)
+    key = KEYS[0]
+    first = ring.pick(key)
+    second = ring.pick(key, exclude=frozenset({first.url}))
+    assert second is not None and second is not first
+    assert ring.pick(key, exclude=frozenset(URLS)) is None
+    assert ring.pick(None, exclude=frozenset(URLS[:2])).url == URLS[2]
+
+
+async def _stream(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+def _client(monkeypatch, handler) -> TestClient:
+    real = httpx.AsyncClient
+
+    def client(**kwargs):
+        return real(transport=httpx.MockTransport(handler), **kwargs)
+
+    monkeypatch.setattr(gateway.httpx, "AsyncClient", client)
+    return TestClient(gateway.create_app(URLS[:2]))
+
+
+def test_connect_error_retries_on_another_replica(monkeypatch):
+    def handler(request: httpx.Request):
+        if request.url.path == "/health":
+            return httpx.Response(200)
+        if request.url.host == "a":
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, content=_stream(b"from b"))
+
+    with _client(monkeypatch, handler) as client:
+        resp = client.get("/anything")
+        status = client.get("/gateway/status").json()
+    assert resp.status_code == 200 and resp.text == "from b"
+    assert status["retried"] == 1
+    assert all(r["healthy"] and r["in_flight"] == 0 for r in status["replicas"].values())
+
+
+def test_error_after_sending_is_not_retried(monkeypatch):
+    calls = []
+
+    def handler(request: httpx.Request):
+        if request.url.path == "/health":
+            return httpx.Response(200)
+        calls.append(request.url.host)
+        raise httpx.ReadTimeout("slow", request=request)
+
+    with _client(monkeypatch, handler) as client:
+        resp = client.post("/generate-booking", json={"template_url": "https://cdn.example/x.pdf"})
+        status = client.get("/gateway/status").json()
+    assert resp.status_code == 502
+    assert len(calls) == 1
+    assert status["retried"] == 0 and status["upstream_errors"] == 1
+    assert all(r["healthy"] and r["in_flight"] == 0 for r in status["replicas"].values())
+
+
+def test_in_flight_released_when_stream_fails(monkeypatch):
+    async def broken():
+        yield b"partial"
+        raise httpx.ReadError("reset")
+
+    def handler(request: httpx.Request):
+        if request.url.path == "/health":
+            return httpx.Response(200)
+        return httpx.Response(200, content=broken())
+
+    with _client(monkeypatch, handler) as client:
+        try:
+            client.get("/anything")
+        except httpx.ReadError:
+            pass
+        status = client.get("/gateway/status").json()
+    assert all(r["in_flight"] == 0 for r in status["replicas"].values())
+
+
+def test_in_flight_released_when_client_leaves_before_the_replica_answers(monkeypatch):
+    real = httpx.AsyncClient
+
+    async def handler(request: httpx.Request):
+        if request.url.path == "/health":
+            return httpx.Response(200)
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(gateway.httpx, "AsyncClient", lambda **kwargs: real(transport=httpx.MockTransport(handler), **kwargs))
+    app = gateway.create_app(URLS[:2])
+
+    async def scenario():
+        async with app.router.lifespan_context(app):
+            async with real(transport=httpx.ASGITransport(app=app), base_url="http://gateway") as client:
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(client.get("/anything"), 0.2)
+                return (await client.get("/gateway/status")).json()
+
+    status = asyncio.run(scenario())
+    assert sum(r["routed"] for r in status["replicas"].values()) == 1
+    assert all(r["in_flight"] == 0 for r in status["replicas"].values())
+
+
+def test_spillover_skips_unhealthy_and_excluded_replicas():
+    urls = URLS + ["http://d:8000"]
+    ring = HashRing(urls, load_factor=1.25)
+    key = KEYS[0]
+    owner = ring.pick(key)
+    order = [owner.url]
+    for _ in range(3):
+        order.append(ring.pick(key, exclude=frozenset(order)).url)
+    # Owner full (capacity 2 with four in flight), next in ring order down
+    owner.in_flight = 4
+    ring.replicas[order[1]].healthy = False
+    assert ring.pick(key).url == order[2]
+    # ... and the one after that excluded, as after a failed attempt
+    assert ring.pick(key, exclude=frozenset({order[2]})).url == order[3]
+    assert ring.replicas[order[3]].spilled == 1
+    # Nothing but the full owner left: it still takes the request
+    assert ring.pick(key, exclude=frozenset(order[2:])) is owner
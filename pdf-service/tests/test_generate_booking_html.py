@@ -0,0 +1,72 @@
+import re
+from io import BytesIO
+
+import pikepdf
+import pytest
+
+import html_render
+from generate_booking_html import BookingData, render_booking_pdf
+from html_render import splice_static_pages
+
+BOOKING = BookingData(
+    guest_name="Ann Example", guest_email="ann@example.com", confirmation_number="1234.567.890",
+    pin_code="4321", checkin_date="2027-05-01", checkout_date="2027-05-04",
+)
+HOTEL = {"hotel_name": "Hotel Example", "page2_contact_text": "Call the front desk."}
+
+
+def _pdf(kind: str, pages: int) -> bytes:
+    pdf = pikepdf.new()
+    for i in range(pages):
+        page = pdf.add_blank_page()
+        page.Contents = pdf.make_stream(f"% {kind} page {i}".encode())
+    pdf.docinfo["/Title"] = kind
+    out = BytesIO()
+    pdf.save(out)
+    return out.getvalue()
+
+
+def _fake_render(html: str, stylesheet: str = "", full_fonts: bool = False) -> bytes:
+    """Stand-in for WeasyPrint: a page per page container, one more per 80 lines of text."""
+    kind = "static" if 'class="page"' not in html else "dynamic" if 'class="page2-title"' not in html else "all"
+    pages = len(re.findall(r'class="page(?:-2)?"', html)) + html.count("<br>") // 80
+    return _pdf(kind, pages)
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    calls = []
+
+    def render(html, *args, **kwargs):
+        result = _fake_render(html, *args, **kwargs)
+        with pikepdf.open(BytesIO(result)) as pdf:
+            calls.append(str(pdf.docinfo["/Title"]))
+        return result
+
+    monkeypatch.setattr(html_render, "render_html", render)
+    return calls
+
+
+def test_static_page_is_cached_and_overlaid(renders):
+    for _ in range(2):
+        with pikepdf.open(BytesIO(render_booking_pdf(BOOKING, HOTEL, {}))) as pdf:
+            assert len(pdf.pages) == 2
+            assert b"dynamic page 0" in pdf.pages[0].Contents.read_bytes()
+            assert b"static page 0" in pdf.pages[1].Contents.read_bytes()
+    assert renders == ["static", "dynamic", "dynamic"]
+
+
+def test_overflowing_static_part_is_rendered_in_full(renders):
+    hotel = dict(HOTEL, page2_contact_text="\n".join(["Late arrivals: call ahead."] * 100))
+    with pikepdf.open(BytesIO(render_booking_pdf(BOOKING, hotel, {}))) as pdf:
+        assert str(pdf.docinfo["/Title"]) == "all"
+        assert len(pdf.pages) == 3
+        assert b"all page 0" in pdf.pages[0].Contents.read_bytes()
+    assert renders == ["static", "all"]
+
+
+def test_splice_rejects_a_static_page_count_mismatch():
+    with pytest.raises(ValueError):
+        splice_static_pages(_pdf("dynamic", 2), _pdf("static", 2), 1)
+    with pikepdf.open(BytesIO(splice_static_pages(_pdf("dynamic", 2), _pdf("static", 1), 1))) as pdf:
+        assert len(pdf.pages) == 2
@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+import admission
+import main
+from main import HtmlBatchDocument, HtmlToPdfBatchRequest
+
+
+@pytest.fixture(autouse=True)
+def fresh_limiters(monkeypatch):
+    monkeypatch.setattr(admission, "_limiters", {})
+
+
+def _batch(*names: str) -> HtmlToPdfBatchRequest:
+    return HtmlToPdfBatchRequest(documents=[HtmlBatchDocument(html=f"<p>{n}</p>", name=n) for n in names])
+
+
+def test_streams_every_document_and_releases_the_slot(monkeypatch):
+    async def run(fn, html, stylesheet):
+        if "bad" in html:
+            raise ValueError("boom")
+        return html.encode()
+
+    monkeypatch.setattr(main.workers, "run", run)
+    with TestClient(main.app) as client:
+        resp = client.post("/html-to-pdf/batch", json=_batch("a", "bad", "c").model_dump())
+    lines = sorted((json.loads(line) for line in resp.text.splitlines()), key=lambda line: line["index"])
+    assert [line["status"] for line in lines] == ["success", "error", "success"]
+    assert lines[1] == {"index": 1, "name": "bad", "status": "error", "error": "boom"}
+    assert admission.limiter("html-to-pdf-batch").active == 0
+
+
+def test_client_gone_before_the_stream_starts(monkeypatch):
+    started = []
+
+    async def run(fn, html, stylesheet):
+        started.append(asyncio.current_task())
+        await asyncio.sleep(60)
+
+    async def send(message):
+        raise OSError("connection reset")
+
+    async def scenario():
+        response = await main.html_to_pdf_batch(_batch("a", "b"))
+        await asyncio.sleep(0)
+        with pytest.raises(ClientDisconnect):
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, None, send)
+        await asyncio.sleep(0)
+        return response.renders
+
+    monkeypatch.setattr(main.workers, "run", run)
+    renders = asyncio.run(scenario())
+    assert len(started) == 2 and all(r.cancelled() for r in renders)
+    assert admission.limiter("html-to-pdf-batch").active == 0
@@ -0,0 +1,54 @@
+import sys
+import types
+
+import pytest
+
+import html_render
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    """Stand-in for WeasyPrint's fetcher: 1000 bytes per URL, counted."""
+    calls = []
+
+    def default_url_fetcher(url, timeout=10, ssl_context=None):
+        calls.append(url)
+        return {"string": url.encode().ljust(1000, b"x"), "mime_type": "image/png"}
+
+    urls = types.ModuleType("weasyprint.urls")
+    urls.default_url_fetcher = default_url_fetcher
+    monkeypatch.setitem(sys.modules, "weasyprint.urls", urls)
+    monkeypatch.setattr(html_render, "_assets", html_render.OrderedDict())
+    monkeypatch.setattr(html_render, "_assets_size", 0)
+    return calls
+
+
+def test_assets_expire_after_the_ttl(fetches, monkeypatch):
+    url = "https://cdn.example/logo.png"
+    assert html_render.safe_url_fetcher(url)["mime_type"] == "image/png"
+    html_render.safe_url_fetcher(url)
+    assert fetches == [url]
+
+    monkeypatch.setattr(html_render, "HTML_ASSET_CACHE_TTL_S", 0)
+    html_render.safe_url_fetcher(url)
+    assert fetches == [url, url]
+    assert html_render._assets_size == 1000
+
+
+def test_assets_are_bounded_by_bytes(fetches, monkeypatch):
+    monkeypatch.setattr(html_render, "HTML_ASSET_CACHE_MAX_BYTES", 4000)
+    for name in "abcde":
+        html_render.safe_url_fetcher(f"https://cdn.example/{name}.png")
+    assert list(html_render._assets) == [f"https://cdn.example/{name}.png" for name in "bcde"]
+    assert html_render._assets_size == 4000
+
+    monkeypatch.setattr(html_render, "HTML_ASSET_CACHE_MAX_BYTES", 2000)   # 1000 > a quarter
+    html_render.safe_url_fetcher("https://cdn.example/big.png")
+    assert "https://cdn.example/big.png" not in html_render._assets
+
+
+def test_only_https_and_data_urls(fetches):
+    with pytest.raises(ValueError):
+        html_render.safe_url_fetcher("http://cdn.example/logo.png")
+    with pytest.raises(ValueError):
+        html_render.safe_url_fetcher("file:///etc/passwd")
@@ -0,0 +1,46 @@
+import httpx
+import pytest
+
+import images
+
+
+def _serve(monkeypatch, routes: dict):
+    """Answer GETs from *routes* (url -> response), counting requests."""
+    seen = []
+
+    def handler(request: httpx.Request):
+        seen.append(str(request.url))
+        return routes[str(request.url)]
+
+    real = httpx.Client
+    monkeypatch.setattr(httpx, "Client", lambda **kwargs: real(transport=httpx.MockTransport(handler), **kwargs))
+    return seen
+
+
+def _redirect(location: str) -> httpx.Response:
+    return httpx.Response(302, headers={"Location": location})
+
+
+def test_https_redirects_are_followed(monkeypatch):
+    seen = _serve(monkeypatch, {
+        "https://cdn.example/photo.jpg": _redirect("/v2/photo.jpg"),
+        "https://cdn.example/v2/photo.jpg": httpx.Response(200, content=b"jpeg"),
+    })
+    assert images._fetch_source("https://cdn.example/photo.jpg") == b"jpeg"
+    assert seen == ["https://cdn.example/photo.jpg", "https://cdn.example/v2/photo.jpg"]
+
+
+@pytest.mark.parametrize("location", ["http://cdn.example/photo.jpg", "http://169.254.169.254/latest/meta-data"])
+def test_redirect_off_https_is_blocked(monkeypatch, location):
+    seen = _serve(monkeypatch, {"https://cdn.example/photo.jpg": _redirect(location)})
+    with pytest.raises(ValueError, match="Blocked redirect"):
+        images._fetch_source("https://cdn.example/photo.jpg")
+    assert seen == ["https://cdn.example/photo.jpg"]
+    # The template keeps the original URL
+    assert images.optimized_image_uri("https://cdn.example/photo.jpg", "thumb") == "https://cdn.example/photo.jpg"
+
+
+def test_redirect_loop_ends(monkeypatch):
+    _serve(monkeypatch, {"https://cdn.example/a": _redirect("https://cdn.example/a")})
+    with pytest.raises(ValueError, match="redirects"):
+        images._fetch_source("https://cdn.example/a")
@@ -0,0 +1,58 @@
+import json
+import random
+
+import pytest
+
+from json_stream import ObjectStreamParser
+
+ANSWER = (
+    '```json\n{"guest_name": "Jürgen \\"JJ\\" Ødegård", "nights": 3, "price": -1.5e2,'
+    ' "paid": true, "note": null, "rooms": [{"type": "double", "beds": [1, 2]}],'
+    ' "address": {"city": "Antalya, TR", "lines": ["}", "]"]}}\n```'
+)
+
+
+def _feed_in_chunks(text: str, sizes) -> tuple[ObjectStreamParser, list]:
+    parser, pairs, pos = ObjectStreamParser(), [], 0
+    for size in sizes:
+        pairs += parser.feed(text[pos:pos + size])
+        pos += size
+    pairs += parser.feed(text[pos:])
+    return parser, pairs
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_any_chunking_gives_the_full_parse(seed):
+    rng = random.Random(seed)
+    sizes = [rng.randint(1, 7) for _ in range(len(ANSWER))]
+    parser, pairs = _feed_in_chunks(ANSWER, sizes)
+    expected = json.loads(ANSWER[ANSWER.index("{"):ANSWER.rindex("}") + 1])
+    assert parser.done
+    assert parser.result == expected
+    assert pairs == list(expected.items())
+
+
+def test_pairs_are_returned_as_soon_as_complete():
+    parser = ObjectStreamParser()
+    assert parser.feed('{"guest_name": "Ann') == []
+    assert parser.feed('a", "nights": 1') == [("guest_name", "Anna")]
+    # A number may still go on until a delimiter follows
+    assert parser.feed("2") == []
+    assert parser.feed(" ,") == [("nights", 12)]
+    assert parser.feed('"pin": "1234"}') == [("pin", "1234")]
+    assert parser.done
+    assert parser.feed(', "ignored": 1') == []
+
+
+def test_empty_object_and_prefix_without_brace():
+    parser = ObjectStreamParser()
+    assert parser.feed("Sure, here it is: ") == []
+    assert not parser.done
+    assert parser.feed("{ }") == []
+    assert parser.done and parser.result == {}
+
+
+@pytest.mark.parametrize("text", ['{"a" 1}', '{"a": 1 "b": 2}', "{a: 1}"])
+def test_malformed_input_raises(text):
+    with pytest.raises(ValueError):
+        ObjectStreamParser().feed(text)
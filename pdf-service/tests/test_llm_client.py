@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import llm_client
+from llm_client import LLMError, LLMUnavailable, breaker_state, generate_content
+
+ANSWER = {"candidates": [{"content": {"parts": [{"text": "{}"}]}}]}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Route calls to ``upstream.handler`` and reset the breaker and counters."""
+    calls = []
+
+    class Upstream:
+        handler = None
+
+    async def dispatch(request):
+        calls.append(request)
+        return await Upstream.handler(len(calls))
+
+    monkeypatch.setattr(llm_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(dispatch)))
+    monkeypatch.setattr(llm_client, "_latencies", llm_client.deque(maxlen=200))
+    monkeypatch.setattr(llm_client, "_consecutive_failures", 0)
+    monkeypatch.setattr(llm_client, "_opened_at", None)
+    monkeypatch.setattr(llm_client, "_probe_in_flight", False)
+    monkeypatch.setattr(llm_client, "_counters", dict.fromkeys(llm_client._counters, 0))
+    monkeypatch.setattr(llm_client, "GEMINI_BREAKER_FAILURES", 2)
+    monkeypatch.setattr(llm_client, "GEMINI_RETRY_BASE_S", 0.0)
+    monkeypatch.setattr(llm_client, "GEMINI_HEDGE_AFTER_S", 0.0)
+    Upstream.calls = calls
+    return Upstream
+
+
+def _respond(status: int, **headers):
+    async def handler(n):
+        return httpx.Response(status, json=ANSWER if status == 200 else {}, headers=headers)
+    return handler
+
+
+def _cool_down():
+    llm_client._opened_at = time.monotonic() - llm_client.GEMINI_BREAKER_COOLDOWN_S
+
+
+def test_breaker_opens_then_lets_one_probe_through(upstream):
+    async def scenario():
+        upstream.handler = _respond(400)
+        for _ in range(2):
+            with pytest.raises(LLMError):
+                await generate_content({})
+        assert breaker_state() == "open"
+        with pytest.raises(LLMUnavailable):
+            await generate_content({})
+        assert len(upstream.calls) == 2   # rejected without calling upstream
+
+        # Half-open: a single probe goes up, a concurrent call is turned away
+        _cool_down()
+        assert breaker_state() == "half-open"
+        gate = asyncio.Event()
+
+        async def slow_failure(n):
+            await gate.wait()
+            return httpx.Response(400)
+        upstream.handler = slow_failure
+        probe = asyncio.ensure_future(generate_content({}))
+        await asyncio.sleep(0.01)
+        with pytest.raises(LLMUnavailable):
+            await generate_content({})
+        gate.set()
+        with pytest.raises(LLMError):
+            await probe
+        assert breaker_state() == "open"   # a failed probe re-opens at once
+
+        # The next probe succeeds and closes it
+        _cool_down()
+        upstream.handler = _respond(200)
+        assert await generate_content({}) == ANSWER
+        assert breaker_state() == "closed"
+        assert await generate_content({}) == ANSWER
+
+    asyncio.run(scenario())
+    assert llm_client.stats()["rejected"] == 2
+    assert llm_client.stats()["consecutive_failures"] == 0
+
+
+def test_cancelled_probe_frees_the_half_open_slot(upstream):
+    async def scenario():
+        _cool_down()
+
+        async def hang(n):
+            await asyncio.sleep(10)
+        upstream.handler = hang
+        probe = asyncio.ensure_future(generate_content({}))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        upstream.handler = _respond(200)
+        assert await generate_content({}) == ANSWER
+
+    asyncio.run(scenario())
+    assert breaker_state() == "closed"
+
+
+def test_slow_call_is_hedged_and_the_faster_answer_wins(upstream, monkeypatch):
+    monkeypatch.setattr(llm_client, "GEMINI_HEDGE_AFTER_S", 0.05)
+    first_cancelled = []
+
+    async def handler(n):
+        if n == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                first_cancelled.append(True)
+                raise
+        return httpx.Response(200, json=ANSWER)
+    upstream.handler = handler
+
+    assert asyncio.run(generate_content({})) == ANSWER
+    assert len(upstream.calls) == 2 and first_cancelled
+    stats = llm_client.stats()
+    assert (stats["hedged"], stats["hedge_wins"], stats["breaker"]) == (1, 1, "closed")
+
+
+def test_fast_call_is_not_hedged(upstream, monkeypatch):
+    monkeypatch.setattr(llm_client, "GEMINI_HEDGE_AFTER_S", 0.5)
+    upstream.handler = _respond(200)
+    assert asyncio.run(generate_content({})) == ANSWER
+    assert len(upstream.calls) == 1 and llm_client.stats()["hedged"] == 0
+
+
+def test_retryable_status_is_retried(upstream):
+    async def handler(n):
+        return httpx.Response(503, headers={"Retry-After": "0"}) if n == 1 else httpx.Response(200, json=ANSWER)
+    upstream.handler = handler
+    assert asyncio.run(generate_content({})) == ANSWER
+    assert llm_client.stats()["retries"] == 1 and breaker_state() == "closed"
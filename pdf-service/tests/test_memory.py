@@ -0,0 +1,50 @@
+import tracemalloc
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import memory
+import workers
+
+MB = 1024 * 1024
+
+
+def _allocate(size: int) -> int:
+    return len(bytearray(size))
+
+
+def test_worker_peaks_by_route_template(monkeypatch):
+    monkeypatch.setenv("MEMORY_TRACE", "1")   # read by the workers at start
+    monkeypatch.setattr(memory, "_peaks", {})
+    app = FastAPI()
+    app.middleware("http")(memory.memory_middleware)
+
+    @app.get("/items/{item}")
+    async def item(item: str):
+        return {"size": await workers.run(_allocate, 8 * MB)}
+
+    tracemalloc.start()
+    try:
+        with TestClient(app) as client:
+            responses = [client.get(f"/items/{i}") for i in range(3)]
+            assert client.get("/nowhere").status_code == 404
+    finally:
+        tracemalloc.stop()
+        workers.shutdown()
+
+    for response in responses:
+        assert int(response.headers["X-Worker-Memory-Peak-KB"]) >= 8 * 1024
+    assert list(memory._peaks) == ["/items/{item}"]
+    assert memory._peaks["/items/{item}"]["worker"] >= 8 * MB
+
+
+def test_debug_memory_needs_a_configured_api_key(monkeypatch):
+    import main
+    client = TestClient(main.app)
+    monkeypatch.setattr(main, "PDF_SERVICE_API_KEY", "")
+    assert client.get("/debug/memory").status_code == 403
+
+    monkeypatch.setattr(main, "PDF_SERVICE_API_KEY", "secret")
+    assert client.get("/debug/memory", headers={"x-api-key": "wrong"}).status_code == 401
+    # Past the key checks: tracing is off in tests
+    assert client.get("/debug/memory", headers={"x-api-key": "secret"}).status_code == 409
@@ -0,0 +1,91 @@
+from io import BytesIO
+
+import pikepdf
+from pikepdf import Array, Dictionary, Name
+
+from replace_text import content_streams, replace_text_in_pdf, text_runs
+
+
+def _font(pdf, width: int):
+    """Helvetica with every character *width* units wide."""
+    return pdf.make_indirect(Dictionary(
+        Type=Name.Font, Subtype=Name.Type1, BaseFont=Name.Helvetica,
+        FirstChar=32, LastChar=126, Widths=Array([width] * 95),
+    ))
+
+
+def _form(pdf, content: bytes, font, subtype=True):
+    form = pikepdf.Stream(pdf, content)
+    if subtype:
+        form.Type, form.Subtype = Name.XObject, Name.Form
+    form.BBox = Array([0, 0, 612, 792])
+    form.Resources = Dictionary(Font=Dictionary(F1=font))
+    return pdf.make_indirect(form)
+
+
+def _page(pdf, content: bytes, font=None, form=None):
+    page = pdf.add_blank_page()
+    page.Resources = Dictionary()
+    if font is not None:
+        page.Resources.Font = Dictionary(F1=font)
+    if form is not None:
+        page.Resources.XObject = Dictionary(Fm0=form)
+    page.Contents = pdf.make_stream(content)
+    return page
+
+
+def _replace(pdf, replacements: dict) -> pikepdf.Pdf:
+    out = BytesIO()
+    pdf.save(out)
+    return pikepdf.open(BytesIO(replace_text_in_pdf(out.getvalue(), replacements)))
+
+
+def _tm_x(stream) -> list[float]:
+    return [float(operands[4]) for operands, op in pikepdf.parse_content_stream(stream) if str(op) == "Tm"]
+
+
+def test_form_shared_by_two_pages_is_rewritten_once():
+    pdf = pikepdf.new()
+    form = _form(pdf, b"BT /F1 12 Tf 72 700 Td (Hello GUESTNAME) Tj ET", _font(pdf, 500))
+    for _ in range(2):
+        _page(pdf, b"q /Fm0 Do Q", form=form)
+    assert len(content_streams(pdf)) == 3
+
+    # Applied twice, the replacement would grow to "GUESTNAME Jr Jr"
+    with _replace(pdf, {"GUESTNAME": "GUESTNAME Jr"}) as result:
+        assert text_runs(result) == ["Hello GUESTNAME Jr"]
+        assert result.pages[0].Resources.XObject.Fm0.objgen == result.pages[1].Resources.XObject.Fm0.objgen
+
+
+def test_widget_appearance_streams_are_rewritten():
+    pdf = pikepdf.new()
+    font = _font(pdf, 500)
+    page = _page(pdf, b"")
+    # Appearance streams often lack /Subtype /Form
+    normal = _form(pdf, b"BT /F1 10 Tf 2 2 Td (GUESTNAME) Tj ET", font, subtype=False)
+    down = _form(pdf, b"BT /F1 10 Tf 2 2 Td (GUESTNAME!) Tj ET", font, subtype=False)
+    widget = pdf.make_indirect(Dictionary(
+        Type=Name.Annot, Subtype=Name.Widget, FT=Name.Tx, T=pikepdf.String("guest"),
+        Rect=Array([72, 700, 272, 720]), AP=Dictionary(N=normal, D=Dictionary(On=down)),
+    ))
+    page.Annots = pdf.make_indirect(Array([widget]))
+    pdf.Root.AcroForm = Dictionary(Fields=Array([widget]))
+
+    with _replace(pdf, {"GUESTNAME": "Ann Example"}) as result:
+        ap = result.pages[0].Annots[0].AP
+        assert text_runs(result) == ["Ann Example", "Ann Example!"]
+        assert b"(Ann Example)" in ap.N.read_bytes()
+        assert b"(Ann Example!)" in ap.D.On.read_bytes()
+
+
+def test_widths_come_from_the_font_of_the_rewritten_stream():
+    pdf = pikepdf.new()
+    text = b"BT /F1 1 Tf 10 0 0 10 100 700 Tm (1,000) Tj ET"
+    # Both streams call their font /F1, but the fonts differ
+    form = _form(pdf, text, _font(pdf, 1000))
+    _page(pdf, text + b" q /Fm0 Do Q", font=_font(pdf, 500), form=form)
+
+    with _replace(pdf, {"1,000": "10,000"}) as result:
+        # Right-aligned price: moved left by one character at 10 pt
+        assert _tm_x(result.pages[0].Contents) == [95.0]
+        assert _tm_x(result.pages[0].Resources.XObject.Fm0) == [90.0]
@@ -0,0 +1,74 @@
+import hashlib
+
+import pytest
+
+import storage
+from storage import upload_pdf
+
+
+class FakeS3:
+    """Records what boto3's transfer methods would have uploaded."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+        self.objects[(bucket, key)] = (fileobj.read(), ExtraArgs)
+
+    def upload_file(self, filename, bucket, key, ExtraArgs=None, Config=None):
+        with open(filename, "rb") as f:
+            self.objects[(bucket, key)] = (f.read(), ExtraArgs)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    client = FakeS3()
+    monkeypatch.setattr(storage, "S3_ENDPOINT_URL", "http://localhost:9000")
+    monkeypatch.setattr(storage, "S3_ACCESS_KEY_ID", "key")
+    monkeypatch.setattr(storage, "S3_SECRET_ACCESS_KEY", "secret")
+    monkeypatch.setattr(storage, "_client", client)
+    return client
+
+
+def test_bytes_are_uploaded_with_their_checksum(s3):
+    data = b"%PDF-1.7 booking"
+    result = upload_pdf(data, "/bookings/4821.pdf")
+    sha256 = hashlib.sha256(data).hexdigest()
+    assert result == {"bucket": "generated-docs", "storage_path": "bookings/4821.pdf",
+                      "sha256": sha256, "size": len(data)}
+    body, extra = s3.objects[("generated-docs", "bookings/4821.pdf")]
+    assert body == data
+    assert extra == {"ContentType": "application/pdf", "Metadata": {"sha256": sha256}}
+
+
+def test_a_file_is_uploaded_from_its_path(s3, tmp_path):
+    data = b"%PDF-1.7 " + b"x" * (3 * 1024 * 1024)
+    path = tmp_path / "bundle.pdf"
+    path.write_bytes(data)
+    result = upload_pdf(str(path), "dossiers/1.pdf", bucket="dossiers")
+    assert (result["sha256"], result["size"]) == (hashlib.sha256(data).hexdigest(), len(data))
+    assert s3.objects[("dossiers", "dossiers/1.pdf")][0] == data
+
+
+def test_invalid_paths_are_refused(s3):
+    for key in ("", "/", "bookings/../secrets.pdf"):
+        with pytest.raises(ValueError):
+            upload_pdf(b"%PDF", key)
+    assert not s3.objects
+
+
+def test_upload_needs_configuration(monkeypatch):
+    monkeypatch.setattr(storage, "S3_ENDPOINT_URL", "")
+    assert not storage.storage_enabled()
+    with pytest.raises(RuntimeError):
+        upload_pdf(b"%PDF", "bookings/1.pdf")
+
+
+def test_one_client_with_the_multipart_settings(s3, monkeypatch):
+    monkeypatch.setattr(storage, "_client", None)
+    monkeypatch.setattr(storage, "_transfer_config", None)
+    monkeypatch.setattr(storage, "S3_MULTIPART_THRESHOLD", 5 * 1024 * 1024)
+    client = storage._get_client()
+    assert storage._get_client() is client
+    assert storage._transfer_config.multipart_threshold == 5 * 1024 * 1024
+    assert client.meta.endpoint_url == "http://localhost:9000"
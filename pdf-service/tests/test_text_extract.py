@@ -0,0 +1,64 @@
+import asyncio
+import os
+from io import BytesIO
+
+import pikepdf
+import pytest
+
+import uploads
+import workers
+from text_extract import extract_page_range, extract_pdf_text, extract_text_parallel, page_ranges
+
+
+def _pdf(pages: int) -> bytes:
+    pdf = pikepdf.new()
+    font = pdf.make_indirect(pikepdf.Dictionary(
+        Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1, BaseFont=pikepdf.Name.Helvetica,
+    ))
+    for i in range(pages):
+        page = pdf.add_blank_page()
+        page.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font))
+        page.Contents = pdf.make_stream(f"BT /F1 12 Tf 72 700 Td (Page {i + 1}) Tj ET".encode())
+    out = BytesIO()
+    pdf.save(out)
+    return out.getvalue()
+
+
+def test_path_and_bytes_give_the_same_text(tmp_path):
+    data = _pdf(3)
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(data)
+    text = extract_pdf_text(data)
+    assert [line for line in text.split() if line != "Page"] == ["1", "2", "3"]
+    assert extract_pdf_text(str(path)) == text
+
+
+def test_page_ranges_join_to_the_sequential_text(tmp_path):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(_pdf(10))
+    ranges = page_ranges(10, 3)
+    assert ranges[0][0] == 0 and ranges[-1][1] == 10
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    assert "".join(extract_page_range(str(path), *r) for r in ranges) == extract_pdf_text(str(path))
+
+
+def test_failed_range_stops_the_others_before_the_file_goes(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(workers, "WORKER_PROCESSES", 3)
+    stopped = []
+
+    async def run(fn, path, first, last):
+        assert os.path.dirname(path) == str(tmp_path)
+        if first == 0:
+            raise ValueError("bad page")
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            stopped.append(os.path.exists(path))
+            raise
+
+    monkeypatch.setattr(workers, "run", run)
+    with pytest.raises(ValueError, match="bad page"):
+        asyncio.run(extract_text_parallel(_pdf(12)))
+    assert stopped == [True, True]
+    assert not os.listdir(tmp_path)
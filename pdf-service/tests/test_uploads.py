@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+from io import BytesIO
+
+import pikepdf
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import UploadFile
+
+import uploads
+from uploads import read_upload
+
+
+def _pdf(pages: int) -> bytes:
+    pdf = pikepdf.new()
+    for _ in range(pages):
+        pdf.add_blank_page()
+    out = BytesIO()
+    pdf.save(out)
+    return out.getvalue()
+
+
+def _upload(data: bytes, max_size: int) -> UploadFile:
+    """An upload as Starlette's multipart parser leaves it."""
+    f = tempfile.SpooledTemporaryFile(max_size=max_size)
+    f.write(data)
+    f.seek(0)
+    return UploadFile(f, size=len(data), filename="doc.pdf")
+
+
+@pytest.fixture
+def spool_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(uploads, "UPLOAD_SPOOL_THRESHOLD", 1024)
+    return tmp_path
+
+
+def test_large_upload_is_used_where_starlette_spooled_it(spool_dir):
+    data = _pdf(20)
+    file = _upload(data, max_size=1024)
+    pdf = asyncio.run(read_upload(file))
+    try:
+        assert pdf.on_disk and pdf.path.startswith("/proc/")
+        assert not os.listdir(spool_dir)   # no second copy
+        assert (pdf.size, pdf.sha256) == (len(data), hashlib.sha256(data).hexdigest())
+        assert pdf.read_bytes() == data
+        # Worker processes open it by the same path
+        child = subprocess.run([sys.executable, "-c", f"print(len(open({pdf.path!r}, 'rb').read()))"],
+                               capture_output=True, text=True, check=True)
+        assert int(child.stdout) == len(data)
+        with pdf.open_pikepdf() as doc:
+            assert len(doc.pages) == 20
+    finally:
+        pdf.close()
+    assert not file.file.closed   # Starlette closes its own spool file
+
+
+def test_upload_kept_in_memory_by_starlette_is_rolled_over(spool_dir):
+    data = _pdf(20)
+    file = _upload(data, max_size=1 << 20)
+    pdf = asyncio.run(read_upload(file))
+    assert pdf.on_disk and pdf.read_bytes() == data
+    pdf.close()
+
+
+def test_small_upload_stays_in_memory(spool_dir):
+    data = _pdf(1)
+    assert len(data) <= 1024
+    pdf = asyncio.run(read_upload(_upload(data, max_size=1 << 20)))
+    assert not pdf.on_disk and pdf.read_bytes() == data
+
+
+def test_without_proc_the_upload_is_copied(spool_dir, monkeypatch):
+    monkeypatch.setattr(uploads, "_fd_path", lambda f: None)
+    data = _pdf(20)
+    pdf = asyncio.run(read_upload(_upload(data, max_size=1024)))
+    assert os.path.dirname(pdf.path) == str(spool_dir) and pdf.read_bytes() == data
+    pdf.close()
+    assert not os.listdir(spool_dir)
+
+
+def test_oversized_upload_is_rejected(spool_dir):
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(read_upload(_upload(_pdf(20), max_size=1024), max_bytes=1000))
+    assert e.value.status_code == 413
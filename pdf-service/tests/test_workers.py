@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import workers
+
+
+def _spin(marker: str) -> str:
+    """A long job with a checkpoint between short stages."""
+    open(marker, "w").close()
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        workers.checkpoint()
+        time.sleep(0.01)
+    return "finished"
+
+
+@pytest.fixture
+def pool():
+    yield
+    workers.shutdown()
+
+
+def test_cancelled_running_job_stops_at_checkpoint(tmp_path, pool):
+    marker = tmp_path / "started"
+    aborted = workers.stats()["aborted_running"]
+
+    async def main():
+        job = asyncio.ensure_future(workers.run(_spin, str(marker)))
+        while not marker.exists():
+            await asyncio.sleep(0.05)
+        started = time.monotonic()
+        job.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await job
+        # The slot is only freed once the worker has left the job
+        while workers._busy and time.monotonic() - started < 10:
+            await asyncio.sleep(0.05)
+        assert workers._busy == 0
+        assert time.monotonic() - started < 10
+        # Same worker, still usable
+        assert await workers.run(os.getpid) != os.getpid()
+
+    asyncio.run(main())
+    assert workers.stats()["aborted_running"] == aborted + 1
+
+
+def _echo(value):
+    return value
+
+
+def _copied_since(before: dict) -> dict:
+    return {key: workers._copies[key] - before[key] for key in before}
+
+
+def test_handoff_copies_and_cleanup(tmp_path, monkeypatch, pool):
+    monkeypatch.setattr(workers, "WORKER_HANDOFF_DIR", str(tmp_path))
+    size = 2 * workers.WORKER_HANDOFF_MIN_BYTES   # workers keep the default threshold
+
+    before = dict(workers._copies)
+    assert asyncio.run(workers.run(_echo, b"x" * size)) == b"x" * size
+    copied = _copied_since(before)
+    assert copied["handed_off"] == 2 and copied["fallbacks"] == 0
+    assert copied["bytes_copied"] == 2 * 2 * size
+
+    before = dict(workers._copies)
+    assert asyncio.run(workers.run(_echo, "é" * size)) == "é" * size
+    assert _copied_since(before)["bytes_copied"] == 2 * 4 * (2 * size)   # UTF-8, encoded and decoded
+
+    assert not os.listdir(tmp_path)
+
+
+def test_handoff_falls_back_to_pickle_when_dir_unusable(tmp_path, monkeypatch, pool):
+    monkeypatch.setattr(workers, "WORKER_HANDOFF_DIR", str(tmp_path / "missing"))
+    monkeypatch.setattr(workers, "WORKER_HANDOFF_MIN_BYTES", 1024)
+
+    before = dict(workers._copies)
+    assert asyncio.run(workers.run(_echo, b"x" * 4096)) == b"x" * 4096
+    copied = _copied_since(before)
+    assert copied["fallbacks"] == 1 and copied["handed_off"] == 0
+    assert copied["pickled_bytes"] == 2 * 4096
+
+
+@pytest.fixture
+def lanes(monkeypatch):
+    """Empty lanes with every worker busy."""
+    monkeypatch.setattr(workers, "_lanes", {name: workers._Lane() for name in workers.REQUEST_CLASSES})
+    monkeypatch.setattr(workers, "_busy", workers.WORKER_PROCESSES)
+    monkeypatch.setattr(workers, "_interactive_streak", 0)
+    monkeypatch.setattr(workers, "_aged", 0)
+    monkeypatch.setattr(workers, "WORKER_INTERACTIVE_WEIGHT", 2)
+    monkeypatch.setattr(workers, "WORKER_BULK_MAX_WAIT_S", 10.0)
+
+
+def _dispatch_order(waiting: dict[str, list[float]], cancelled: frozenset[str] = frozenset()) -> list[str]:
+    """Names of the waiters in the order freed workers take them.
+
+    *waiting* maps each lane to the enqueue times of its waiters, which
+    are named ``<lane><index>``.
+    """
+    async def main():
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for lane, times in waiting.items():
+            for i, enqueued in enumerate(times):
+                fut = loop.create_future()
+                futures[fut] = f"{lane}{i}"
+                workers._lanes[lane].waiters.append((fut, enqueued))
+                if futures[fut] in cancelled:
+                    fut.cancel()
+        order = []
+        for _ in range(len(futures)):
+            workers._release()
+            order += [name for fut, name in futures.items() if fut.done() and not fut.cancelled() and name not in order]
+        return order
+
+    return asyncio.run(main())
+
+
+def test_interactive_overtakes_bulk_with_weighted_share(lanes):
+    now = time.monotonic()
+    order = _dispatch_order({"interactive": [now] * 5, "bulk": [now] * 2})
+    assert order == [
+        "interactive0", "interactive1", "bulk0",
+        "interactive2", "interactive3", "bulk1",
+        "interactive4",
+    ]
+
+
+def test_aged_bulk_job_goes_next(lanes):
+    now = time.monotonic()
+    order = _dispatch_order({"interactive": [now] * 2, "bulk": [now - 11]})
+    assert order[0] == "bulk0"
+    assert workers._aged == 1
+
+
+def test_cancelled_waiters_do_not_count(lanes):
+    now = time.monotonic()
+    # The long-waiting bulk job was cancelled: nothing has aged
+    order = _dispatch_order(
+        {"interactive": [now] * 3, "bulk": [now - 11, now]},
+        cancelled=frozenset({"bulk0", "interactive0"}),
+    )
+    assert order == ["interactive1", "interactive2", "bulk1"]
+    assert workers._aged == 0
+    assert not any(lane.waiters for lane in workers._lanes.values())
@@ -0,0 +1,118 @@
+"""
+Plain-text extraction with pdfminer, run in the worker pool.
+
+pdfminer lays out one page after another in a single thread, so a long
+bank statement or application packet takes seconds. From
+``EXTRACT_PARALLEL_MIN_PAGES`` pages on, ``extract_text_parallel``
+splits the document into contiguous page ranges, one per worker (at
+least ``EXTRACT_MIN_PAGES_PER_TASK`` pages each), and every worker
+memory-maps the same file and lays out only its own pages. pdfminer
+ends each page with a form feed, so joining the ranges in order gives
+exactly the text of a sequential pass.
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import mmap
+import os
+import tempfile
+from io import BytesIO, StringIO
+from typing import Union
+
+from config import env_int
+
+EXTRACT_PARALLEL_MIN_PAGES = env_int("EXTRACT_PARALLEL_MIN_PAGES", 8)
+EXTRACT_MIN_PAGES_PER_TASK = max(1, env_int("EXTRACT_MIN_PAGES_PER_TASK", 4))
+
+
+def _extract_text(fp, page_numbers=None) -> str:
+    """``pdfminer.high_level.extract_text`` of the open file *fp*, with a
+    cancellation checkpoint before every page."""
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+    from workers import checkpoint
+
+    rsrcmgr = PDFResourceManager(caching=True)
+    with StringIO() as output:
+        interpreter = PDFPageInterpreter(rsrcmgr, TextConverter(rsrcmgr, output, laparams=LAParams()))
+        for page in PDFPage.get_pages(fp, page_numbers):
+            checkpoint()
+            interpreter.process_page(page)
+        return output.getvalue()
+
+
+def _extract_file_text(path: str, page_numbers=None) -> str:
+    """:func:`_extract_text` of the file at *path*, memory-mapped."""
+    from uploads import MappedFile
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _extract_text(MappedFile(mm), page_numbers)
+
+
+def extract_pdf_text(source: Union[bytes, str]) -> str:
+    """pdfminer text of *source* (PDF bytes or a file path); picklable for workers."""
+    if isinstance(source, (bytes, bytearray)):
+        return _extract_text(BytesIO(source))
+    return _extract_file_text(source)
+
+
+def extract_page_range(path: str, first: int, last: int) -> str:
+    """pdfminer text of pages ``first..last-1`` (0-based) of the file at *path*."""
+    return _extract_file_text(path, range(first, last))
+
+
+def page_count(source: Union[bytes, str]) -> int:
+    import pikepdf
+    with pikepdf.open(BytesIO(source) if isinstance(source, (bytes, bytearray)) else source) as pdf:
+        return len(pdf.pages)
+
+
+def page_ranges(pages: int, parts: int) -> list[tuple[int, int]]:
+    """*pages* split into at most *parts* contiguous, near-equal ranges."""
+    parts = max(1, min(parts, math.ceil(pages / EXTRACT_MIN_PAGES_PER_TASK)))
+    size, extra = divmod(pages, parts)
+    ranges, start = [], 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+async def extract_text_parallel(source: Union[bytes, str]) -> str:
+    """Text of *source* (PDF bytes or a file path), split across workers
+    by page range when it is long enough to be worth it."""
+    import workers
+    from uploads import UPLOAD_TMP_DIR
+
+    try:
+        pages = await asyncio.to_thread(page_count, source)
+    except Exception:
+        pages = 0   # let pdfminer report what is wrong with the file
+    if pages < max(2, EXTRACT_PARALLEL_MIN_PAGES) or workers.WORKER_PROCESSES < 2:
+        return await workers.run(extract_pdf_text, source)
+
+    path, tmp = source, None
+    if isinstance(source, (bytes, bytearray)):
+        # Workers map one file rather than each receiving a copy of the bytes
+        fd, tmp = tempfile.mkstemp(prefix="extract-", suffix=".pdf", dir=UPLOAD_TMP_DIR)
+        with os.fdopen(fd, "wb") as f:
+            f.write(source)
+        path = tmp
+    tasks = [
+        asyncio.ensure_future(workers.run(extract_page_range, path, first, last))
+        for first, last in page_ranges(pages, workers.WORKER_PROCESSES)
+    ]
+    try:
+        parts = await asyncio.gather(*tasks)
+    finally:
+        # One range failed (or we were cancelled): stop the others, and
+        # wait for them before their input file goes away
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if tmp:
+            os.unlink(tmp)
+    return "".join(parts)
@@ -0,0 +1,217 @@
+"""
+Bounded handling of uploaded PDFs.
+
+Starlette has already spooled every multipart file part: in memory up
+to 1 MiB, beyond that to an anonymous temporary file. Uploads up to
+``UPLOAD_SPOOL_THRESHOLD`` bytes are kept in memory. Larger ones are
+used where Starlette wrote them, through ``/proc/<pid>/fd/<n>``, which
+the worker processes can open too; pdfminer and pikepdf then map that
+file, so the service never writes a large upload twice nor holds a full
+``bytes`` copy of it. Without ``/proc`` the upload is copied to a named
+temporary file instead.
+
+Uploads above ``UPLOAD_MAX_BYTES`` are rejected with 413. Requests with
+a ``Content-Length`` are refused before the body is read
+(``reject_oversized_uploads``). Chunked requests, or requests without
+that header, are only checked after Starlette has parsed, and so
+spooled, the whole body.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from io import BytesIO
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from config import env_int
+
+UPLOAD_SPOOL_THRESHOLD = env_int("UPLOAD_SPOOL_THRESHOLD", 1024 * 1024)
+UPLOAD_MAX_BYTES = env_int("UPLOAD_MAX_BYTES", 25 * 1024 * 1024)
+UPLOAD_TMP_DIR = os.environ.get("UPLOAD_TMP_DIR") or None
+# /bundle takes several PDFs per request; this caps their total size
+BUNDLE_MAX_BYTES = env_int("BUNDLE_MAX_BYTES", 100 * 1024 * 1024)
+# Same for /detect-fields/batch
+DETECT_BATCH_MAX_BYTES = env_int("DETECT_BATCH_MAX_BYTES", 100 * 1024 * 1024)
+
+_CHUNK = 256 * 1024
+# Allowance for multipart boundaries and part headers in Content-Length
+_MULTIPART_SLACK = 64 * 1024
+
+# Endpoints whose request body is uploaded PDFs -> body size limit
+UPLOAD_PATHS = {
+    "/detect-fields": UPLOAD_MAX_BYTES,
+    "/detect-fields/stream": UPLOAD_MAX_BYTES,
+    "/detect-fields/batch": DETECT_BATCH_MAX_BYTES,
+    "/extract-text": UPLOAD_MAX_BYTES,
+    "/bundle": BUNDLE_MAX_BYTES,
+}
+
+
+def _too_large(limit: int = UPLOAD_MAX_BYTES) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Upload exceeds the {limit} byte limit",
+    )
+
+
+# ---------------------------------------------------------------------------
+# Spooled upload
+# ---------------------------------------------------------------------------
+
+class MappedFile(io.RawIOBase):
+    """Read-only file object over an ``mmap`` (pdfminer wants an ``IOBase``)."""
+
+    def __init__(self, mm: mmap.mmap):
+        super().__init__()
+        self._mm = mm
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        return self._mm.read(size if size is not None and size >= 0 else None)
+
+    def readinto(self, b) -> int:
+        data = self._mm.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, pos: int, whence: int = io.SEEK_SET) -> int:
+        self._mm.seek(pos, whence)
+        return self._mm.tell()
+
+    def tell(self) -> int:
+        return self._mm.tell()
+
+    def __len__(self) -> int:
+        return len(self._mm)
+
+
+class SpooledPdf:
+    """An uploaded PDF, held in memory when small and on disk otherwise."""
+
+    def __init__(self):
+        self.size = 0
+        self.sha256 = ""
+        self.path: Optional[str] = None
+        self._data: Optional[bytes] = None
+        self._owns_path = False   # a temporary file of ours, not Starlette's
+
+    @property
+    def on_disk(self) -> bool:
+        return self.path is not None
+
+    def open_pikepdf(self):
+        """Open the upload with pikepdf, memory-mapped if on disk."""
+        import pikepdf
+        if self.path is None:
+            return pikepdf.open(BytesIO(self._data or b""))
+        return pikepdf.open(self.path, access_mode=pikepdf.AccessMode.mmap)
+
+    def read_bytes(self) -> bytes:
+        """Materialize the whole upload — only for callers that need ``bytes``."""
+        if self.path is None:
+            return self._data or b""
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        if self.path is not None and self._owns_path:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        self.path = None
+        self._data = None
+
+
+def _fd_path(f) -> Optional[str]:
+    """A path other processes can open the on-disk file *f* by, if any."""
+    try:
+        path = f"/proc/{os.getpid()}/fd/{f.fileno()}"
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    return path if os.path.exists(path) else None
+
+
+async def read_upload(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> SpooledPdf:
+    """Hash *file* into a :class:`SpooledPdf`, enforcing *max_bytes*.
+
+    A large upload stays in Starlette's spool file, see the module
+    docstring; the :class:`SpooledPdf` is valid until *file* is closed.
+    """
+    src = file.file
+    size = src.seek(0, os.SEEK_END)
+    if size > max_bytes:
+        raise _too_large(max_bytes)
+    spooled = SpooledPdf()
+    spooled.size = size
+    if size > UPLOAD_SPOOL_THRESHOLD:
+        if not getattr(src, "_rolled", True):   # same check as UploadFile._in_memory
+            src.rollover()
+        spooled.path = _fd_path(src)
+
+    digest = hashlib.sha256()
+    buf = bytearray()
+    out = None
+    try:
+        await file.seek(0)
+        if size > UPLOAD_SPOOL_THRESHOLD and spooled.path is None:
+            fd, spooled.path = tempfile.mkstemp(prefix="upload-", suffix=".pdf", dir=UPLOAD_TMP_DIR)
+            spooled._owns_path = True
+            out = os.fdopen(fd, "wb")
+        while True:
+            chunk = await file.read(_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            if out is not None:
+                out.write(chunk)
+            elif spooled.path is None:
+                buf += chunk
+    except BaseException:
+        if out is not None:
+            out.close()
+        spooled.close()
+        raise
+    if out is not None:
+        out.close()
+    if spooled.path is None:
+        spooled._data = bytes(buf)
+    spooled.sha256 = digest.hexdigest()
+    return spooled
+
+
+@asynccontextmanager
+async def spooled_upload(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES):
+    """``async with spooled_upload(file) as pdf:`` — cleans up the spool on exit."""
+    spooled = await read_upload(file, max_bytes)
+    try:
+        yield spooled
+    finally:
+        spooled.close()
+
+
+# ---------------------------------------------------------------------------
+# Early rejection middleware
+# ---------------------------------------------------------------------------
+
+async def reject_oversized_uploads(request, call_next):
+    """Refuse oversized uploads from ``Content-Length`` before the body is read."""
+    limit = UPLOAD_PATHS.get(request.url.path) if request.method == "POST" else None
+    if limit is not None:
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > limit + _MULTIPART_SLACK:
+            exc = _too_large(limit)
+            return JSONResponse({"detail": exc.detail}, status_code=exc.status_code)
+    return await call_next(request)
@@ -0,0 +1,544 @@
+"""
+Process pool for CPU-bound work (WeasyPrint renders, PDF merges).
+
+Threads don't help WeasyPrint, which is mostly pure Python, so renders
+run in a pool of ``WORKER_PROCESSES`` processes. Each worker keeps its
+renderer state (font configuration, parsed stylesheets, fetched assets)
+warm between jobs, see ``html_render``.
+
+Workers are started with the ``spawn`` method so they never inherit the
+event loop or open sockets of the web process.
+
+Workers are recycled so their heaps don't creep: each one exits after
+``WORKER_MAX_TASKS`` jobs, and the whole pool is replaced when a worker
+grows beyond ``WORKER_MAX_RSS_MB`` (jobs already running on the old
+pool finish first). Both default to 0 = never.
+
+Jobs don't go to the pool in arrival order. Each one belongs to a
+request class, ``interactive`` (previews, field detection) or ``bulk``
+(group generation from ``generate-documents.ts``, batch endpoints), set
+from the ``X-Request-Class`` header or the endpoint default in
+``BULK_PATHS``. At most ``WORKER_PROCESSES`` jobs are handed to the pool
+at a time; the rest wait in one lane per class. A freed worker takes
+the next interactive job, so interactive work overtakes queued bulk
+work, but while both lanes wait every ``WORKER_INTERACTIVE_WEIGHT + 1``-th
+dispatch goes to bulk, and a bulk job that has waited
+``WORKER_BULK_MAX_WAIT_S`` goes next regardless.
+
+Cancelling a ``run`` (client gone, deadline passed, see ``cancellation``)
+drops a queued job before it reaches the pool. A job that is already
+running is stopped cooperatively: its id goes into a small shared
+table, and the job raises ``JobCancelled`` at its next ``checkpoint()``.
+Long jobs call that between their stages (WeasyPrint layout and PDF
+output, each content stream, merged file or pdfminer page), so only the
+worker running the job is affected, it unwinds at a point where its
+state is consistent, and it stays in the pool. Its slot is freed once
+the job has actually stopped.
+
+Large buffers (template and output PDFs, rendered HTML) are not pickled
+through the pool's pipe, which copies them four times on the way
+(pickle, pipe write, pipe read, unpickle) and holds up the arguments
+and results of every other job behind them. Every ``bytes``/``str``
+argument or result of at least ``WORKER_HANDOFF_MIN_BYTES``, also inside
+lists and tuples, is written once to a file in ``WORKER_HANDOFF_DIR``
+(``/dev/shm`` when there is one, so it stays in memory) and only a
+``Handoff`` with its path crosses the process boundary. This is not
+zero-copy: the receiver reads the file back into a buffer of its own,
+because the jobs and their callers work on ``bytes`` and ``str``. A
+handed-off ``bytes`` is copied twice (file write and read), a ``str``
+four times (its UTF-8 encoding and decoding too). The web process
+deletes the file as soon as the job is done, cancelled or failed;
+files left by a web process that died are removed when the next pool
+starts. If the file can't be created or written (tmpfs full) the buffer
+is pickled as before. ``stats()`` and the ``X-Worker-Bytes-Copied``
+response header report the bytes copied between processes.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import itertools
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Optional
+
+from config import env_float, env_int
+from memory import record_worker_peak, rss_bytes, start_tracing, traced_call
+
+WORKER_PROCESSES = max(1, env_int("WORKER_PROCESSES", os.cpu_count() or 1))
+WORKER_MAX_TASKS = env_int("WORKER_MAX_TASKS", 0)
+WORKER_MAX_RSS_MB = env_int("WORKER_MAX_RSS_MB", 0)
+WORKER_INTERACTIVE_WEIGHT = max(1, env_int("WORKER_INTERACTIVE_WEIGHT", 4))
+WORKER_BULK_MAX_WAIT_S = env_float("WORKER_BULK_MAX_WAIT_S", 10.0)
+WORKER_HANDOFF_MIN_BYTES = env_int("WORKER_HANDOFF_MIN_BYTES", 256 * 1024)   # 0 = always pickle
+WORKER_HANDOFF_DIR = os.environ.get("WORKER_HANDOFF_DIR") or (
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+)
+
+REQUEST_CLASSES = ("interactive", "bulk")
+
+# Endpoints whose jobs are bulk unless the caller says otherwise
+BULK_PATHS = {"/html-to-pdf/batch", "/bundle", "/detect-fields/batch"}
+
+_CANCEL_SLOTS = 64
+
+_pool: Optional[ProcessPoolExecutor] = None
+_recycled = 0
+_cancelled_ids = None      # shared ring of recently cancelled job ids
+_cancel_next = 0
+_job_ids = itertools.count(1)
+_cancelled_queued = 0
+_aborted_running = 0
+
+
+def pool() -> ProcessPoolExecutor:
+    global _pool, _cancelled_ids
+    if _pool is None:
+        _remove_stale_handoffs()
+        ctx = multiprocessing.get_context("spawn")
+        if _cancelled_ids is None:
+            _cancelled_ids = ctx.RawArray("q", _CANCEL_SLOTS)
+        _pool = ProcessPoolExecutor(
+            max_workers=WORKER_PROCESSES,
+            mp_context=ctx,
+            max_tasks_per_child=WORKER_MAX_TASKS or None,
+            initializer=_init_worker,
+            initargs=(_cancelled_ids,),
+        )
+    return _pool
+
+
+# ---------------------------------------------------------------------------
+# Worker side: cancellable jobs
+# ---------------------------------------------------------------------------
+
+class JobCancelled(Exception):
+    """Raised inside a worker when the job's request was cancelled."""
+
+
+_current_job = 0
+
+
+def _job_cancelled(job_id: int) -> bool:
+    return job_id in _cancelled_ids[:]
+
+
+def checkpoint():
+    """Raise ``JobCancelled`` if the job running in this worker was cancelled.
+
+    Call it between the stages of long work. Outside a worker job it
+    does nothing.
+    """
+    if _current_job and _job_cancelled(_current_job):
+        raise JobCancelled(f"job {_current_job} cancelled")
+
+
+def _init_worker(cancelled_ids):
+    global _cancelled_ids
+    _cancelled_ids = cancelled_ids
+    start_tracing()
+
+
+def _run_job(job_id: int, fn, *args):
+    global _current_job
+    _current_job = job_id
+    try:
+        checkpoint()
+        result, peak = traced_call(fn, *_unpack(args))
+    finally:
+        _current_job = 0
+    return _pack(result, [], owner=os.getppid()), peak
+
+
+def _abort(job_id: int):
+    """Ask the worker running *job_id* to stop at its next checkpoint."""
+    global _cancel_next, _aborted_running
+    _cancelled_ids[_cancel_next] = job_id
+    _cancel_next = (_cancel_next + 1) % _CANCEL_SLOTS
+    _aborted_running += 1
+
+
+# ---------------------------------------------------------------------------
+# Buffer handoff
+# ---------------------------------------------------------------------------
+
+_HANDOFF_PREFIX = "pdfsvc-handoff-"
+
+_copies = {"handed_off": 0, "handed_off_bytes": 0, "pickled_bytes": 0, "fallbacks": 0, "bytes_copied": 0}
+_request_copies: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_copies", default=None)
+
+
+class Handoff:
+    """A buffer parked in a file; what crosses the process boundary instead."""
+
+    __slots__ = ("path", "size", "text")
+
+    def __init__(self, path: str, size: int, text: bool):
+        self.path = path
+        self.size = size
+        self.text = text
+
+    def __getstate__(self):
+        return self.path, self.size, self.text
+
+    def __setstate__(self, state):
+        self.path, self.size, self.text = state
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        return data.decode() if self.text else data
+
+    @property
+    def copied(self) -> int:
+        """Bytes copied to hand this buffer over (see module docstring)."""
+        return (4 if self.text else 2) * self.size
+
+    def discard(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _stash(value, owner: int) -> Optional[Handoff]:
+    text = isinstance(value, str)
+    data = value.encode() if text else value
+    try:
+        fd, path = tempfile.mkstemp(prefix=f"{_HANDOFF_PREFIX}{owner}-", dir=WORKER_HANDOFF_DIR)
+    except OSError:
+        return None
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+    except OSError:
+        os.unlink(path)
+        return None
+    return Handoff(path, len(data), text)
+
+
+def _pack(value, handoffs: list[Handoff], owner: int):
+    """*value* with its large buffers replaced by handoffs (appended to *handoffs*)."""
+    if isinstance(value, (bytes, bytearray, str)):
+        if WORKER_HANDOFF_MIN_BYTES and len(value) >= WORKER_HANDOFF_MIN_BYTES:
+            handoff = _stash(value, owner)
+            if handoff is not None:
+                handoffs.append(handoff)
+                return handoff
+            _copies["fallbacks"] += 1
+        return value
+    if type(value) in (list, tuple):
+        return type(value)(_pack(item, handoffs, owner) for item in value)
+    return value
+
+
+def _unpack(value, handoffs: Optional[list[Handoff]] = None):
+    """*value* with handoffs loaded back; they are appended to *handoffs*."""
+    if isinstance(value, Handoff):
+        if handoffs is not None:
+            handoffs.append(value)
+        return value.load()
+    if type(value) in (list, tuple):
+        return type(value)(_unpack(item, handoffs) for item in value)
+    return value
+
+
+def _handoffs_in(value) -> list[Handoff]:
+    if isinstance(value, Handoff):
+        return [value]
+    if type(value) in (list, tuple):
+        return [h for item in value for h in _handoffs_in(item)]
+    return []
+
+
+def _inline_bytes(value) -> int:
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if type(value) in (list, tuple):
+        return sum(_inline_bytes(item) for item in value)
+    return 0
+
+
+def _count_copies(handoffs: list[Handoff], pickled: int):
+    copied = sum(h.copied for h in handoffs) + 4 * pickled
+    _copies["handed_off"] += len(handoffs)
+    _copies["handed_off_bytes"] += sum(h.size for h in handoffs)
+    _copies["pickled_bytes"] += pickled
+    _copies["bytes_copied"] += copied
+    request = _request_copies.get()
+    if request is not None:
+        request["bytes"] += copied
+
+
+def _remove_stale_handoffs():
+    """Delete handoff files whose web process no longer exists."""
+    try:
+        names = os.listdir(WORKER_HANDOFF_DIR)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(_HANDOFF_PREFIX):
+            continue
+        try:
+            pid = int(name[len(_HANDOFF_PREFIX):].split("-", 1)[0])
+            os.kill(pid, 0)
+        except ValueError:
+            continue
+        except ProcessLookupError:
+            try:
+                os.unlink(os.path.join(WORKER_HANDOFF_DIR, name))
+            except OSError:
+                pass
+        except PermissionError:
+            pass   # alive, another user's process
+
+
+def worker_rss() -> dict[int, int]:
+    """RSS in bytes of each live worker process, by pid."""
+    if _pool is None:
+        return {}
+    # ProcessPoolExecutor has no public accessor for its processes
+    return {pid: rss_bytes(pid) for pid in list(getattr(_pool, "_processes", None) or {})}
+
+
+def _recycle_if_bloated(executor: ProcessPoolExecutor):
+    global _pool, _recycled
+    if not WORKER_MAX_RSS_MB or _pool is not executor:
+        return
+    limit = WORKER_MAX_RSS_MB * 1024 * 1024
+    bloated = {pid: rss for pid, rss in worker_rss().items() if rss > limit}
+    if not bloated:
+        return
+    print(
+        f"[workers] replacing pool, workers over {WORKER_MAX_RSS_MB} MB: "
+        + ", ".join(f"{pid}={rss // (1024 * 1024)}MB" for pid, rss in bloated.items()),
+        file=sys.stderr, flush=True,
+    )
+    _pool = None
+    _recycled += 1
+    # New jobs go to a fresh pool right away; the old one is drained off
+    # the event loop.
+    threading.Thread(target=executor.shutdown, kwargs={"wait": True}, daemon=True).start()
+
+
+# ---------------------------------------------------------------------------
+# Priority lanes
+# ---------------------------------------------------------------------------
+
+_request_class: contextvars.ContextVar[str] = contextvars.ContextVar("request_class", default="interactive")
+
+
+class _Lane:
+    def __init__(self):
+        self.waiters: deque[tuple[asyncio.Future, float]] = deque()
+        self.dispatched = 0
+        self.max_wait_s = 0.0
+
+
+_lanes = {name: _Lane() for name in REQUEST_CLASSES}
+_busy = 0
+_interactive_streak = 0
+_aged = 0
+
+
+def request_class() -> str:
+    return _request_class.get()
+
+
+def set_request_class(name: str):
+    """Class for the jobs of the current request (or task)."""
+    if name not in REQUEST_CLASSES:
+        raise ValueError(f"request class must be one of {', '.join(REQUEST_CLASSES)}")
+    _request_class.set(name)
+
+
+async def request_class_middleware(request, call_next):
+    """Set the request class from ``X-Request-Class`` or the endpoint, and
+    report the bytes its jobs copied between processes."""
+    header = request.headers.get("x-request-class", "").strip().lower()
+    try:
+        set_request_class(header or ("bulk" if request.url.path in BULK_PATHS else "interactive"))
+    except ValueError as e:
+        from fastapi.responses import JSONResponse
+        return JSONResponse({"detail": str(e)}, status_code=400)
+    copies = {"bytes": 0}
+    _request_copies.set(copies)
+    response = await call_next(request)
+    if copies["bytes"]:
+        response.headers["X-Worker-Bytes-Copied"] = str(copies["bytes"])
+    return response
+
+
+def _prune(lane: _Lane) -> bool:
+    """Drop waiters cancelled at the head of *lane*; True if any are left."""
+    while lane.waiters and lane.waiters[0][0].done():
+        lane.waiters.popleft()
+    return bool(lane.waiters)
+
+
+def _next_lane() -> Optional[str]:
+    global _interactive_streak, _aged
+    # Cancelled waiters must not count towards the streak or the aging
+    for lane in _lanes.values():
+        _prune(lane)
+    interactive, bulk = _lanes["interactive"].waiters, _lanes["bulk"].waiters
+    if not bulk:
+        return "interactive" if interactive else None
+    if not interactive:
+        _interactive_streak = 0
+        return "bulk"
+    if time.monotonic() - bulk[0][1] >= WORKER_BULK_MAX_WAIT_S:
+        _aged += 1
+        _interactive_streak = 0
+        return "bulk"
+    if _interactive_streak >= WORKER_INTERACTIVE_WEIGHT:
+        _interactive_streak = 0
+        return "bulk"
+    _interactive_streak += 1
+    return "interactive"
+
+
+def _dispatch(name: str, enqueued: float):
+    global _busy
+    lane = _lanes[name]
+    lane.dispatched += 1
+    lane.max_wait_s = max(lane.max_wait_s, time.monotonic() - enqueued)
+    _busy += 1
+
+
+def _release():
+    global _busy
+    _busy -= 1
+    while _busy < WORKER_PROCESSES:
+        name = _next_lane()
+        if name is None:
+            return
+        fut, enqueued = _lanes[name].waiters.popleft()
+        _dispatch(name, enqueued)
+        fut.set_result(None)
+
+
+async def _acquire(name: str):
+    global _cancelled_queued
+    enqueued = time.monotonic()
+    if _busy < WORKER_PROCESSES and not any([_prune(lane) for lane in _lanes.values()]):
+        _dispatch(name, enqueued)
+        return
+    fut = asyncio.get_running_loop().create_future()
+    _lanes[name].waiters.append((fut, enqueued))
+    try:
+        await fut
+    except asyncio.CancelledError:
+        if fut.done() and not fut.cancelled():
+            _release()   # slot was granted just as we were cancelled
+        else:
+            _cancelled_queued += 1
+        raise
+
+
+async def run(fn, *args):
+    """Run ``fn(*args)`` in a worker process and await the result.
+
+    *fn* must be a module-level function so it can be pickled. The job
+    waits in the lane of the current request class for a free worker.
+    """
+    global _pool
+    await _acquire(request_class())
+    release = True
+    sent: list[Handoff] = []
+    try:
+        executor = pool()
+        loop = asyncio.get_running_loop()
+        job_id = next(_job_ids)
+        packed = _pack(args, sent, owner=os.getpid())
+        job = executor.submit(_run_job, job_id, fn, *packed)
+        try:
+            packed_result, peak = await asyncio.wrap_future(job)
+        except asyncio.CancelledError:
+            if not job.done():
+                # Running in a worker: ask it to stop, and keep its slot
+                # (and its input files) until it has actually stopped.
+                _abort(job_id)
+                release = False
+                job.add_done_callback(partial(_after_abort, loop, sent))
+                sent = []
+            elif not job.cancelled() and job.exception() is None:
+                for handoff in _handoffs_in(job.result()):
+                    handoff.discard()
+            raise
+        except BrokenProcessPool:
+            # A worker died (OOM kill, segfault in a C library): start a
+            # fresh pool for the next job instead of failing forever.
+            if _pool is executor:
+                _pool = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        record_worker_peak(peak)
+        received: list[Handoff] = []
+        try:
+            result = _unpack(packed_result, received)
+        finally:
+            for handoff in received:
+                handoff.discard()
+        _count_copies(sent + received, _inline_bytes(packed) + _inline_bytes(packed_result))
+    finally:
+        for handoff in sent:
+            handoff.discard()
+        if release:
+            _release()
+    _recycle_if_bloated(executor)
+    return result
+
+
+def _after_abort(loop, sent: list[Handoff], job):
+    """Done callback of a cancelled running job (runs in the pool's thread)."""
+    for handoff in sent:
+        handoff.discard()
+    if not job.cancelled() and job.exception() is None:
+        for handoff in _handoffs_in(job.result()):
+            handoff.discard()
+    if not loop.is_closed():
+        loop.call_soon_threadsafe(_release)
+
+
+def stats() -> dict:
+    return {
+        "processes": WORKER_PROCESSES,
+        "max_tasks_per_child": WORKER_MAX_TASKS,
+        "max_rss_mb": WORKER_MAX_RSS_MB,
+        "pools_recycled": _recycled,
+        "rss_bytes": worker_rss(),
+        "busy": _busy,
+        "lanes": {
+            name: {
+                "queued": sum(1 for fut, _ in lane.waiters if not fut.done()),
+                "dispatched": lane.dispatched,
+                "max_wait_s": round(lane.max_wait_s, 3),
+            }
+            for name, lane in _lanes.items()
+        },
+        "interactive_weight": WORKER_INTERACTIVE_WEIGHT,
+        "bulk_aged_dispatches": _aged,
+        "cancelled_queued": _cancelled_queued,
+        "aborted_running": _aborted_running,
+        "handoff": {
+            "dir": WORKER_HANDOFF_DIR,
+            "min_bytes": WORKER_HANDOFF_MIN_BYTES,
+            **_copies,
+        },
+    }
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
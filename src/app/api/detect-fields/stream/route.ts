@@ -0,0 +1,53 @@
+import { NextRequest, NextResponse } from "next/server";
+
+const PDF_SERVICE_URL = process.env.PDF_SERVICE_URL || "http://localhost:8000";
+const PDF_SERVICE_API_KEY = process.env.PDF_SERVICE_API_KEY || "";
+
+// Server-sent events from the PDF service are passed through unbuffered:
+// "field" per detected field, then "done" (or "error").
+export async function POST(request: NextRequest) {
+  try {
+    const formData = await request.formData();
+    const file = formData.get("file") as File | null;
+
+    if (!file) {
+      return NextResponse.json(
+        { status: "error", error: "No file uploaded" },
+        { status: 400 }
+      );
+    }
+
+    const proxyForm = new FormData();
+    proxyForm.append("file", file);
+
+    const resp = await fetch(`${PDF_SERVICE_URL}/detect-fields/stream`, {
+      method: "POST",
+      headers: {
+        ...(PDF_SERVICE_API_KEY ? { "x-api-key": PDF_SERVICE_API_KEY } : {}),
+      },
+      body: proxyForm,
+    });
+
+    if (!resp.ok || !resp.body) {
+      const text = await resp.text();
+      return NextResponse.json(
+        { status: "error", error: text || `PDF service returned ${resp.status}` },
+        { status: resp.status || 502 }
+      );
+    }
+
+    return new Response(resp.body, {
+      headers: {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+      },
+    });
+  } catch (error) {
+    console.error("detect-fields stream proxy error:", error);
+    return NextResponse.json(
+      { status: "error", error: String(error) },
+      { status: 500 }
+    );
+  }
+}
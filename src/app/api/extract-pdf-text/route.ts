@@ -29,6 +29,7 @@ export async function POST(req: NextRequest) {
       response = await fetch(`${PDF_SERVICE_URL}/extract-text`, {
         method: "POST",
         headers: {
+          "x-request-timeout-ms": "30000",
           ...(PDF_SERVICE_API_KEY ? { "x-api-key": PDF_SERVICE_API_KEY } : {}),
         },
         body: proxyForm,
@@ -50,6 +50,7 @@ export async function POST(req: NextRequest) {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
+          "x-request-timeout-ms": "30000",
           ...(PDF_SERVICE_API_KEY ? { "x-api-key": PDF_SERVICE_API_KEY } : {}),
         },
         body: JSON.stringify({ html: fullHtml }),
@@ -187,19 +187,51 @@ export function HotelForm({
       const formData = new FormData();
       formData.append("file", pdfFile);
 
-      const resp = await fetch("/api/detect-fields", {
+      const resp = await fetch("/api/detect-fields/stream", {
         method: "POST",
         body: formData,
       });
-      const result = await resp.json();
+      if (!resp.ok || !resp.body) {
+        const result = await resp.json().catch(() => ({}));
+        toast.error(result.error || "Detection failed");
+        return;
+      }
 
-      if (result.status === "success" && result.field_mapping) {
+      // Fill the mapping in as fields arrive instead of after the whole call
+      const detected: Record<string, string> = {};
+      let result: { status?: string; field_mapping?: Record<string, string>; error?: string } | null = null;
+      const reader = resp.body.pipeThrough(new TextDecoderStream()).getReader();
+      let buffer = "";
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value;
+        let boundary: number;
+        while ((boundary = buffer.indexOf("\n\n")) >= 0) {
+          const block = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          const event = /^event: (.*)$/m.exec(block)?.[1];
+          const data = /^data: (.*)$/m.exec(block)?.[1];
+          if (!event || !data) continue;
+          const payload = JSON.parse(data);
+          if (event === "field") {
+            detected[payload.name] = payload.value;
+            setFieldMapping({ ...detected });
+            setFieldMappingJson(JSON.stringify(detected, null, 2));
+            setConfigOpen(true);
+          } else {
+            result = payload;
+          }
+        }
+      }
+
+      if (result?.status === "success" && result.field_mapping) {
         setFieldMapping(result.field_mapping);
         setFieldMappingJson(JSON.stringify(result.field_mapping, null, 2));
         setConfigOpen(true);
         toast.success(`Detected ${Object.keys(result.field_mapping).length} fields`);
       } else {
-        toast.error(result.error || "Detection failed");
+        toast.error(result?.error || "Detection failed");
       }
     } catch (err) {
       console.error("Auto-detect error:", err);
@@ -3,6 +3,9 @@ import { fetchFxRates } from "@/lib/fx-rates";
 
 const PDF_SERVICE_URL = process.env.PDF_SERVICE_URL || "http://localhost:8000";
 const PDF_SERVICE_API_KEY = process.env.PDF_SERVICE_API_KEY || "";
+// When the PDF service has S3 credentials for the generated-docs bucket it
+// uploads the PDF itself and returns only the storage path.
+const PDF_SERVICE_DIRECT_UPLOAD = process.env.PDF_SERVICE_DIRECT_UPLOAD === "true";
 
 interface GenerateOptions {
   hotelId?: string;
@@ -322,6 +325,8 @@ async function generateBookingPdf(
         method: "POST",
         headers: {
           "Content-Type": "application/json",
+          "x-request-class": "bulk",
+          "x-request-timeout-ms": "30000",
           ...(PDF_SERVICE_API_KEY ? { "x-api-key": PDF_SERVICE_API_KEY } : {}),
         },
         body: JSON.stringify({
@@ -336,6 +341,7 @@ async function generateBookingPdf(
           refund_amount_tl: refundAmountTl,
           field_mapping: hotelConfig.field_mapping || {},
           cancel_days_before: Number(hotelConfig.cancel_days_before) || 3,
+          ...(PDF_SERVICE_DIRECT_UPLOAD ? { storage_path: `${app.id}/booking.pdf` } : {}),
         }),
         signal: pdfController.signal,
       });
@@ -353,19 +359,21 @@ async function generateBookingPdf(
       throw new Error(result.error || "PDF generation failed");
     }
 
-    // Decode base64 and upload
-    const pdfBuffer = Buffer.from(result.pdf_base64, "base64");
     const storagePath = `${app.id}/booking.pdf`;
 
-    const { error: uploadError } = await supabase.storage
-      .from("generated-docs")
-      .upload(storagePath, pdfBuffer, {
-        contentType: "application/pdf",
-        upsert: true,
-      });
-
-    if (uploadError) {
-      throw new Error(`Storage upload failed: ${uploadError.message}`);
+    // Decode base64 and upload, unless the service already stored it
+    if (!result.storage_path) {
+      const pdfBuffer = Buffer.from(result.pdf_base64, "base64");
+      const { error: uploadError } = await supabase.storage
+        .from("generated-docs")
+        .upload(storagePath, pdfBuffer, {
+          contentType: "application/pdf",
+          upsert: true,
+        });
+
+      if (uploadError) {
+        throw new Error(`Storage upload failed: ${uploadError.message}`);
+      }
     }
 
     // Update record
@@ -638,9 +646,16 @@ FORMATTING RULES:
         method: "POST",
         headers: {
           "Content-Type": "application/json",
+          "x-request-class": "bulk",
+          "x-request-timeout-ms": "30000",
           ...(PDF_SERVICE_API_KEY ? { "x-api-key": PDF_SERVICE_API_KEY } : {}),
         },
-        body: JSON.stringify({ html: fullHtml }),
+        body: JSON.stringify({
+          html: fullHtml,
+          ...(PDF_SERVICE_DIRECT_UPLOAD
+            ? { storage_path: `${app.id}/letter-of-intent.pdf` }
+            : {}),
+        }),
         signal: pdfController.signal,
       });
     } finally {
@@ -656,18 +671,20 @@ FORMATTING RULES:
       throw new Error(pdfResult.error || "PDF conversion failed");
     }
 
-    const pdfBuffer = Buffer.from(pdfResult.pdf_base64, "base64");
     const storagePath = `${app.id}/letter-of-intent.pdf`;
 
-    const { error: uploadError } = await supabase.storage
-      .from("generated-docs")
-      .upload(storagePath, pdfBuffer, {
-        contentType: "application/pdf",
-        upsert: true,
-      });
-
-    if (uploadError) {
-      throw new Error(`Storage upload failed: ${uploadError.message}`);
+    if (!pdfResult.storage_path) {
+      const pdfBuffer = Buffer.from(pdfResult.pdf_base64, "base64");
+      const { error: uploadError } = await supabase.storage
+        .from("generated-docs")
+        .upload(storagePath, pdfBuffer, {
+          contentType: "application/pdf",
+          upsert: true,
+        });
+
+      if (uploadError) {
+        throw new Error(`Storage upload failed: ${uploadError.message}`);
+      }
     }
 
     // Update record with content and PDF